@@ -0,0 +1,47 @@
+"""
+Cost of stdlib attributes accessed through the Logger wrapper,
+e.g. `logger.handlers` in a monitoring loop.
+
+Usage:
+    python benchmark/bench_getattr.py [--number N]
+"""
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nanolog as nl
+
+
+def legacy_getattr(wrapper, attr):
+    "Logger.__getattr__ before the delegation properties"
+    if attr in dir(wrapper):
+        return object.__getattribute__(wrapper, attr)
+    else:
+        return getattr(wrapper.logger, attr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+
+    logger = nl.Logger.create_logger('bench_getattr', stream=None)
+    raw_logger = logger.unwrap()
+    cases = [
+        ('legacy logger.handlers', lambda: legacy_getattr(logger, 'handlers')),
+        ('logger.handlers', lambda: logger.handlers),
+        ('logger.name', lambda: logger.name),
+        ('logger.getEffectiveLevel (fallback)',
+         lambda: logger.getEffectiveLevel),
+        ('raw logging.Logger.handlers', lambda: raw_logger.handlers),
+    ]
+    for name, func in cases:
+        number = args.number // 100 if name.startswith('legacy') else args.number
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<38s} {:10.1f} ns/call'.format(name, best / number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Cold-start cost of `import nanolog`, measured with `python -X importtime`
+in fresh interpreters. Exits with status 1 if the median exceeds --max-ms,
+so it can be used as a regression check.
+
+Usage:
+    python benchmark/bench_import_time.py [--runs N] [--max-ms MS]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    Returns:
+        dict of module name -> cumulative import time in microseconds
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail if the median import time exceeds this')
+    args = parser.parse_args()
+
+    import_times('nanolog')  # warm up the bytecode cache
+    runs = [import_times('nanolog') for _ in range(args.runs)]
+    median_ms = statistics.median(run['nanolog'] for run in runs) / 1000.
+    print('import nanolog: {:.1f} ms (median of {} runs)'
+          .format(median_ms, args.runs))
+    slowest = sorted(runs[-1].items(), key=lambda item: -item[1])[:10]
+    for name, micros in slowest:
+        print('  {:<30s} {:8.1f} ms'.format(name, micros / 1000.))
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print('FAILED: exceeds {:.1f} ms'.format(args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
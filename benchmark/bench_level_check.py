@@ -0,0 +1,92 @@
+"""
+Cost of a disabled level method call, e.g. `logger.debug3(...)` on an INFO logger.
+
+The "before" rows run a frozen copy of the code path this replaced: the
+eagerly generated methods of the old _MethodGenerator, which pass the level
+on to log()/pp(), whose is_enabled_for() converts it with get_level_number()
+and asks logging.Logger.isEnabledFor().
+
+Usage:
+    python benchmark/bench_level_check.py [--number N]
+"""
+import os
+import sys
+import argparse
+import timeit
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nanolog as nl
+from nanolog.logger import _NAME2LEVEL, _parse_level_name
+
+
+# ---------------- frozen copy of the old code path -----------------
+class _OldMethodGenerator(type):
+    def __init__(cls, _name, _bases, old_attrs):
+        super().__init__(_name, _bases, old_attrs)
+
+        def _create_new_method(old_method, level_number):
+            # avoid late binding
+            def _new_method(self, *_args, **_kwargs):
+                # fill in the first positional arg
+                return old_method(self, level_number, *_args, **_kwargs)
+            return _new_method
+
+        for level_name, level_number in _NAME2LEVEL.items():
+            lname, lnum = _parse_level_name(level_name)
+            for new_name, old_name in [(lname + lnum, 'log'),
+                                       (lname + 'pp' + lnum, 'pp')]:
+                setattr(cls, new_name,
+                        _create_new_method(old_attrs[old_name], level_number))
+            setattr(cls, level_name, level_number)
+
+
+class OldLogger(metaclass=_OldMethodGenerator):
+    def __init__(self, logger):
+        self.logger = logger
+
+    def is_enabled_for(self, level):
+        level = nl.get_level_number(level)
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, *msg, sep=' ',
+            exc_info=None, stack_info=False, extra=None):
+        if self.is_enabled_for(level):
+            raise AssertionError('only disabled calls are timed')
+
+    def pp(self, level, *msgs, sep=' ',
+           indent=nl.PP_DEFAULT, width=nl.PP_DEFAULT, depth=nl.PP_DEFAULT,
+           compact=nl.PP_DEFAULT,
+           exc_info=None, stack_info=False, extra=None):
+        if self.is_enabled_for(level):
+            raise AssertionError('only disabled calls are timed')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=1000000)
+    args = parser.parse_args()
+
+    logger = nl.Logger.create_logger('bench_level_check', level='info',
+                                     stream=None)
+    old_logger = OldLogger(logging.getLogger('bench_level_check'))
+
+    cases = [
+        ('before: debug3 (disabled)', lambda: old_logger.debug3('x', 1)),
+        ('after:  debug3 (disabled)', lambda: logger.debug3('x', 1)),
+        ('before: debugpp3 (disabled)', lambda: old_logger.debugpp3('x', 1)),
+        ('after:  debugpp3 (disabled)', lambda: logger.debugpp3('x', 1)),
+        ("before: log('DEBUG3') (disabled)",
+         lambda: old_logger.log('DEBUG3', 'x', 1)),
+        ("after:  log('DEBUG3') (disabled)",
+         lambda: logger.log('DEBUG3', 'x', 1)),
+        ('before: is_enabled_for(13)', lambda: old_logger.is_enabled_for(13)),
+        ('after:  is_enabled_for(13)', lambda: logger.is_enabled_for(13)),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        print('{:<36s} {:8.1f} ns/call'.format(name, best / args.number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
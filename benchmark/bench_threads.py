@@ -0,0 +1,72 @@
+"""
+Throughput of many threads logging at once through create_logger, to a
+file, with the default handlers, async_mode=True (one queue) and
+async_mode='thread' (per-thread buffers, ThreadBufferedHandler).
+
+Usage:
+    python benchmark/bench_threads.py [--records N] [--threads 1 4 16 64]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nanolog as nl
+
+
+MODES = [
+    ('default', False),
+    ('async_mode=True', True),
+    ("async_mode='thread'", 'thread'),
+]
+
+
+def run(mode, num_threads, records, file_name):
+    "Returns: records per second, including the final flush"
+    logger = nl.Logger.create_logger(
+        'bench_threads', stream=None, file_name=file_name, file_mode='w',
+        time_format='MDY HMS', show_level=True, async_mode=mode
+    )
+    per_thread = records // num_threads
+    start_gate = threading.Barrier(num_threads + 1)
+
+    def write():
+        start_gate.wait()
+        for i in range(per_thread):
+            logger.info('step', i, 'loss', 0.25)
+
+    threads = [threading.Thread(target=write) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    logger.flush()
+    elapsed = time.perf_counter() - start
+    logger.close()
+    return per_thread * num_threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=64000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name = os.path.join(tmp, 'bench.log')
+        print('{:>8s}'.format('threads')
+              + ''.join('{:>22s}'.format(name) for name, _ in MODES))
+        for num_threads in args.threads:
+            rates = [run(mode, num_threads, args.records, file_name)
+                     for _, mode in MODES]
+            print('{:>8d}'.format(num_threads)
+                  + ''.join('{:>15.0f} rec/s'.format(rate) for rate in rates))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,11 @@
 from .logger import *
 from .constants import *
-from .printing import *
\ No newline at end of file
+from .printing import *
+from .handlers import *
+from .formatters import *
+from .binary import (
+    BinaryFileHandler, BinaryDecoder, iter_binary_log, decode_binary_log
+)
+from .collector import SocketHandler, LogCollector, parse_address
+from .ringbuffer import RingBufferHandler, RingBufferReader
+from .spans import SpanRegistry, QuantileSketch, span_registry
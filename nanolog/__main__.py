@@ -0,0 +1,158 @@
+"""
+nanolog command line tools
+
+Usage:
+    python -m nanolog decode my_log.bin [--format jsonl]
+    python -m nanolog collect /tmp/log.sock [-o all.log] [--format jsonl]
+    python -m nanolog drain /dev/shm/worker*.ring [-o all.log] [--follow]
+"""
+
+import sys
+import time
+import argparse
+from .logger import Logger
+from .binary import decode_binary_log
+from .collector import LogCollector
+from .ringbuffer import RingBufferReader
+
+
+def _decode(args):
+    formatter = Logger._get_formatter(args.format, args.time_format,
+                                      show_level=not args.hide_level)
+    try:
+        for line in decode_binary_log(args.file_name, formatter):
+            print(line)
+    except BrokenPipeError:  # e.g. piped into `head`
+        sys.stderr.close()
+
+
+def _collect(args):
+    logger = Logger.create_logger(
+        'nanolog.collector',
+        level='trace',
+        file_name=args.output,
+        stream=None if args.quiet else 'stdout',
+        format=args.format,
+        time_format=args.time_format,
+        show_level=not args.hide_level
+    )
+    collector = LogCollector(args.address, logger,
+                             merge_window=args.merge_window)
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.close()
+
+
+def _drain(args):
+    logger = Logger.create_logger(
+        'nanolog.drain',
+        file_name=args.output,
+        stream=None if args.quiet else 'stdout',
+        format=args.format,
+        time_format=args.time_format,
+        show_level=not args.hide_level
+    )
+    readers = [RingBufferReader(name, readonly=args.snapshot)
+               for name in args.file_names]
+    try:
+        while True:
+            if args.snapshot:
+                records = [r for reader in readers for r in reader.snapshot()]
+            else:
+                records = [r for reader in readers for r in reader.drain()]
+            records.sort(key=lambda r: r.created)
+            for record in records:
+                logger.logger.handle(record)
+            if not args.follow:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.close()
+        for reader in readers:
+            if reader.lost:
+                print('{}: {} records lost'.format(reader.file_name, reader.lost),
+                      file=sys.stderr)
+            reader.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nanolog')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    decode_parser = subparsers.add_parser(
+        'decode', help='print a binary log written by add_binary_handler()'
+    )
+    decode_parser.add_argument('file_name')
+    decode_parser.add_argument(
+        '-f', '--format', default='{asctime} {name} {filename}:{lineno} ',
+        help='`{}` style format string, or "jsonl" for JSON-lines output'
+    )
+    decode_parser.add_argument('-t', '--time-format', default='YMD HMS',
+                               help='see nanolog.get_time_formatter')
+    decode_parser.add_argument('--hide-level', action='store_true',
+                               help='do not print "[levelname]> "')
+    decode_parser.set_defaults(func=_decode)
+
+    collect_parser = subparsers.add_parser(
+        'collect', help='write the records of add_socket_handler() clients'
+    )
+    collect_parser.add_argument(
+        'address', help='Unix socket path, port or "host:port" to listen on'
+    )
+    collect_parser.add_argument('-o', '--output', nargs='*', default=None,
+                                help='log files to append to')
+    collect_parser.add_argument('-q', '--quiet', action='store_true',
+                                help='do not print to stdout')
+    collect_parser.add_argument(
+        '-f', '--format', default='{asctime} {name} {process} ',
+        help='`{}` style format string, or "jsonl" for JSON-lines output'
+    )
+    collect_parser.add_argument('-t', '--time-format', default='YMD HMS',
+                                help='see nanolog.get_time_formatter')
+    collect_parser.add_argument('--hide-level', action='store_true',
+                                help='do not print "[levelname]> "')
+    collect_parser.add_argument(
+        '--merge-window', type=float, default=0.2,
+        help='seconds to hold records back to merge them in time order'
+    )
+    collect_parser.set_defaults(func=_collect)
+
+    drain_parser = subparsers.add_parser(
+        'drain', help='write the records of add_ring_buffer_handler() buffers'
+    )
+    drain_parser.add_argument('file_names', nargs='+')
+    drain_parser.add_argument('-o', '--output', nargs='*', default=None,
+                              help='log files to append to')
+    drain_parser.add_argument('-q', '--quiet', action='store_true',
+                              help='do not print to stdout')
+    drain_parser.add_argument(
+        '-f', '--format', default='{asctime} {name} {process} ',
+        help='`{}` style format string, or "jsonl" for JSON-lines output'
+    )
+    drain_parser.add_argument('-t', '--time-format', default='YMD HMS',
+                              help='see nanolog.get_time_formatter')
+    drain_parser.add_argument('--hide-level', action='store_true',
+                              help='do not print "[levelname]> "')
+    drain_parser.add_argument('--follow', action='store_true',
+                              help='keep draining until interrupted')
+    drain_parser.add_argument('--interval', type=float, default=0.05,
+                              help='seconds between drains with --follow')
+    drain_parser.add_argument(
+        '--snapshot', action='store_true',
+        help='print every record still in the buffers without consuming them,'
+             ' e.g. after a crash'
+    )
+    drain_parser.set_defaults(func=_drain)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
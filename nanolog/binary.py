@@ -0,0 +1,503 @@
+"""
+Compact binary log format, for logging at rates where even text formatting
+is too expensive. Messages are rendered only when the log is decoded.
+
+File layout: a sequence of sessions, one per time the file is opened
+(or per connection, for nanolog.SocketHandler). Each session starts with
+MAGIC followed by the writer's varint pid, then a stream of frames,
+each a varint length followed by the payload:
+
+- callsite frame: CALLSITE, varint id, logger name, pathname,
+  varint lineno, funcName. Written once, the first time a callsite logs.
+- record frame: RECORD, zigzag varint microseconds since the previous
+  record, varint level, varint callsite id, varint flags, message,
+  then exc_text and stack_info strings if flagged.
+
+Messages from Logger.log()/logfmt() whose arguments are all None, bool,
+int, float or str are stored unrendered, as the arguments plus a render
+id. Anything else is stored as the rendered string.
+"""
+
+import os
+import copy
+import struct
+import logging as _logging
+from .printing import printstr
+
+
+MAGIC = b'NLOG\x01'
+
+# frame types
+CALLSITE = 1
+RECORD = 2
+
+# record flags
+_HAS_EXC_TEXT = 1
+_HAS_STACK_INFO = 2
+
+# message kinds
+_LITERAL = 0
+_PRINTSTR = 1  # printstr(*args, sep=sep)
+_STR_FORMAT = 2  # str.format(fmt, *args, **kwargs)
+
+# value tags
+_NONE = 0
+_TRUE = 1
+_FALSE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+
+_DOUBLE = struct.Struct('<d')
+
+_EXC_FORMATTER = _logging.Formatter()
+
+
+# ---------------- primitives -----------------
+def write_varint(buf, n):
+    "Append unsigned int `n` to bytearray `buf` in LEB128 encoding"
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_varint(data, pos):
+    """
+    Returns:
+        (value, position after the varint)
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_zigzag(buf, n):
+    "Append signed int `n`, small magnitudes take few bytes"
+    write_varint(buf, n * 2 if n >= 0 else -n * 2 - 1)
+
+
+def read_zigzag(data, pos):
+    n, pos = read_varint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def write_str(buf, s):
+    encoded = s.encode('utf-8', 'surrogateescape')
+    write_varint(buf, len(encoded))
+    buf += encoded
+
+
+def read_str(data, pos):
+    length, pos = read_varint(data, pos)
+    end = pos + length
+    return bytes(data[pos:end]).decode('utf-8', 'surrogateescape'), end
+
+
+def is_primitive(value):
+    "Whether write_value() can store `value` exactly"
+    return value is None or type(value) in (bool, int, float, str)
+
+
+def write_value(buf, value):
+    "Append a None, bool, int, float or str with a type tag"
+    value_type = type(value)
+    if value is None:
+        buf.append(_NONE)
+    elif value_type is bool:
+        buf.append(_TRUE if value else _FALSE)
+    elif value_type is int:
+        buf.append(_INT)
+        write_zigzag(buf, value)
+    elif value_type is float:
+        buf.append(_FLOAT)
+        buf += _DOUBLE.pack(value)
+    elif value_type is str:
+        buf.append(_STR)
+        write_str(buf, value)
+    else:
+        raise TypeError('cannot encode {!r}'.format(value_type))
+
+
+def read_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    elif tag == _TRUE:
+        return True, pos
+    elif tag == _FALSE:
+        return False, pos
+    elif tag == _INT:
+        return read_zigzag(data, pos)
+    elif tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    elif tag == _STR:
+        return read_str(data, pos)
+    else:
+        raise ValueError('corrupted binary log: unknown value tag {}'.format(tag))
+
+
+# ---------------- messages -----------------
+def _is_deferred(msg):
+    "Whether `msg` is a DeferredMessage that write_message() stores exactly"
+    render = getattr(msg, 'render', None)
+    args = getattr(msg, 'args', None)
+    if render is None or args is None:
+        return False
+    kwargs = msg.kwargs
+    if render is printstr:
+        return (set(kwargs) <= {'sep'}
+                and all(map(is_primitive, args))
+                and is_primitive(kwargs.get('sep', ' ')))
+    return (render is str.format
+            and all(map(is_primitive, args))
+            and all(map(is_primitive, kwargs.values())))
+
+
+def freeze_record(record):
+    """
+    Copy of `record` that can be encoded later on another thread: the message
+    is rendered now unless it can be stored unrendered, and the exception
+    is formatted to exc_text.
+    """
+    record = copy.copy(record)
+    if record.args or not _is_deferred(record.msg):
+        record.msg = record.getMessage()
+        record.args = None
+    if record.exc_info:
+        if not record.exc_text:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        record.exc_info = None
+    return record
+
+
+def write_message(buf, msg):
+    """
+    Append a LogRecord.msg. nanolog.DeferredMessage from printstr or str.format
+    with primitive arguments is stored unrendered.
+    """
+    render = getattr(msg, 'render', None)
+    # DeferredMessage drops its args once rendered
+    args = getattr(msg, 'args', None)
+    if render is not None and args is not None:
+        kwargs = msg.kwargs
+        if (render is printstr and set(kwargs) <= {'sep'}
+                and is_primitive(kwargs.get('sep', ' '))):
+            # print() calls str() on every arg, so that's exact for any object
+            buf.append(_PRINTSTR)
+            write_value(buf, kwargs.get('sep', ' '))
+            write_varint(buf, len(args))
+            for arg in args:
+                write_value(buf, arg if is_primitive(arg) else str(arg))
+            return
+        if (render is str.format
+                and all(map(is_primitive, args))
+                and all(map(is_primitive, kwargs.values()))):
+            buf.append(_STR_FORMAT)
+            write_varint(buf, len(args))
+            for arg in args:
+                write_value(buf, arg)
+            write_varint(buf, len(kwargs))
+            for key, value in kwargs.items():
+                write_str(buf, key)
+                write_value(buf, value)
+            return
+    buf.append(_LITERAL)
+    write_str(buf, str(msg))
+
+
+def _format_fallback(args, kwargs):
+    "The format string followed by the reprs of its arguments"
+    parts = [str(args[0]) if args else '']
+    parts.extend(map(repr, args[1:]))
+    parts.extend('{}={!r}'.format(key, value) for key, value in kwargs.items())
+    return ' '.join(parts)
+
+
+def read_message(data, pos):
+    """
+    Returns:
+        (rendered message, position after the message)
+    """
+    kind = data[pos]
+    pos += 1
+    if kind == _LITERAL:
+        return read_str(data, pos)
+    elif kind == _PRINTSTR:
+        sep, pos = read_value(data, pos)
+        nargs, pos = read_varint(data, pos)
+        args = []
+        for _ in range(nargs):
+            arg, pos = read_value(data, pos)
+            args.append(arg)
+        return printstr(*args, sep=sep), pos
+    elif kind == _STR_FORMAT:
+        nargs, pos = read_varint(data, pos)
+        args = []
+        for _ in range(nargs):
+            arg, pos = read_value(data, pos)
+            args.append(arg)
+        nkwargs, pos = read_varint(data, pos)
+        kwargs = {}
+        for _ in range(nkwargs):
+            key, pos = read_str(data, pos)
+            kwargs[key], pos = read_value(data, pos)
+        try:
+            return str.format(*args, **kwargs), pos
+        except Exception:
+            # a bad format call in the logging code, stored unrendered
+            return _format_fallback(args, kwargs), pos
+    else:
+        raise ValueError('corrupted binary log: unknown message kind {}'.format(kind))
+
+
+# ---------------- writer -----------------
+class BinaryEncoder:
+    """
+    Encodes one session: `header()` starts it, then `encode()` every record.
+    Callsite ids and time deltas refer back to earlier records of the session.
+    """
+    def __init__(self):
+        self._callsites = {}
+        self._last_micros = 0
+
+    def header(self):
+        "Session header, resets the callsite table and the time base"
+        self._callsites = {}
+        self._last_micros = 0
+        header = bytearray(MAGIC)
+        write_varint(header, os.getpid())
+        return header
+
+    def encode(self, record, buf=None):
+        """
+        Append the record frame, preceded by a callsite frame if the callsite
+        is new to this session.
+
+        Returns:
+          `buf`, a new bytearray if None
+        """
+        if buf is None:
+            buf = bytearray()
+        key = (record.name, record.pathname, record.lineno, record.funcName)
+        callsite_id = self._callsites.get(key)
+        if callsite_id is None:
+            callsite_id = self._callsites[key] = len(self._callsites)
+            frame = bytearray([CALLSITE])
+            write_varint(frame, callsite_id)
+            write_str(frame, record.name)
+            write_str(frame, record.pathname)
+            write_varint(frame, record.lineno)
+            write_str(frame, record.funcName or '')
+            write_varint(buf, len(frame))
+            buf += frame
+
+        frame = bytearray([RECORD])
+        micros = int(record.created * 1e6)
+        write_zigzag(frame, micros - self._last_micros)
+        self._last_micros = micros
+        write_varint(frame, record.levelno)
+        write_varint(frame, callsite_id)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        flags = ((_HAS_EXC_TEXT if record.exc_text else 0)
+                 | (_HAS_STACK_INFO if record.stack_info else 0))
+        write_varint(frame, flags)
+        if record.args:
+            write_message(frame, record.getMessage())
+        else:
+            write_message(frame, record.msg)
+        if record.exc_text:
+            write_str(frame, record.exc_text)
+        if record.stack_info:
+            write_str(frame, record.stack_info)
+        write_varint(buf, len(frame))
+        buf += frame
+        return buf
+
+
+class BinaryFileHandler(_logging.FileHandler):
+    """
+    Writes records in the compact binary format described in this module.
+    Use `iter_binary_log()` or `python -m nanolog decode` to read it back.
+
+    Records are not flushed one by one, `flush()` or `close()` to persist.
+    In async_mode, messages are rendered before they are queued unless
+    `render_in_writer=True`, so the rendered string is what gets stored.
+    """
+    def __init__(self, filename, mode='a', delay=False):
+        """
+        Args:
+          filename: path of the binary log
+          mode: 'a' to append a new session or 'w' to overwrite
+        """
+        assert mode in ['a', 'w'], 'mode must be "a" or "w"'
+        super().__init__(filename, mode + 'b', delay=delay)
+
+    def uses_caller(self):
+        return True
+
+    def _open(self):
+        stream = super()._open()
+        self._encoder = BinaryEncoder()
+        stream.write(self._encoder.header())
+        return stream
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self._encoder.encode(record))
+        except Exception:
+            self.handleError(record)
+
+
+# ---------------- reader -----------------
+def _make_record(callsite, levelno, created, msg, session_start, pid):
+    name, pathname, lineno, func = callsite
+    record = _logging.LogRecord(name, levelno, pathname, lineno, msg, (), None,
+                                func=func)
+    record.created = created
+    record.msecs = (created - int(created)) * 1000
+    record.relativeCreated = (created - session_start) * 1000
+    record.process = pid
+    record.processName = record.thread = record.threadName = None
+    return record
+
+
+class BinaryDecoder:
+    """
+    Incremental reader: `feed()` bytes as they arrive, e.g. from a socket,
+    and get back every record completed so far. A frame split across
+    two feeds is kept until the rest of it arrives.
+    """
+    _UNKNOWN_CALLSITE = ('', '(unknown file)', 0, '(unknown function)')
+
+    def __init__(self, pid=None):
+        """
+        Args:
+          pid: writer's pid for frames that come without a session header
+        """
+        self._pending = b''
+        self._callsites = {}
+        self._micros = 0
+        self._session_start = None
+        self.pid = pid
+
+    def pending_bytes(self):
+        "Size of the incomplete frame waiting for more data"
+        return len(self._pending)
+
+    def feed(self, data):
+        """
+        Must be iterated to the end before the next feed()
+
+        Yields:
+          logging.LogRecord with rendered message
+        """
+        if self._pending:
+            data = self._pending + data
+        data = memoryview(data)
+        size = len(data)
+        pos = 0
+        while pos < size:
+            if data[pos] == MAGIC[0]:
+                # a frame of that length would continue with its type,
+                # which is never MAGIC[1], so wait for 2 bytes to tell
+                if size - pos < 2 or (data[pos + 1] == MAGIC[1]
+                                      and size - pos < len(MAGIC)):
+                    break
+            try:
+                if bytes(data[pos:pos + len(MAGIC)]) == MAGIC:
+                    # new session, reset the delta and callsite state
+                    self.pid, pos = read_varint(data, pos + len(MAGIC))
+                    self._callsites = {}
+                    self._micros = 0
+                    self._session_start = None
+                    continue
+                length, start = read_varint(data, pos)
+            except IndexError:  # varint cut off at the end of the data
+                break
+            end = start + length
+            if end > size:
+                break
+            try:
+                # a complete frame, reading past its end means corruption
+                record = self._read_frame(data[:end], start)
+            except IndexError:
+                raise ValueError('corrupted binary log: frame at byte {} '
+                                 'is shorter than its content'.format(pos))
+            pos = end
+            if record is not None:
+                yield record
+        self._pending = bytes(data[pos:])
+
+    def _read_frame(self, data, pos):
+        frame_type = data[pos]
+        if frame_type == CALLSITE:
+            callsite_id, p = read_varint(data, pos + 1)
+            name, p = read_str(data, p)
+            pathname, p = read_str(data, p)
+            lineno, p = read_varint(data, p)
+            func, p = read_str(data, p)
+            self._callsites[callsite_id] = (name, pathname, lineno, func)
+            return None
+        elif frame_type == RECORD:
+            delta, p = read_zigzag(data, pos + 1)
+            self._micros += delta
+            levelno, p = read_varint(data, p)
+            callsite_id, p = read_varint(data, p)
+            flags, p = read_varint(data, p)
+            msg, p = read_message(data, p)
+            created = self._micros / 1e6
+            if self._session_start is None:
+                self._session_start = created
+            record = _make_record(
+                self._callsites.get(callsite_id, self._UNKNOWN_CALLSITE),
+                levelno, created, msg, self._session_start, self.pid
+            )
+            if flags & _HAS_EXC_TEXT:
+                record.exc_text, p = read_str(data, p)
+            if flags & _HAS_STACK_INFO:
+                record.stack_info, p = read_str(data, p)
+            return record
+        else:
+            raise ValueError('corrupted binary log: unknown frame type {} '
+                             'at byte {}'.format(frame_type, pos))
+
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_binary_log(file_name):
+    """
+    Stream the records of a binary log back, one session after another.
+    A frame truncated by a crash in the middle of a write is skipped.
+
+    Args:
+      file_name: path written by BinaryFileHandler
+
+    Yields:
+      logging.LogRecord with rendered message
+    """
+    decoder = BinaryDecoder()
+    with open(os.path.expanduser(file_name), 'rb') as f:
+        # in chunks, memory stays flat however large the log is
+        for chunk in iter(lambda: f.read(_READ_CHUNK_SIZE), b''):
+            yield from decoder.feed(chunk)
+
+
+def decode_binary_log(file_name, formatter):
+    """
+    Yields:
+      every record of the binary log formatted by `formatter`
+    """
+    for record in iter_binary_log(file_name):
+        yield formatter.format(record)
@@ -0,0 +1,410 @@
+"""
+Multi-process logging: every worker process sends its records to one
+LogCollector over a Unix domain socket or TCP, and the collector writes them
+through its own file and stream handlers, merged in timestamp order.
+
+The wire format is the binary log format of nanolog.binary, one session
+per connection.
+
+Usage:
+    # collector process, or `python -m nanolog collect /tmp/log.sock -o all.log`
+    logger = Logger.create_logger('collector', file_name='all.log')
+    LogCollector('/tmp/log.sock', logger).serve_forever()
+
+    # each worker
+    logger = Logger.create_logger('worker3', stream=None)
+    logger.add_socket_handler('/tmp/log.sock')
+"""
+
+import os
+import sys
+import heapq
+import time
+import threading
+import traceback
+import collections
+import logging as _logging
+from .binary import BinaryEncoder, BinaryDecoder, freeze_record
+
+# socket and selectors are imported where needed, they add several ms to
+# `import nanolog` for processes that never log over a socket
+
+
+def parse_address(address):
+    """
+    Args:
+      address:
+      - (host, port) tuple or int port on localhost: TCP
+      - "host:port" or "port" string: TCP
+      - any other string: path of a Unix domain socket
+
+    Returns:
+      (socket family, address for bind/connect)
+    """
+    import socket
+    if isinstance(address, int):
+        return socket.AF_INET, ('localhost', address)
+    if isinstance(address, (tuple, list)):
+        return socket.AF_INET, tuple(address)
+    if address.isdigit():
+        return socket.AF_INET, ('localhost', int(address))
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, os.path.expanduser(address)
+
+
+class SocketHandler(_logging.Handler):
+    """
+    Client side: sends records to a LogCollector in batches, from a
+    background sender thread.
+
+    While the collector is unreachable, records wait in a local buffer of at
+    most `buffer_size` records, the oldest are dropped beyond that and
+    counted in `self.dropped`. The sender reconnects with exponential
+    backoff, from `reconnect_interval` up to `max_reconnect_interval`.
+
+    A batch that fails halfway is sent again after reconnecting, so a
+    broken connection may duplicate a few records but never loses the ones
+    still in the buffer.
+    """
+    def __init__(self, address,
+                 buffer_size=10000,
+                 batch_size=512,
+                 flush_interval=0.05,
+                 reconnect_interval=0.1,
+                 max_reconnect_interval=5.0,
+                 timeout=5.0):
+        """
+        Args:
+          address: see `parse_address()`
+          buffer_size: max number of records waiting to be sent
+          batch_size: max number of records per send
+          flush_interval: max seconds a record waits for its batch to fill
+          reconnect_interval: first delay before reconnecting
+          max_reconnect_interval: cap of the doubling reconnect delay
+          timeout: seconds to wait on connect/send, and on flush() or close()
+            while the collector is unreachable
+        """
+        super().__init__()
+        assert buffer_size > 0, 'buffer_size must be positive'
+        self.family, self.address = parse_address(address)
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.timeout = timeout
+        self.dropped = 0
+        self._sock = None
+        self._encoder = BinaryEncoder()
+        self._queue = collections.deque()
+        self._queue_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._queue_lock)
+        self._drained = threading.Condition(self._queue_lock)
+        self._enqueued = 0  # records accepted so far
+        self._done = 0  # records sent or dropped so far
+        self._flushing = 0  # number of threads waiting in flush()
+        self._closed = False
+        self._stopped = threading.Event()  # interrupts the reconnect delay
+        self._sender = threading.Thread(
+            target=self._send_loop, name='nanolog-socket-sender', daemon=True
+        )
+        self._sender.start()
+
+    def uses_caller(self):
+        return True
+
+    def handle(self, record):
+        # the queue has its own lock, no need to serialize on the handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            record = freeze_record(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._queue_lock:
+            if self._closed:
+                return
+            if len(self._queue) >= self.buffer_size:
+                self._queue.popleft()
+                self.dropped += 1
+                self._done += 1
+            self._queue.append(record)
+            self._enqueued += 1
+            # wake the sender for the first record, so that it starts the
+            # flush_interval countdown, and again once a batch is full
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._not_empty.notify()
+
+    def _connect(self):
+        import socket
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._encoder = BinaryEncoder()
+        return self._encoder.header()
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _next_batch(self):
+        "Wait until a batch is due. Returns an empty list once closed and empty"
+        with self._queue_lock:
+            while not self._queue and not self._closed:
+                self._not_empty.wait()
+            if (len(self._queue) < self.batch_size
+                    and not self._closed and not self._flushing):
+                # give the batch a chance to fill up
+                self._not_empty.wait(self.flush_interval)
+            n = min(len(self._queue), self.batch_size)
+            return [self._queue[i] for i in range(n)]
+
+    def _send_loop(self):
+        delay = self.reconnect_interval
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                self._disconnect()
+                return
+            try:
+                data = bytearray()
+                if self._sock is None:
+                    data += self._connect()
+                for record in batch:
+                    self._encoder.encode(record, data)
+                self._sock.sendall(data)
+            except OSError:
+                self._disconnect()
+                with self._queue_lock:
+                    if self._closed:
+                        # collector is gone, don't hold up close() forever
+                        self.dropped += len(self._queue)
+                        self._done += len(self._queue)
+                        self._queue.clear()
+                        self._drained.notify_all()
+                        return
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_interval)
+                continue
+            except Exception:
+                # the collector may have seen part of the session state
+                self._disconnect()
+                if _logging.raiseExceptions:
+                    sys.stderr.write('--- Logging error in SocketHandler ---\n')
+                    traceback.print_exc(file=sys.stderr)
+            delay = self.reconnect_interval
+            with self._queue_lock:
+                # emit() may have evicted part of the batch meanwhile
+                for record in batch:
+                    if self._queue and self._queue[0] is record:
+                        self._queue.popleft()
+                        self._done += 1
+                self._drained.notify_all()
+
+    def pending(self):
+        "Number of records accepted but not yet sent"
+        with self._queue_lock:
+            return self._enqueued - self._done
+
+    def flush(self):
+        """
+        Blocks until every record accepted before the call is sent,
+        or `timeout` seconds if the collector is unreachable
+        """
+        deadline = time.time() + self.timeout
+        with self._queue_lock:
+            target = self._enqueued
+            self._flushing += 1
+            self._not_empty.notify()
+            try:
+                while self._done < target and self._sender.is_alive():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._drained.wait(remaining)
+            finally:
+                self._flushing -= 1
+
+    def close(self):
+        with self._queue_lock:
+            self._closed = True
+            self._not_empty.notify_all()
+        self._stopped.set()
+        if self._sender is not threading.current_thread():
+            self._sender.join(self.timeout)
+        super().close()
+
+
+class LogCollector:
+    """
+    Server side: accepts SocketHandler connections and hands every received
+    record to `logger`'s handlers.
+
+    Records are held back for `merge_window` seconds and released in the
+    order of their creation time, so that records from different processes
+    interleave correctly in the output. A record that arrives later than
+    that is written right away.
+    """
+    def __init__(self, address, logger, merge_window=0.2):
+        """
+        Args:
+          address: see `parse_address()`, port 0 picks a free port,
+            the bound address is in `self.address`
+          logger: nanolog.Logger or logging.Logger whose handlers write
+            the collected records
+          merge_window: seconds to wait for earlier records from other
+            processes before writing a record
+        """
+        import socket
+        import selectors
+        self.family, address = parse_address(address)
+        # unwrap nanolog.Logger
+        self.logger = getattr(logger, 'logger', logger)
+        self.merge_window = merge_window
+        self.received = 0
+        self._heap = []
+        self._seq = 0
+        self._closed = False
+        self._thread = None
+        self._unix_path = None
+        if self.family == socket.AF_UNIX:
+            self._unix_path = address
+            if os.path.exists(address):
+                os.remove(address)  # stale socket of a previous collector
+        self._server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family != socket.AF_UNIX:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(128)
+        self._server.setblocking(False)
+        self.address = self._server.getsockname()
+        # wakes up the select() loop on close()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+    def start(self):
+        "Serve on a background thread"
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='nanolog-collector', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        try:
+            while not self._closed:
+                timeout = None
+                if self._heap:
+                    timeout = max(self._heap[0][0] + self.merge_window
+                                  - time.time(), 0)
+                for key, _ in self._selector.select(timeout):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif key.fileobj is not self._wakeup_recv:
+                        self._read(key.fileobj, key.data)
+                self._release(time.time() - self.merge_window)
+        finally:
+            self._shutdown()
+
+    def _accept(self):
+        "Returns False if there was no connection to accept"
+        try:
+            conn, _ = self._server.accept()
+        except OSError:
+            return False
+        import selectors
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, BinaryDecoder())
+        return True
+
+    def _read(self, conn, decoder):
+        try:
+            data = conn.recv(1 << 16)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._selector.unregister(conn)
+            conn.close()
+            return
+        try:
+            self._push(decoder, data)
+        except Exception:
+            # a corrupted stream can't be resynchronized, drop the connection
+            traceback.print_exc(file=sys.stderr)
+            self._selector.unregister(conn)
+            conn.close()
+
+    def _release(self, until):
+        "Write out the held records created before `until`"
+        heap = self._heap
+        while heap and heap[0][0] <= until:
+            self.logger.handle(heapq.heappop(heap)[2])
+
+    def _shutdown(self):
+        # clients that connected and finished before the close
+        while self._accept():
+            pass
+        for key in list(self._selector.get_map().values()):
+            if key.fileobj not in (self._server, self._wakeup_recv):
+                # pick up whatever the clients sent before the close
+                self._selector.unregister(key.fileobj)
+                self._drain(key.fileobj, key.data)
+                key.fileobj.close()
+        self._release(float('inf'))
+        self._selector.close()
+        self._server.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        if self._unix_path is not None:
+            try:
+                os.remove(self._unix_path)
+            except OSError:
+                pass
+        for handler in self.logger.handlers:
+            handler.flush()
+
+    def _drain(self, conn, decoder):
+        while True:
+            try:
+                data = conn.recv(1 << 16)
+            except OSError:
+                return
+            if not data:
+                return
+            self._push(decoder, data)
+
+    def _push(self, decoder, data):
+        for record in decoder.feed(data):
+            heapq.heappush(self._heap, (record.created, self._seq, record))
+            self._seq += 1
+            self.received += 1
+
+    def close(self):
+        "Stop serving, write out every record received so far"
+        self._closed = True
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
@@ -0,0 +1,256 @@
+"""
+Formatters for the records nanolog.Logger emits.
+"""
+
+import json
+import time
+import string
+import keyword
+import operator
+import logging as _logging
+
+
+# attributes every LogRecord has, anything else in record.__dict__
+# was passed through `extra=`
+_RECORD_ATTRS = frozenset(
+    _logging.LogRecord('', 0, '', 0, '', (), None).__dict__
+) | {'message', 'asctime'}
+
+# LogRecord attributes derived from the caller's frame
+CALLER_ATTRS = frozenset(['pathname', 'filename', 'lineno', 'funcName', 'module'])
+
+
+def _logfmt_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' ="\n'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class BoundContext:
+    """
+    Context fields of a bound logger (see `Logger.bind()`), rendered once at
+    bind time: `prefix` is the "key=value " text that CompiledFormatter puts
+    before the message, `json` the '"key": value' members that JsonFormatter
+    appends to its object. A record carries the whole context as a single
+    `context` attribute, so the cost per record doesn't depend on the number
+    of fields.
+
+    Values are rendered when bound, later changes to mutable values are not
+    reflected.
+    """
+    __slots__ = ('fields', 'prefix', 'json')
+
+    _encode = json.JSONEncoder(
+        ensure_ascii=False, check_circular=False, default=str
+    ).encode
+
+    def __init__(self, fields, parent=None):
+        """
+        Args:
+          fields: dict of new context fields
+          parent: BoundContext to extend, `fields` override its keys
+        """
+        if parent is not None:
+            merged = dict(parent.fields)
+            merged.update(fields)
+            if len(merged) < len(parent.fields) + len(fields):
+                # overridden keys must not appear twice, render from scratch
+                parent, fields = None, merged
+        prefix = ''.join('{}={} '.format(key, _logfmt_value(value))
+                         for key, value in fields.items())
+        members = ', '.join('{}: {}'.format(self._encode(str(key)),
+                                            self._encode(value))
+                            for key, value in fields.items())
+        if parent is None:
+            self.fields = dict(fields)
+        else:
+            # only the new fields are rendered, the parent's text is reused
+            prefix = parent.prefix + prefix
+            members = ', '.join(filter(None, (parent.json, members)))
+            self.fields = merged
+        self.prefix = prefix
+        self.json = members
+
+    def __str__(self):
+        return self.prefix.rstrip()
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def __repr__(self):
+        return '<BoundContext {}>'.format(self)
+
+
+class JsonFormatter(_logging.Formatter):
+    """
+    Formats every record as a single-line JSON object, i.e. JSON-lines output.
+
+    The object holds `fields` in order, followed by `exc_text` and
+    `stack_info` if present, and then every attribute passed via `extra=`
+    and the fields of a bound logger (see `Logger.bind()`).
+    Values that are not JSON serializable are converted with str().
+    """
+    def __init__(self, fields, datefmt=None):
+        """
+        Args:
+          fields: list of LogRecord attribute names,
+            e.g. ['asctime', 'levelname', 'message']
+          datefmt: time format string for the `asctime` field
+        """
+        super().__init__(datefmt=datefmt)
+        self.fields = tuple(fields)
+        assert self.fields, 'JsonFormatter needs at least one field'
+        self._uses_time = 'asctime' in self.fields
+        # compiled once per field set, attrgetter returns a tuple in order
+        getter = operator.attrgetter(*self.fields)
+        if len(self.fields) == 1:
+            self._get_values = lambda record: (getter(record),)
+        else:
+            self._get_values = getter
+        self._encode = json.JSONEncoder(
+            ensure_ascii=False, check_circular=False, default=str
+        ).encode
+
+    def uses_caller(self):
+        return not CALLER_ATTRS.isdisjoint(self.fields)
+
+    def format(self, record):
+        # skips logging.Formatter's usesTime() and formatMessage() path
+        record.message = record.getMessage()
+        if self._uses_time:
+            record.asctime = self.formatTime(record, self.datefmt)
+        obj = dict(zip(self.fields, self._get_values(record)))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            obj['exc_text'] = record.exc_text
+        if record.stack_info:
+            obj['stack_info'] = self.formatStack(record.stack_info)
+        context = None
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                if value.__class__ is BoundContext:
+                    context = value
+                    continue
+                obj[key] = value
+        text = self._encode(obj)
+        if context is not None and context.json:
+            # splice in the members serialized at bind time
+            text = text[:-1] + ', ' + context.json + '}'
+        return text
+
+
+class CompiledFormatter(_logging.Formatter):
+    """
+    logging.Formatter for `{}`-style format strings that compiles the format
+    once into an f-string render function, instead of running usesTime(),
+    building the record's __dict__ and calling str.format on every record.
+
+    Only the attributes the format references are read. `asctime` is
+    computed only if referenced, and its strftime() text is cached for the
+    current second, with `msecs` spliced in for the default time format.
+
+    The output is the same as logging.Formatter(fmt, datefmt, style='{'),
+    except that the fields of a bound logger (see `Logger.bind()`) are put
+    before the message as "key=value ..." text, unless the format places
+    them itself with `{context}`.
+    Formats with nested or indexed fields, e.g. `{name[0]}`, fall back to
+    the stdlib implementation.
+    """
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt, style='{')
+        self._render = self._compile(self._fmt)
+        self._uses_context = self._render is not None and any(
+            field == 'context' for _, field, _, _ in
+            string.Formatter().parse(self._fmt)
+        )
+        self._uses_time = self.usesTime()
+        self._time_cache = (None, None)  # (second, strftime text)
+
+    @staticmethod
+    def _compile(fmt):
+        """
+        Returns:
+          render(record, asctime, message) function, or None if the format
+          uses something the f-string translation doesn't support
+        """
+        pieces = []
+        try:
+            parsed = list(string.Formatter().parse(fmt))
+        except ValueError:
+            return None
+        for literal, field, spec, conversion in parsed:
+            literal = literal.replace('{', '{{').replace('}', '}}')
+            if literal:
+                pieces.append('f' + repr(literal))
+            if field is None:
+                continue
+            if (not field.isidentifier() or keyword.iskeyword(field)
+                    or '{' in spec or '\\' in spec or "'" in spec
+                    or '"' in spec):
+                return None
+            if field in ('asctime', 'message'):
+                expr = field
+            elif field == 'context':
+                # records from loggers that aren't bound have no context
+                expr = 'getattr(record, "context", "")'
+            else:
+                expr = 'record.' + field
+            if conversion:
+                expr += '!' + conversion
+            if spec:
+                expr += ':' + spec
+            pieces.append("f'{{{}}}'".format(expr))
+        source = 'def render(record, asctime, message):\n    return {}\n'.format(
+            ' '.join(pieces) or "''"
+        )
+        namespace = {}
+        exec(compile(source, '<nanolog format {!r}>'.format(fmt), 'exec'),
+             namespace)
+        return namespace['render']
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt != self.datefmt or self.converter is not time.localtime:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, text = self._time_cache
+        if second != cached_second:
+            text = time.strftime(datefmt or self.default_time_format,
+                                 time.localtime(second))
+            # a tuple, so that threads always see a matching pair
+            self._time_cache = (second, text)
+        if datefmt:
+            return text
+        if self.default_msec_format:
+            return self.default_msec_format % (text, record.msecs)
+        return text
+
+    def format(self, record):
+        render = self._render
+        if render is None:
+            return super().format(record)
+        message = record.message = record.getMessage()
+        if not self._uses_context:
+            context = record.__dict__.get('context')
+            if context.__class__ is BoundContext:
+                message = context.prefix + message
+        asctime = None
+        if self._uses_time:
+            asctime = record.asctime = self.formatTime(record, self.datefmt)
+        try:
+            s = render(record, asctime, message)
+        except AttributeError as e:
+            raise ValueError('Formatting field not found in record: {}'
+                             .format(e))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            if s[-1:] != '\n':
+                s = s + '\n'
+            s = s + record.exc_text
+        if record.stack_info:
+            if s[-1:] != '\n':
+                s = s + '\n'
+            s = s + self.formatStack(record.stack_info)
+        return s
@@ -0,0 +1,1039 @@
+"""
+Handlers that sit between nanolog.Logger and the actual output handlers.
+"""
+
+import os
+import re
+import sys
+import copy
+import time
+import shutil
+import weakref
+import threading
+import traceback
+import operator
+import collections
+import logging as _logging
+from .binary import BinaryEncoder, BinaryDecoder
+
+
+class ProxyHandler(_logging.Handler):
+    """
+    Forwards records to a list of target handlers.
+    Every target still applies its own level and filters.
+
+    `container` tells nanolog.Logger whether output handlers added later
+    become targets of this proxy, as for the async queue, or whether the
+    proxy only wraps the targets it was created with.
+    """
+    container = True
+
+    def __init__(self, targets=None, level=_logging.NOTSET):
+        """
+        Args:
+          targets: list of logging.Handler that actually write the records
+          level: records below this level are not forwarded at all
+        """
+        super().__init__(level)
+        self.targets = list(targets or [])
+
+    def add_target(self, handler):
+        self.targets.append(handler)
+
+    def remove_target(self, handler):
+        if handler in self.targets:
+            self.targets.remove(handler)
+
+    def accepts(self, record):
+        "Whether any of the targets' levels permits the record"
+        for target in self.targets:
+            if record.levelno >= target.level:
+                return True
+        return False
+
+    def dispatch(self, record):
+        "Hand the record to every target whose level permits it"
+        for target in self.targets:
+            if record.levelno >= target.level:
+                target.handle(record)
+
+    def emit(self, record):
+        self.dispatch(record)
+
+    def flush(self):
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        for target in self.targets:
+            target.close()
+        super().close()
+
+
+class QueuedHandler(ProxyHandler):
+    """
+    Hands records over to a background writer thread, so that the logging
+    call never waits on disk or terminal I/O.
+
+    The queue is bounded by `queue_size`. When it is full, `overflow` decides:
+      - 'block': the caller waits until the writer catches up
+      - 'drop_oldest': the oldest queued record is discarded
+      - 'drop_newest': the incoming record is discarded
+    Discarded records are counted in `self.dropped`.
+
+    Messages are rendered on the calling thread before they are queued,
+    so later mutations of the logged objects don't show up in the output.
+    With `render_in_writer=True` the rendering moves to the writer thread as
+    well, provided the logged objects are not modified afterwards.
+
+    `flush()` blocks until every record queued before the call is written.
+    `close()` drains the queue and stops the writer. logging.shutdown() calls
+    both at interpreter exit.
+    """
+    OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, targets=None, queue_size=10000, overflow='block',
+                 render_in_writer=False):
+        """
+        Args:
+          targets: list of logging.Handler that actually write the records
+          queue_size: max number of records waiting for the writer thread
+          overflow: 'block', 'drop_oldest' or 'drop_newest'
+          render_in_writer: True to render messages on the writer thread
+        """
+        super().__init__(targets)
+        assert queue_size > 0, 'queue_size must be positive'
+        assert overflow in self.OVERFLOW_POLICIES, \
+            'overflow must be one of {}'.format(self.OVERFLOW_POLICIES)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.render_in_writer = render_in_writer
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._queue_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._queue_lock)
+        self._not_full = threading.Condition(self._queue_lock)
+        self._drained = threading.Condition(self._queue_lock)
+        self._enqueued = 0  # records accepted so far
+        self._done = 0  # records written out or evicted so far
+        self._closed = False
+        self._writer = threading.Thread(
+            target=self._write_loop, name='nanolog-writer', daemon=True
+        )
+        self._writer.start()
+
+    def handle(self, record):
+        # the queue has its own lock, no need to serialize on the handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        if not self.render_in_writer and self.accepts(record):
+            try:
+                record.getMessage()
+            except Exception:
+                self.handleError(record)
+                return
+        with self._queue_lock:
+            if not self._closed:
+                if len(self._queue) >= self.queue_size:
+                    if self.overflow == 'drop_newest':
+                        self.dropped += 1
+                        return
+                    elif self.overflow == 'drop_oldest':
+                        self._queue.popleft()
+                        self.dropped += 1
+                        self._done += 1
+                    else:
+                        while (len(self._queue) >= self.queue_size
+                               and not self._closed):
+                            self._not_full.wait()
+                if not self._closed:
+                    self._queue.append(record)
+                    self._enqueued += 1
+                    self._not_empty.notify()
+                    return
+        # writer thread is gone, e.g. records logged during interpreter exit
+        self.dispatch(record)
+
+    def _write_loop(self):
+        while True:
+            with self._queue_lock:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:  # closed and fully drained
+                    return
+                batch, self._queue = self._queue, collections.deque()
+                self._not_full.notify_all()
+            for record in batch:
+                self.dispatch(record)
+            with self._queue_lock:
+                self._done += len(batch)
+                self._drained.notify_all()
+
+    def pending(self):
+        "Number of records accepted but not yet written out"
+        with self._queue_lock:
+            return self._enqueued - self._done
+
+    def flush(self):
+        with self._queue_lock:
+            target = self._enqueued
+            while self._done < target and self._writer.is_alive():
+                self._drained.wait()
+        super().flush()
+
+    def close(self):
+        with self._queue_lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        super().close()
+
+
+_created = operator.attrgetter('created')
+
+
+class ThreadBufferedHandler(ProxyHandler):
+    """
+    Each logging thread appends its records to a buffer of its own, without
+    taking any lock, and a single flusher thread merges the buffers in
+    timestamp order and hands the records to the targets. Only the flusher
+    ever holds the targets' locks, so threads don't contend on them.
+
+    Messages are rendered on the logging thread, as in QueuedHandler.
+    A buffer that reaches `buffer_size` records, or a record at or above
+    `flush_level`, wakes the flusher up early; otherwise it runs every
+    `flush_interval` seconds. Records of different threads that fall into
+    different flush rounds can come out of timestamp order.
+
+    `flush()` writes out every record buffered before the call.
+    """
+    def __init__(self, targets=None, flush_interval=0.05, buffer_size=1000,
+                 flush_level=_logging.ERROR):
+        """
+        Args:
+          targets: list of logging.Handler that actually write the records
+          flush_interval: max seconds a record waits in its thread's buffer
+          buffer_size: number of records in one buffer that wakes the flusher
+          flush_level: records at or above this level wake the flusher
+        """
+        super().__init__(targets)
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.flush_level = flush_level
+        self._local = threading.local()
+        # (thread, its deque), appended under _buffers_lock only
+        self._buffers = []
+        self._buffers_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name='nanolog-thread-flusher', daemon=True
+        )
+        self._flusher.start()
+
+    def handle(self, record):
+        # no handler lock, that is the point
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def _buffer(self):
+        try:
+            return self._local.records
+        except AttributeError:
+            # deque append and popleft are atomic, the flusher can drain
+            # the buffer while this thread keeps appending
+            records = self._local.records = collections.deque()
+            with self._buffers_lock:
+                self._buffers.append((threading.current_thread(), records))
+            return records
+
+    def emit(self, record):
+        if self._closed:
+            self.dispatch(record)
+            return
+        try:
+            record.getMessage()
+        except Exception:
+            self.handleError(record)
+            return
+        records = self._buffer()
+        records.append(record)
+        if (len(records) >= self.buffer_size
+                or record.levelno >= self.flush_level):
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+
+    def _drain(self):
+        "Write out everything buffered so far, in timestamp order"
+        with self._drain_lock:
+            with self._buffers_lock:
+                buffers = list(self._buffers)
+            batches = []
+            finished = []
+            for thread, records in buffers:
+                batch = [records.popleft() for _ in range(len(records))]
+                if batch:
+                    batches.append(batch)
+                elif not thread.is_alive():
+                    finished.append(records)
+            if finished:
+                with self._buffers_lock:
+                    self._buffers = [entry for entry in self._buffers
+                                     if entry[1] not in finished]
+            if not batches:
+                return
+            merged = batches[0]
+            if len(batches) > 1:
+                for batch in batches[1:]:
+                    merged.extend(batch)
+                # stable, and fast on the already sorted runs
+                merged.sort(key=_created)
+            for target in self.targets:
+                handle_batch = getattr(target, 'handle_batch', None)
+                if handle_batch is not None:
+                    handle_batch(merged)
+                    continue
+                for record in merged:
+                    if record.levelno >= target.level:
+                        target.handle(record)
+
+    def flush(self):
+        self._drain()
+        super().flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self._drain()
+        super().close()
+
+
+class DedupHandler(ProxyHandler):
+    """
+    Collapses repeats of the same record, i.e. same level, callsite and
+    rendered message, into one "last message repeated N times" record.
+
+    With `window=None`, only consecutive repeats are collapsed, and the
+    summary is written when a different record arrives. With `window` in
+    seconds, every repeat within `window` seconds of a record's first
+    occurrence is collapsed, and the summary is written with the first record
+    after the window ends. `flush()` and `close()` write out pending summaries.
+    """
+    container = False
+
+    def __init__(self, targets=None, window=None, max_keys=1000):
+        """
+        Args:
+          targets: list of logging.Handler that actually write the records
+          window: seconds, None to collapse consecutive repeats only
+          max_keys: max number of distinct records tracked with `window`
+        """
+        super().__init__(targets)
+        self.window = window
+        self.max_keys = max_keys
+        # key -> [first seen time, number of repeats, last repeated record]
+        # in order of first occurrence
+        self._seen = collections.OrderedDict()
+
+    @staticmethod
+    def _key(record):
+        return (record.levelno, record.pathname, record.lineno,
+                record.getMessage())
+
+    def emit(self, record):
+        try:
+            key = self._key(record)
+        except Exception:
+            self.handleError(record)
+            return
+        seen = self._seen
+        if self.window is None:
+            entry = seen.get(key)
+            if entry is None:
+                self._write_summaries()
+                seen[key] = [record.created, 0, None]
+                self.dispatch(record)
+            else:
+                entry[1] += 1
+                entry[2] = record
+            return
+        expired = record.created - self.window
+        while seen:
+            first_key = next(iter(seen))
+            if seen[first_key][0] > expired and len(seen) < self.max_keys:
+                break
+            self._write_summary(seen.pop(first_key))
+        entry = seen.get(key)
+        if entry is None:
+            seen[key] = [record.created, 0, None]
+            self.dispatch(record)
+        else:
+            entry[1] += 1
+            entry[2] = record
+
+    def _write_summary(self, entry):
+        _, repeats, last = entry
+        if not repeats:
+            return
+        summary = copy.copy(last)
+        summary.msg = 'last message repeated {} time{}'.format(
+            repeats, 's' if repeats > 1 else ''
+        )
+        summary.args = ()
+        summary.exc_info = summary.exc_text = summary.stack_info = None
+        self.dispatch(summary)
+
+    def _write_summaries(self):
+        "Must hold the handler lock"
+        while self._seen:
+            self._write_summary(self._seen.popitem(last=False)[1])
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._write_summaries()
+        finally:
+            self.release()
+        super().flush()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class FlightRecorderHandler(ProxyHandler):
+    """
+    Keeps the most recent records in memory without formatting them, and
+    writes them out only when something goes wrong.
+
+    - records at or above `pass_level` go to the targets right away
+    - every record is also appended to a ring of the last `capacity` records,
+      or of the last `max_bytes` of binary encoded records if given
+    - a record at or above `trigger_level`, or one with exc_info, dumps the
+      ring to the targets: the records they haven't seen yet, oldest first,
+      between two marker records. `dump()` does the same on demand.
+
+    The ring holds references, so a logged object that is modified later
+    shows its new value in the dump. The `max_bytes` ring stores
+    messages with primitive arguments as is and renders everything else,
+    in exchange for a fixed memory footprint.
+    """
+    def __init__(self, targets=None, capacity=10000, max_bytes=None,
+                 pass_level=_logging.INFO, trigger_level=_logging.ERROR):
+        """
+        Args:
+          targets: list of logging.Handler that actually write the records
+          capacity: number of records to keep, ignored if max_bytes is set
+          max_bytes: size of the binary encoded records to keep
+          pass_level: records at or above it are written out immediately,
+            None to write out dumps only
+          trigger_level: records at or above it dump the ring
+        """
+        super().__init__(targets)
+        assert capacity > 0, 'capacity must be positive'
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.pass_level = float('inf') if pass_level is None else pass_level
+        self.trigger_level = trigger_level
+        if max_bytes:
+            self._frames = collections.deque()
+            self._frame_bytes = 0
+        else:
+            self._ring = [None] * capacity
+            self._next = 0  # ring index of the next record
+        self._size = 0  # number of records in the ring
+
+    def _record(self, record):
+        if self.max_bytes:
+            frame = bytes(BinaryEncoder().encode(record))
+            self._frames.append(frame)
+            self._frame_bytes += len(frame)
+            self._size += 1
+            while self._frame_bytes > self.max_bytes:
+                self._frame_bytes -= len(self._frames.popleft())
+                self._size -= 1
+        else:
+            self._ring[self._next] = record
+            self._next = (self._next + 1) % self.capacity
+            if self._size < self.capacity:
+                self._size += 1
+
+    def records(self):
+        "Records in the ring, oldest first"
+        if self.max_bytes:
+            decoder = BinaryDecoder(pid=os.getpid())
+            return [r for frame in self._frames for r in decoder.feed(frame)]
+        start = (self._next - self._size) % self.capacity
+        return [self._ring[(start + i) % self.capacity]
+                for i in range(self._size)]
+
+    def _clear(self):
+        if self.max_bytes:
+            self._frames.clear()
+            self._frame_bytes = 0
+        else:
+            self._ring = [None] * self.capacity
+            self._next = 0
+        self._size = 0
+
+    def emit(self, record):
+        if record.levelno >= self.trigger_level or record.exc_info:
+            self._dump(record)
+            self.dispatch(record)
+        elif record.levelno >= self.pass_level:
+            self.dispatch(record)
+        else:
+            try:
+                self._record(record)
+            except Exception:
+                self.handleError(record)
+
+    def _dump(self, trigger):
+        "Must hold the handler lock"
+        if not self._size:
+            return
+        records = self.records()
+        self._clear()
+        self.dispatch(self._marker(
+            trigger, 'flight recorder: last {} records'.format(len(records))
+        ))
+        for record in records:
+            self.dispatch(record)
+        self.dispatch(self._marker(trigger, 'flight recorder: end'))
+
+    def _marker(self, trigger, msg):
+        return _logging.LogRecord(
+            trigger.name, trigger.levelno, trigger.pathname, trigger.lineno,
+            '----- {} -----'.format(msg), (), None, trigger.funcName
+        )
+
+    def dump(self, record=None):
+        """
+        Write out the recorded records now.
+
+        Args:
+          record: the marker records copy its logger name, level and
+            location, defaults to this call's location at `trigger_level`
+        """
+        if record is None:
+            frame = sys._getframe(1)
+            record = _logging.LogRecord(
+                'nanolog', self.trigger_level, frame.f_code.co_filename,
+                frame.f_lineno, '', (), None, frame.f_code.co_name
+            )
+        self.acquire()
+        try:
+            self._dump(record)
+        finally:
+            self.release()
+
+
+# stands in for a streamed message while the rest of the record is formatted
+_STREAM_MARK = '\x00nanolog-streamed-message\x00'
+
+
+class StreamingMixin:
+    """
+    Writes messages that render in chunks, i.e. have an `iter_chunks()`
+    method like those of `Logger.pp(..., streaming=True)`, piece by piece to
+    the stream, so that the full message is never held in memory.
+
+    The rest of the record is formatted around a placeholder. If the
+    formatter doesn't copy the message verbatim, e.g. JSON escapes it, the
+    message is rendered in full as usual.
+
+    Also writes whole batches of records at once, see `handle_batch()`.
+    """
+    def _streamed_parts(self, record):
+        """
+        Returns:
+          (text before the message, iterator of message chunks, text after
+          the message), or None if the record must be formatted as a whole
+        """
+        msg = record.msg
+        iter_chunks = getattr(msg, 'iter_chunks', None)
+        if iter_chunks is None or record.args or msg.is_rendered():
+            return None
+        record.msg = _STREAM_MARK
+        try:
+            text = self.format(record)
+        finally:
+            record.msg = msg
+            record.__dict__.pop('message', None)
+        prefix, mark, suffix = text.partition(_STREAM_MARK)
+        if not mark or _STREAM_MARK in suffix:
+            return None
+        return prefix, iter_chunks(), suffix + self.terminator
+
+    def _write_streamed(self, stream, parts):
+        "Returns: number of characters written"
+        prefix, chunks, suffix = parts
+        stream.write(prefix)
+        size = len(prefix) + len(suffix)
+        for chunk in chunks:
+            stream.write(chunk)
+            size += len(chunk)
+        stream.write(suffix)
+        stream.flush()
+        return size
+
+    def _emit_streamed(self, record):
+        "Returns: False if the record has to go through the normal emit()"
+        try:
+            parts = self._streamed_parts(record)
+            if parts is None:
+                return False
+            if self.stream is None:
+                self.stream = self._open()
+            self._write_streamed(self.stream, parts)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+        return True
+
+    def handle_batch(self, records):
+        """
+        handle() for a list of records at once: one lock acquisition, one
+        write and one flush. Used by ThreadBufferedHandler.
+        """
+        self.acquire()
+        try:
+            texts = []
+            for record in records:
+                if record.levelno < self.level or not self.filter(record):
+                    continue
+                if getattr(record.msg, 'iter_chunks', None) is not None:
+                    self._write_texts(texts, record)
+                    texts = []
+                    self.emit(record)
+                    continue
+                try:
+                    texts.append(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            if texts:
+                self._write_texts(texts, records[-1])
+        finally:
+            self.release()
+
+    def _write_texts(self, texts, record):
+        if not texts:
+            return
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(''.join(texts))
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class StreamHandler(StreamingMixin, _logging.StreamHandler):
+    "logging.StreamHandler that writes streamed messages in chunks"
+    def emit(self, record):
+        if not self._emit_streamed(record):
+            super().emit(record)
+
+
+class _SharedFile:
+    "An open file and its lock, shared by the FileHandlers of one path"
+    __slots__ = ('stream', 'lock', 'users', '__weakref__')
+
+    def __init__(self):
+        self.stream = None
+        self.lock = threading.RLock()
+        self.users = 0  # handlers that currently have the stream open
+
+
+# absolute path -> _SharedFile, an entry lives as long as a handler holds it
+_shared_files = weakref.WeakValueDictionary()
+_shared_files_lock = threading.Lock()
+
+
+def _shared_file(path):
+    with _shared_files_lock:
+        shared = _shared_files.get(path)
+        if shared is None:
+            shared = _shared_files[path] = _SharedFile()
+        return shared
+
+
+class FileHandler(StreamingMixin, _logging.FileHandler):
+    """
+    logging.FileHandler that writes streamed messages in chunks.
+
+    All FileHandlers of the same path, e.g. attached to a dozen loggers,
+    share one open file and one lock, so the records of different loggers
+    never interleave and only one descriptor is used. A handler with mode
+    'w' truncates the file when it opens it, also if other handlers
+    already have it open. The file is closed along with the last handler.
+    """
+    share_file = True
+
+    def createLock(self):
+        super().createLock()  # also registers the handler for os.fork()
+        if self.share_file:
+            self._shared = _shared_file(self.baseFilename)
+            self.lock = self._shared.lock
+
+    def _open(self):
+        if not self.share_file:
+            return super()._open()
+        # logging.FileHandler opens the file before it creates the lock
+        shared = self._shared = _shared_file(self.baseFilename)
+        with shared.lock:
+            if shared.stream is None:
+                shared.stream = super()._open()
+            elif self.mode == 'w':
+                shared.stream.flush()
+                shared.stream.seek(0)
+                shared.stream.truncate()
+            shared.users += 1
+            return shared.stream
+
+    def emit(self, record):
+        if not self._emit_streamed(record):
+            super().emit(record)
+
+    def close(self):
+        if not self.share_file:
+            super().close()
+            return
+        self.acquire()
+        try:
+            stream, self.stream = self.stream, None
+            if stream is not None:
+                stream.flush()
+                shared = self._shared
+                shared.users -= 1
+                if not shared.users:
+                    shared.stream = None
+                    stream.close()
+        finally:
+            self.release()
+        # skips FileHandler.close(), which would close the shared stream
+        _logging.StreamHandler.close(self)
+
+
+class BufferedFileHandler(FileHandler):
+    """
+    FileHandler that accumulates formatted records and writes them out with
+    a single write() call, instead of writing and flushing every record.
+
+    The buffer is written out when
+      - it holds at least `buffer_bytes` characters
+      - a record at or above `flush_level` arrives
+      - `flush_interval` seconds have passed, checked by a background thread
+      - `flush()` or `close()` is called, logging.shutdown() does both at exit
+    """
+    def __init__(self, filename, mode='a', encoding=None, delay=False,
+                 buffer_bytes=64 * 1024,
+                 flush_interval=1.0,
+                 flush_level=_logging.ERROR):
+        """
+        Args:
+          filename, mode, encoding, delay: same as logging.FileHandler
+          buffer_bytes: write out once the buffer reaches this size
+          flush_interval: max seconds a record stays in the buffer,
+            None to only flush on size, level or explicit flush()
+          flush_level: records at or above this level are written immediately
+        """
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self._buffer = []
+        self._buffered = 0
+        super().__init__(filename, mode, encoding, delay)
+        self._stop_flusher = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name='nanolog-flusher', daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
+
+    def emit(self, record):
+        try:
+            parts = self._streamed_parts(record)
+            if parts is not None:
+                # keep the order of the records, then bypass the buffer
+                self._write_buffer(record)
+                self._write_streamed_file(parts)
+                return
+            msg = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return
+        self._buffer.append(msg)
+        self._buffered += len(msg)
+        if (self._buffered >= self.buffer_bytes
+                or record.levelno >= self.flush_level):
+            self._write_buffer(record)
+
+    def _write_buffer(self, record=None):
+        "Must hold the handler lock"
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(data)
+            self.stream.flush()
+        except Exception:
+            if record is not None:
+                self.handleError(record)
+            elif _logging.raiseExceptions:
+                sys.stderr.write('--- Logging error in BufferedFileHandler ---\n')
+                traceback.print_exc(file=sys.stderr)
+
+    def handle_batch(self, records):
+        # the buffer already batches the writes
+        for record in records:
+            if record.levelno >= self.level:
+                self.handle(record)
+
+    def _write_streamed_file(self, parts):
+        "Must hold the handler lock"
+        if self.stream is None:
+            self.stream = self._open()
+        return self._write_streamed(self.stream, parts)
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._write_buffer()
+        finally:
+            self.release()
+
+    def close(self):
+        self._stop_flusher.set()
+        flusher = self._flusher
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        self.flush()
+        super().close()
+
+
+class RotatingFileHandler(BufferedFileHandler):
+    """
+    BufferedFileHandler that starts a new file once the current one exceeds
+    `max_bytes` or is older than `rotate_every` seconds.
+
+    The finished segment is renamed to `<filename>.<YYYYmmdd-HHMMSS>` and
+    handed to a background thread, which compresses it with `compress` and
+    then deletes the oldest segments beyond `keep`. The logging thread only
+    pays for the rename.
+    """
+    # rotation closes and replaces the file, it can't be shared
+    share_file = False
+
+    COMPRESSORS = {
+        'gz': ('gzip', '.gz'),
+        'xz': ('lzma', '.xz'),
+        'bz2': ('bz2', '.bz2'),
+    }
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False,
+                 max_bytes=0,
+                 rotate_every=None,
+                 keep=None,
+                 compress='gz',
+                 buffer_bytes=0,
+                 flush_interval=None,
+                 flush_level=_logging.ERROR):
+        """
+        Args:
+          filename, mode, encoding, delay: same as logging.FileHandler
+          max_bytes: rotate before the file would grow past this size,
+            0 for no size limit
+          rotate_every: rotate when the file is older than this many seconds,
+            None for no time limit
+          keep: max number of rotated segments to retain, None to keep all
+          compress: 'gz', 'xz', 'bz2' or None to leave segments uncompressed
+          buffer_bytes, flush_interval, flush_level: see BufferedFileHandler,
+            the default buffer_bytes=0 writes every record right away
+        """
+        assert max_bytes or rotate_every, \
+            'at least one of max_bytes and rotate_every must be set'
+        assert compress is None or compress in self.COMPRESSORS, \
+            'compress must be None or one of {}'.format(list(self.COMPRESSORS))
+        assert keep is None or keep >= 0, 'keep must be None or non-negative'
+        self.max_bytes = max_bytes
+        self.rotate_every = rotate_every
+        self.keep = keep
+        self.compress = compress
+        self._size = 0
+        self._rotate_at = None
+        self._last_stamp = (None, 0)  # of the previous segment name
+        self._segments = collections.deque()
+        self._segments_lock = threading.Lock()
+        self._segments_added = threading.Condition(self._segments_lock)
+        self._compressor = None
+        self._closing = False
+        super().__init__(filename, mode, encoding, delay,
+                         buffer_bytes=buffer_bytes,
+                         flush_interval=flush_interval,
+                         flush_level=flush_level)
+        self._segment_pattern = re.compile(
+            re.escape(os.path.basename(self.baseFilename))
+            + r'\.(\d{8}-\d{6})(?:_(\d+))?(?:\.gz|\.xz|\.bz2)?$'
+        )
+
+    def _open(self):
+        stream = super()._open()
+        self._size = os.fstat(stream.fileno()).st_size
+        if self.rotate_every:
+            self._rotate_at = time.time() + self.rotate_every
+        return stream
+
+    def _write_buffer(self, record=None):
+        if self._buffer and self.stream is not None:
+            # size is checked in characters, close enough for mostly ASCII logs
+            if ((self.max_bytes and self._size
+                    and self._size + self._buffered > self.max_bytes)
+                    or (self._rotate_at is not None and time.time() >= self._rotate_at)):
+                try:
+                    self.rotate()
+                except Exception:
+                    if record is not None:
+                        self.handleError(record)
+        buffered = self._buffered
+        super()._write_buffer(record)
+        self._size += buffered
+
+    def _write_streamed_file(self, parts):
+        # the size is only known afterwards, rotate before the next record
+        if self.stream is not None and (
+                (self.max_bytes and self._size >= self.max_bytes)
+                or (self._rotate_at is not None and time.time() >= self._rotate_at)):
+            self.rotate()
+        size = super()._write_streamed_file(parts)
+        self._size += size
+        return size
+
+    def _segment_name(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        # several rotations within a second count up, even if the earlier
+        # segments have been pruned already, so that names sort in order
+        last_stamp, n = self._last_stamp
+        n = n + 1 if stamp == last_stamp else 0
+        suffix = self.COMPRESSORS[self.compress][1] if self.compress else ''
+        while True:
+            name = '{}.{}'.format(self.baseFilename, stamp)
+            if n:
+                name += '_{}'.format(n)
+            if not (os.path.exists(name) or os.path.exists(name + suffix)):
+                break
+            n += 1
+        self._last_stamp = (stamp, n)
+        return name
+
+    def rotate(self):
+        "Close the current file and start a new one. Must hold the handler lock"
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename):
+            segment = self._segment_name()
+            os.rename(self.baseFilename, segment)
+            self._submit(segment)
+        self.stream = self._open()
+
+    def _submit(self, segment):
+        with self._segments_lock:
+            self._segments.append(segment)
+            if self._compressor is None:
+                self._compressor = threading.Thread(
+                    target=self._compress_loop,
+                    name='nanolog-compressor',
+                    daemon=True
+                )
+                self._compressor.start()
+            self._segments_added.notify()
+
+    def _compress_loop(self):
+        while True:
+            with self._segments_lock:
+                while not self._segments and not self._closing:
+                    self._segments_added.wait()
+                if not self._segments:
+                    return
+                segment = self._segments.popleft()
+            try:
+                if self.compress:
+                    self._compress_file(segment)
+                self._remove_old_segments()
+            except Exception:
+                if _logging.raiseExceptions:
+                    sys.stderr.write('--- Logging error in RotatingFileHandler ---\n')
+                    traceback.print_exc(file=sys.stderr)
+
+    def _compress_file(self, segment):
+        module_name, suffix = self.COMPRESSORS[self.compress]
+        module = __import__(module_name)
+        try:
+            src = open(segment, 'rb')
+        except FileNotFoundError:
+            return  # pruned already
+        with src, module.open(segment + suffix, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(segment)
+
+    def segments(self):
+        "Paths of the rotated segments on disk, oldest first"
+        folder = os.path.dirname(self.baseFilename)
+        found = []
+        for fname in os.listdir(folder):
+            match = self._segment_pattern.match(fname)
+            if match:
+                key = (match.group(1), int(match.group(2) or 0))
+                found.append((key, os.path.join(folder, fname)))
+        return [path for _, path in sorted(found)]
+
+    def _remove_old_segments(self):
+        if self.keep is None:
+            return
+        segments = self.segments()
+        with self._segments_lock:
+            # still waiting to be compressed, pruned after their turn
+            pending = set(self._segments)
+        for path in segments[:max(len(segments) - self.keep, 0)]:
+            if path in pending:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        super().close()
+        with self._segments_lock:
+            self._closing = True
+            self._segments_added.notify_all()
+            compressor = self._compressor
+        if compressor is not None and compressor is not threading.current_thread():
+            compressor.join()
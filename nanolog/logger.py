@@ -2,10 +2,19 @@ import os
 import sys
 import io
 import re
+import time
 import contextlib
-import inspect
+import operator
+import threading
+import weakref
 import logging as _logging
 from .printing import *
+from .handlers import *
+from .formatters import *
+from .binary import BinaryFileHandler
+from .collector import SocketHandler
+from .ringbuffer import RingBufferHandler
+from .spans import span_registry, format_duration
 
 
 def _get_level_mapping():
@@ -86,6 +95,37 @@ def get_level_number(level_name):
 _logging.getLevelName = get_level_name
 
 
+# Every Logger wrapper caches the lowest level it lets through. The stdlib
+# clears its own level caches through Manager._clear_cache() whenever
+# setLevel() or logging.disable() is called, we hook in there to mark the
+# wrapper caches stale as well.
+_STALE_THRESHOLD = -1
+_wrappers = weakref.WeakSet()
+_wrappers_lock = threading.Lock()
+
+
+def _register_wrapper(wrapper):
+    with _wrappers_lock:
+        _wrappers.add(wrapper)
+
+
+def _invalidate_thresholds():
+    with _wrappers_lock:
+        for wrapper in _wrappers:
+            wrapper._threshold = _STALE_THRESHOLD
+
+
+_stdlib_clear_cache = _logging.Manager._clear_cache
+
+
+def _clear_cache(manager):
+    _stdlib_clear_cache(manager)
+    _invalidate_thresholds()
+
+
+_logging.Manager._clear_cache = _clear_cache
+
+
 # http://stackoverflow.com/questions/12980512/custom-logger-class-and-correct-line-number-function-name-in-log
 # From python 3.5 source code:
 # _srcfile is used when walking the stack to check when we've got the first
@@ -99,6 +139,50 @@ _logging.getLevelName = get_level_name
 #
 _srcfile = os.path.normcase(get_level_name.__code__.co_filename)
 
+# code object -> whether it comes from _srcfile, so that _findCaller() doesn't
+# need to normcase() the file name of every frame on every log call
+_internal_code = {}
+_INTERNAL_CODE_CACHE_SIZE = 4096
+
+# (Logger class, format, time_format, show_level) -> shared formatter
+_formatters = {}
+
+# LogRecord attributes derived from the caller's frame
+_CALLER_ATTRS_RE = re.compile('pathname|filename|lineno|funcName|module')
+
+
+def _is_internal_code(co):
+    "_findCaller helper: True if the code object belongs to this module"
+    internal = _internal_code.get(co)
+    if internal is None:
+        if len(_internal_code) >= _INTERNAL_CODE_CACHE_SIZE:
+            # dynamically compiled code could grow the cache without bound
+            _internal_code.clear()
+        internal = os.path.normcase(co.co_filename) == _srcfile
+        _internal_code[co] = internal
+    return internal
+
+
+def _handler_uses_caller(handler):
+    "Whether `handler` output references the caller's file, line or function"
+    uses_caller = getattr(handler, 'uses_caller', None)
+    if uses_caller is not None:
+        return uses_caller()
+    return _formatter_uses_caller(handler.formatter)
+
+
+def _formatter_uses_caller(formatter):
+    "Whether `formatter` output references the caller's file, line or function"
+    if formatter is None:  # stdlib default, '%(message)s'
+        return False
+    uses_caller = getattr(formatter, 'uses_caller', None)
+    if uses_caller is not None:
+        return uses_caller()
+    fmt = getattr(formatter, '_fmt', None)
+    if not isinstance(fmt, str):
+        return True  # unknown formatter, assume the worst
+    return _CALLER_ATTRS_RE.search(fmt) is not None
+
 
 def _expand_args(arg1, arg2):
     "Helper for add_file_handler and add_stream_handler"
@@ -116,6 +200,13 @@ def _expand_args(arg1, arg2):
     return zip(arg1, arg2)
 
 
+def _dedup(handler, dedup):
+    "Helper for add_file_handler and add_stream_handler"
+    if dedup is False or dedup is None:
+        return handler
+    return DedupHandler([handler], window=None if dedup is True else dedup)
+
+
 def _expand_arg(arg):
     "expand an arg into a singleton list"
     if isinstance(arg, list):
@@ -124,6 +215,271 @@ def _expand_arg(arg):
         return [arg]
 
 
+# (pathname, lineno) -> _CallsiteLimit, for the every_n, at_most_per_sec
+# and sample keywords of the logging methods
+_callsite_limits = {}
+_CALLSITE_LIMITS_SIZE = 4096
+_random = None  # random.random, imported on first use
+_next_sweep = 0.  # when rate limited calls next look for closed windows
+
+
+class _CallsiteLimit:
+    """
+    Rate limiting state of one callsite. Records dropped by
+    `at_most_per_sec` or `sample` are counted per window of one second
+    (1/at_most_per_sec if longer), and reported with the first record that
+    passes after the window closes. If the callsite goes quiet, they are
+    reported by the next rate limited call at any callsite once the window
+    has closed, or by `Logger.flush()` and `close()`.
+    """
+    __slots__ = ('calls', 'window_end', 'window_count', 'suppressed',
+                 'unreported', 'reported_at', 'lock',
+                 'logger', 'level', 'func')
+
+    def __init__(self):
+        self.calls = 0
+        self.window_end = 0.
+        self.window_count = 0  # records passed in the current window
+        self.suppressed = 0  # records dropped in the current window
+        self.unreported = 0  # records dropped in closed windows
+        self.reported_at = time.time()
+        self.lock = threading.Lock()
+        # of the last call, to report on the callsite's behalf
+        self.logger = None
+        self.level = None
+        self.func = None
+
+    def check(self, every_n, at_most_per_sec, sample):
+        """
+        Returns:
+          None if the record should be dropped, otherwise the number of
+          dropped records to report first, with the seconds they span
+        """
+        global _random
+        with self.lock:
+            self.calls += 1
+            if every_n and (self.calls - 1) % every_n:
+                return None
+            if not at_most_per_sec and sample is None:
+                return 0, 0.
+            now = time.time()
+            if now >= self.window_end:
+                window = 1. / at_most_per_sec if at_most_per_sec else 1.
+                self.window_end = now + max(window, 1.)
+                self.window_count = 0
+                self.unreported += self.suppressed
+                self.suppressed = 0
+            if sample is not None:
+                if _random is None:
+                    from random import random as _random
+                if _random() >= sample:
+                    self.suppressed += 1
+                    return None
+            if at_most_per_sec:
+                allowed = max(int(at_most_per_sec), 1)
+                if self.window_count >= allowed:
+                    self.suppressed += 1
+                    return None
+                self.window_count += 1
+            unreported, self.unreported = self.unreported, 0
+            elapsed = now - self.reported_at
+            if unreported:
+                self.reported_at = now
+            return unreported, elapsed
+
+    def take_unreported(self, force=False):
+        """
+        Returns:
+          the number of dropped records not reported yet, with the seconds
+          they span. Those of the current window only count once it has
+          closed, or if `force`.
+        """
+        with self.lock:
+            now = time.time()
+            if force or now >= self.window_end:
+                self.unreported += self.suppressed
+                self.suppressed = 0
+            unreported, self.unreported = self.unreported, 0
+            elapsed = now - self.reported_at
+            if unreported:
+                self.reported_at = now
+            return unreported, elapsed
+
+
+def _check_callsite_limit(logger, level, pathname, lineno, func,
+                          every_n, at_most_per_sec, sample):
+    "Logger._log helper, see _CallsiteLimit.check"
+    global _next_sweep
+    key = (pathname, lineno)
+    limit = _callsite_limits.get(key)
+    if limit is None:
+        if len(_callsite_limits) >= _CALLSITE_LIMITS_SIZE:
+            _callsite_limits.clear()
+        limit = _callsite_limits.setdefault(key, _CallsiteLimit())
+    limit.logger, limit.level, limit.func = logger, level, func
+    if at_most_per_sec or sample is not None:
+        now = time.time()
+        if now >= _next_sweep:
+            _next_sweep = now + 1.
+            _report_suppressed()
+    return limit.check(every_n, at_most_per_sec, sample)
+
+
+def _report_suppressed(logger=None, force=False):
+    """
+    Emit the dropped record counts that haven't been reported yet, see
+    _CallsiteLimit.take_unreported
+
+    Args:
+      logger: only the callsites of this logging.Logger, None for all
+    """
+    for (pathname, lineno), limit in list(_callsite_limits.items()):
+        if limit.logger is None or (logger is not None
+                                    and limit.logger is not logger):
+            continue
+        suppressed, elapsed = limit.take_unreported(force)
+        if suppressed:
+            _emit_suppressed(limit.logger, limit.level, pathname, lineno,
+                             limit.func, suppressed, elapsed)
+
+
+def _emit_suppressed(logger, level, pathname, lineno, func,
+                     suppressed, elapsed):
+    logger.handle(logger.makeRecord(
+        logger.name, level, pathname, lineno,
+        'nanolog: suppressed {} records from {}:{} in the last '
+        '{:.1f}s'.format(suppressed, os.path.basename(pathname), lineno,
+                         elapsed),
+        (), None, func
+    ))
+
+
+def _exception_message(msgs, exc):
+    "Logger.exception() helper, renders the message followed by the traceback"
+    msg = printstr(*msgs) + '\n'
+    if isinstance(exc, str):
+        return msg + exc
+    else:
+        return msg + exception2str(exc)
+
+
+class DeferredMessage:
+    """
+    Log message that is rendered on the first str() and cached afterwards.
+
+    logging.LogRecord.getMessage() calls str(record.msg), so the message is
+    only rendered once a handler actually emits the record, and all handlers
+    share the same rendered string.
+    """
+    __slots__ = ('render', 'args', 'kwargs', '_message')
+
+    def __init__(self, render, *args, **kwargs):
+        """
+        Args:
+          render: function that returns the message string
+          *args, **kwargs: passed to `render`
+        """
+        self.render = render
+        self.args = args
+        self.kwargs = kwargs
+        self._message = None
+
+    def is_rendered(self):
+        return self._message is not None
+
+    def __str__(self):
+        message = self._message
+        if message is None:
+            message = self._message = self.render(*self.args, **self.kwargs)
+            # release the raw objects, the string is all we need from now on
+            self.args = self.kwargs = None
+        return message
+
+    def __repr__(self):
+        return '<DeferredMessage {!r}>'.format(
+            self._message if self.is_rendered() else self.render
+        )
+
+
+class StreamingMessage(DeferredMessage):
+    """
+    DeferredMessage whose render function returns an iterator of string
+    chunks. nanolog's stream and file handlers write the chunks one by one
+    (see handlers.StreamingMixin), so the whole message is never built.
+    Anything else that needs the message renders it in full with str().
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        message = self._message
+        if message is None:
+            message = self._message = ''.join(
+                self.render(*self.args, **self.kwargs)
+            )
+            self.args = self.kwargs = None
+        return message
+
+    def iter_chunks(self):
+        if self._message is not None:
+            return iter((self._message,))
+        return self.render(*self.args, **self.kwargs)
+
+
+def _span_message(name, duration_ns, exc_type):
+    msg = '{} took {}'.format(name, format_duration(duration_ns))
+    if exc_type is not None:
+        msg += ' (raised {})'.format(exc_type.__name__)
+    return msg
+
+
+class Span:
+    """
+    Times a block of code, or every call of a decorated function, with
+    time.perf_counter_ns(), see `Logger.span()`.
+    The duration of the last run is in `duration_ns`.
+    """
+    __slots__ = ('logger', 'name', 'level', 'registry', 'duration_ns', '_start')
+
+    def __init__(self, logger, name, level, registry):
+        self.logger = logger
+        self.name = name
+        self.level = level
+        self.registry = registry
+        self.duration_ns = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration_ns = duration = time.perf_counter_ns() - self._start
+        self.registry.record(self.name, duration)
+        logger = self.logger
+        if self.level is not None and logger.is_enabled_for(self.level):
+            logger._log(
+                self.level,
+                DeferredMessage(_span_message, self.name, duration, exc_type),
+                extra={'span': self.name, 'duration_ms': duration / 1e6}
+            )
+        report = logger.logger.__dict__.get('_nanolog_span_report')
+        if report is not None and time.monotonic() >= report['due']:
+            report['due'] = time.monotonic() + report['interval']
+            logger.log_span_stats(report['level'], reset=report['reset'],
+                                  registry=report['registry'])
+        return False
+
+    def __call__(self, func):
+        import functools
+
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            # a new Span per call, so that concurrent calls don't mix up
+            with Span(self.logger, self.name, self.level, self.registry):
+                return func(*args, **kwargs)
+        return _timed
+
+
 def _parse_level_name(level_name):
     "_MethodGenerator helper"
     level_name = level_name.lower()
@@ -133,54 +489,103 @@ def _parse_level_name(level_name):
     return m.group(1), m.group(2)
 
 
+# logging.Logger attributes that Logger forwards through class-level
+# properties instead of the slow __getattr__ fallback
+_DELEGATED_ATTRS = ('name', 'level', 'parent', 'propagate', 'handlers',
+                    'disabled', 'filters', 'manager')
+
+
+def _delegate(attr):
+    "Property that reads and writes `attr` on the wrapped logging.Logger"
+    def _set(self, value):
+        setattr(self.logger, attr, value)
+    return property(operator.attrgetter('logger.' + attr), _set,
+                    doc='Same as logging.Logger.' + attr)
+
+
+def _get_level_methods():
+    """
+    Names of all generated level methods, e.g. 'info3', 'warnfmt', 'debugpp5'
+    mapped to (base method name, level name, level number).
+    logger.infobanner3(..) is equivalent to logger.banner(level=23, ...)
+    """
+    level_methods = {}
+    # all levels from DEBUG, DEBUG2, DEBUG3, ..., CRITICAL9
+    # might have aliases, i.e. same level nubmer maps to different names
+    for level_name, level_number in _NAME2LEVEL.items():
+        lname, lnum = _parse_level_name(level_name)
+        name_method_map = {
+            lname + lnum: 'log',
+            lname + 'fmt' + lnum: 'logfmt',
+            lname + 'banner' + lnum: 'banner',
+            lname + 'bannerfmt' + lnum: 'bannerfmt',
+            lname + 'pp' + lnum: 'pp',
+            lname + 'ppfmt' + lnum: 'ppfmt',
+        }
+        for new_name, old_name in name_method_map.items():
+            level_methods[new_name] = (old_name, level_name, level_number)
+    return level_methods
+
+
+_LEVEL_METHODS = _get_level_methods()
+
+
 class _MethodGenerator(type):
+    """
+    Level methods like `info3` or `debugppfmt5` are generated on first access
+    and then cached on the class, which keeps `import nanolog` cheap.
+    """
     def __init__(cls, _name, _bases, old_attrs):
         # we use __init__ instead of __new__ because __new__ cannot get docstring
         super().__init__(_name, _bases, old_attrs)
 
-        def _create_new_method(old_method, level_number):
-            # avoid late binding
-            def _new_method(self, *_args, **_kwargs):
-                # fill in the first positional arg
-                return old_method(self, level_number, *_args, **_kwargs)
-            return _new_method
-
-        def _generate(level_name, level_number):
-            # generate methods that fill the first `level` parameter
-            # e.g. logger.infobanner3(..) is equivalent to
-            # logger.banner(level=23, ...)
-            lname, lnum = _parse_level_name(level_name)
-            
-            name_method_map = {
-                lname + lnum: 'log',
-                lname + 'fmt' + lnum: 'logfmt',
-                lname + 'banner' + lnum: 'banner',
-                lname + 'bannerfmt' + lnum: 'bannerfmt',
-                lname + 'pp' + lnum: 'pp',
-                lname + 'ppfmt' + lnum: 'ppfmt',
-            }
-            for new_name, old_name in name_method_map.items():
-                old_method = old_attrs[old_name]
-                new_method = _create_new_method(old_method, level_number)
-                old_doc = inspect.getdoc(old_method)
-                # remove the doc that explains 'level:' parameter
-                old_doc = '\n'.join([line for line in old_doc.split('\n')
-                                     if not line.strip().startswith('level:')])
-                # "logging at severity INFO3 (level 23)" on top of docstring
-                extra_doc = ('Logging activated at severity {} (level {})\n'
-                             .format(level_name, level_number))
-                signature_doc = new_name + signature2str(old_method) + '\n'
-                signature_doc = signature_doc.replace('self, level, ', '')
-                new_method.__doc__ = signature_doc + extra_doc + old_doc
-                new_method.__name__ = new_name
-                setattr(cls, new_name, new_method)
-
-        # generate all methods from DEBUG, DEBUG2, DEBUG3, ..., CRITICAL9
-        # might have aliases, i.e. same level nubmer maps to different names
+        for attr in _DELEGATED_ATTRS:
+            if not hasattr(cls, attr):
+                setattr(cls, attr, _delegate(attr))
+
         for level_name, level_number in _NAME2LEVEL.items():
-            _generate(level_name, level_number)
             setattr(cls, level_name, level_number)
 
+    def __getattr__(cls, attr):
+        # only called if normal class attribute lookup fails
+        if attr not in _LEVEL_METHODS:
+            raise AttributeError(
+                "type object '{}' has no attribute '{}'".format(cls.__name__, attr)
+            )
+        old_name, level_name, level_number = _LEVEL_METHODS[attr]
+        old_method = getattr(cls, old_name)
+
+        # avoid late binding
+        def _new_method(self, *_args, **_kwargs):
+            # disabled calls cost a single integer comparison
+            if level_number < self._threshold:
+                return None
+            # fill in the first positional arg. `old_name` is looked up per
+            # call, because the method may have been generated on a base
+            # class that `self`'s class overrides it from
+            return getattr(self.__class__, old_name)(
+                self, level_number, *_args, **_kwargs
+            )
+
+        import inspect
+        old_doc = inspect.getdoc(old_method) or ''
+        # remove the doc that explains 'level:' parameter
+        old_doc = '\n'.join([line for line in old_doc.split('\n')
+                             if not line.strip().startswith('level:')])
+        # "logging at severity INFO3 (level 23)" on top of docstring
+        extra_doc = ('Logging activated at severity {} (level {})\n'
+                     .format(level_name, level_number))
+        signature_doc = attr + signature2str(old_method) + '\n'
+        signature_doc = signature_doc.replace('self, level, ', '')
+        _new_method.__doc__ = signature_doc + extra_doc + old_doc
+        _new_method.__name__ = attr
+        _new_method.__qualname__ = cls.__qualname__ + '.' + attr
+        setattr(cls, attr, _new_method)
+        return _new_method
+
+    def __dir__(cls):
+        return sorted(set(super().__dir__()) | set(_LEVEL_METHODS))
+
 
 class Logger(metaclass=_MethodGenerator):
     """
@@ -214,7 +619,10 @@ class Logger(metaclass=_MethodGenerator):
                     'process', 'processName', 'thread', 'threadName',
                     'created', 'relativeCreated', 'msecs',
                     'levelname', 'levelno', 'asctime', 'message']
-    
+    # the wrapper's own state, e.g. of a BoundLogger, lives in slots, so
+    # its __dict__ is only allocated if user code sets other attributes
+    __slots__ = ('logger', '_threshold', '__dict__', '__weakref__')
+
     def __init__(self, logger):
         """
         Wrap an existing logging.Logger instance or name
@@ -224,20 +632,28 @@ class Logger(metaclass=_MethodGenerator):
         """
         if isinstance(logger, str):
             logger = _logging.getLogger(logger)
-        elif isinstance(logger, self.__class__):
+        elif isinstance(logger, Logger):
             logger = logger.unwrap()
         assert isinstance(logger, _logging.Logger)
         self.logger = logger
+        self._threshold = _STALE_THRESHOLD
+        _register_wrapper(self)
 
     def unwrap(self):
         return self.logger
 
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LEVEL_METHODS))
+
     def __getattr__(self, attr):
         "Delegate unknown attributes to the underlying logger"
-        if attr in dir(self):
-            return object.__getattribute__(self, attr)
-        else:
-            return getattr(self.logger, attr)
+        if attr in _LEVEL_METHODS:
+            # generate the method on the class, bind it to this instance
+            return getattr(self.__class__, attr).__get__(self, self.__class__)
+        if attr == 'logger':
+            # not set yet, e.g. while unpickling; avoid infinite recursion
+            raise AttributeError(attr)
+        return getattr(self.logger, attr)
 
     def is_enabled_for(self, level):
         """
@@ -246,8 +662,20 @@ class Logger(metaclass=_MethodGenerator):
         Args:
             level: level name (string) or number (int)
         """
-        level = get_level_number(level)
-        return self.logger.isEnabledFor(level)
+        if level.__class__ is not int:
+            level = get_level_number(level)
+        threshold = self._threshold
+        if threshold == _STALE_THRESHOLD:
+            threshold = self._refresh_threshold()
+        return level >= threshold and not self.logger.disabled
+
+    def _refresh_threshold(self):
+        "Recompute the lowest enabled level, see stdlib Logger.isEnabledFor"
+        logger = self.logger
+        # logging.disable(level) turns off everything at or below `level`
+        threshold = max(logger.getEffectiveLevel(), logger.manager.disable + 1)
+        self._threshold = threshold
+        return threshold
 
     def exception(self, *msg, exc, level=_logging.ERROR,
                   stack_info=False, extra=None
@@ -256,6 +684,9 @@ class Logger(metaclass=_MethodGenerator):
         Logs a message with level ERROR on this logger. 
         Exception info is always added to the logging message. 
 
+        Every flight recorder (see `add_flight_recorder()`) dumps its
+        records first, whatever the level.
+
         Args:
             exc: the exception value that extends BaseException
             level: defaults to logging.ERROR
@@ -264,21 +695,17 @@ class Logger(metaclass=_MethodGenerator):
             Only Python3 supports exception.__traceback__
         """
         if self.is_enabled_for('ERROR'):
-            msg = printstr(*msg)
-            msg += '\n'
-            if isinstance(exc, str):
-                msg += exc
-            else:
-                excstr = exception2str(exc)
-                # excstr = '\n'.join(['ERROR> ' + line for line in excstr.split('\n')])
-                msg += excstr
+            for recorder in self._find_handlers(FlightRecorderHandler):
+                recorder.dump()
+            msg = DeferredMessage(_exception_message, msg, exc)
             self._log(
                 level, msg,
                 stack_info=stack_info, extra=extra
             )
     
     def log(self, level, *msg, sep=' ',
-            exc_info=None, stack_info=False, extra=None
+            exc_info=None, stack_info=False, extra=None,
+            every_n=None, at_most_per_sec=None, sample=None
             ):
         """
         Log with user-defined level, e.g. INFO3, DEBUG5, WARNING7
@@ -289,16 +716,25 @@ class Logger(metaclass=_MethodGenerator):
             **kwargs:
               - sep: separator symbol between *msg, the same as print()
               - exc_info, stack_info, extra: logging builtin keywords
+              - every_n: only log the 1st, (n+1)-th, (2n+1)-th ... call
+                from this line of code
+              - at_most_per_sec: drop records from this line beyond this rate
+              - sample: log each call from this line with this probability
+              The limits are checked before the message is rendered.
+              Records dropped by the last two are reported in a summary
+              line once per second, with the next record that passes.
         """
         if self.is_enabled_for(level):
-            msg = printstr(*msg, sep=sep)
+            msg = DeferredMessage(printstr, *msg, sep=sep)
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
     def logfmt(self, level, msg, *fmt_args,
                exc_info=None, stack_info=False, extra=None,
+               every_n=None, at_most_per_sec=None, sample=None,
                **fmt_kwargs):
         """
         Log with user-defined level, e.g. INFO3, DEBUG5, WARNING7
@@ -308,19 +744,21 @@ class Logger(metaclass=_MethodGenerator):
             msg: "{}"-style format string
             *fmt_args: positional args for the format string
             **fmt_kwargs: keyword args for the format string, except for
-              "exc_info", "stack_info", "extra" logging keywords
+              "exc_info", "stack_info", "extra" logging keywords and
+              "every_n", "at_most_per_sec", "sample", see `log()`
         """
         if self.is_enabled_for(level):
-            msg = msg.format(*fmt_args, **fmt_kwargs)
-            # self.logger.log(level, msg, **kwargs)
+            msg = DeferredMessage(str.format, msg, *fmt_args, **fmt_kwargs)
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
     def banner(self, level, *msg,
                sep=' ', symbol='=', banner_len=20, banner_lines=1,
-               exc_info=None, stack_info=False, extra=None
+               exc_info=None, stack_info=False, extra=None,
+               every_n=None, at_most_per_sec=None, sample=None
                ):
         """
         Display a banner line or block with your message in the middle
@@ -339,18 +777,20 @@ class Logger(metaclass=_MethodGenerator):
           logger.banner(DEBUG2, 'my', 'hello', 'world', symbol='!', banner_len=10)
         """
         if self.is_enabled_for(level):
-            msg = banner(
-                *msg, sep=sep, symbol=symbol,
+            msg = DeferredMessage(
+                banner, *msg, sep=sep, symbol=symbol,
                 banner_len=banner_len, banner_lines=banner_lines
             )
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
     def bannerfmt(self, level, msg, *fmt_args,
                   symbol='=', banner_len=20, banner_lines=1,
                   exc_info=None, stack_info=False, extra=None,
+                  every_n=None, at_most_per_sec=None, sample=None,
                   **fmt_kwargs):
         """
         Display a banner line or block with your message in the middle.
@@ -362,25 +802,29 @@ class Logger(metaclass=_MethodGenerator):
           msg: "{}"-style format string
           *fmt_args: positional args for the format string
           **fmt_kwargs: keyword args for the format string, except for
-              "exc_info", "stack_info", "extra" logging keywords
+              "exc_info", "stack_info", "extra" logging keywords and
+              "every_n", "at_most_per_sec", "sample", see `log()`
           symbol: banner symbol
           banner_len: length of the banner symbols (excluding message itself)
           banner_lines: number of the banner lines, ideally an odd number
         """
         if self.is_enabled_for(level):
-            msg = bannerfmt(
-                msg, *fmt_args,
+            msg = DeferredMessage(
+                bannerfmt, msg, *fmt_args,
                 symbol=symbol, banner_len=banner_len, banner_lines=banner_lines,
                 **fmt_kwargs
             )
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
     def pp(self, level, *msgs, sep=' ',
            indent=PP_DEFAULT, width=PP_DEFAULT, depth=PP_DEFAULT, compact=PP_DEFAULT,
-           exc_info=None, stack_info=False, extra=None
+           exc_info=None, stack_info=False, extra=None,
+           every_n=None, at_most_per_sec=None, sample=None,
+           streaming=False
            ):
         """
         Prettyprint objects
@@ -388,20 +832,27 @@ class Logger(metaclass=_MethodGenerator):
         Args:
           level: logging level name or number
           *msgs: objects like you would pass to print()
+          streaming: True to render the message in chunks (see
+            `iter_pprintstr()`) that stream and file handlers write as they
+            come, for very large objects. Other handlers, and the async
+            queue unless `render_in_writer` is set, still render it whole.
         """
         if self.is_enabled_for(level):
-            msg = pprintstr(
-                *msgs, sep=sep,
+            msg = (StreamingMessage if streaming else DeferredMessage)(
+                iter_pprintstr if streaming else pprintstr, *msgs, sep=sep,
                 indent=indent, width=width, depth=depth, compact=compact
             )
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
     def ppfmt(self, level, msg, *fmt_args,
               indent=PP_DEFAULT, width=PP_DEFAULT, depth=PP_DEFAULT, compact=PP_DEFAULT,
               exc_info=None, stack_info=False, extra=None,
+              every_n=None, at_most_per_sec=None, sample=None,
+              streaming=False,
               **fmt_kwargs):
         """
         Prettyprint message with formatting
@@ -411,22 +862,131 @@ class Logger(metaclass=_MethodGenerator):
           msg: "{{}}"-style format string
           *fmt_args: positional args for the format string
           **fmt_kwargs: keyword args for the format string, except for
-              "exc_info", "stack_info", "extra" logging keywords
+              "exc_info", "stack_info", "extra" logging keywords,
+              "every_n", "at_most_per_sec", "sample", see `log()`,
+              and "streaming", see `pp()`
         """
         if self.is_enabled_for(level):
-            msg = pprintfmtstr(
-                msg, *fmt_args,
+            msg = (StreamingMessage if streaming else DeferredMessage)(
+                iter_pprintfmtstr if streaming else pprintfmtstr, msg, *fmt_args,
                 indent=indent, width=width, depth=depth, compact=compact,
                 **fmt_kwargs
             )
             self._log(
                 level, msg,
-                exc_info=exc_info, stack_info=stack_info, extra=extra
+                exc_info=exc_info, stack_info=stack_info, extra=extra,
+                every_n=every_n, at_most_per_sec=at_most_per_sec, sample=sample
             )
 
+    def span(self, name, level=_logging.DEBUG, registry=None):
+        """
+        Context manager or decorator that times a block of code or every
+        call of a function. Each duration is logged as "<name> took 3.07ms",
+        with `span` and `duration_ms` attributes for structured formatters,
+        and added to the per-name statistics of `registry`.
+
+        Args:
+          name: span name, the key of the statistics
+          level: level name or number of the duration record,
+            None to only collect statistics
+          registry: SpanRegistry, defaults to the process-wide span_registry
+
+        Example:
+          with logger.span('load_batch'):
+              batch = next(loader)
+
+          @logger.span('train_step', level='info')
+          def train_step(batch): ...
+        """
+        if level is not None:
+            level = get_level_number(level)
+        if registry is None:
+            registry = span_registry
+        return Span(self, name, level, registry)
+
+    def log_span_stats(self, level=_logging.INFO, reset=False, registry=None):
+        """
+        Log a banner and the prettyprinted statistics of every span,
+        see `SpanRegistry.stats()`
+
+        Args:
+          level: level name or number
+          reset: True to start the statistics over afterwards
+          registry: defaults to the process-wide span_registry
+        """
+        if registry is None:
+            registry = span_registry
+        if self.is_enabled_for(level):
+            level = get_level_number(level)
+            self.banner(level, 'span stats')
+            self.pp(level, registry.stats(reset=reset))
+        elif reset:
+            registry.reset()
+
+    def set_span_report(self, interval, level=_logging.INFO, reset=True,
+                        registry=None):
+        """
+        Call `log_span_stats()` every `interval` seconds. The check runs
+        when a span of this logger finishes, no thread is involved.
+
+        Args:
+          interval: seconds between reports, None to stop reporting
+          level, reset, registry: see `log_span_stats()`
+        """
+        if interval is None:
+            self.logger.__dict__.pop('_nanolog_span_report', None)
+            return
+        self.logger._nanolog_span_report = {
+            'interval': interval,
+            'level': level,
+            'reset': reset,
+            'registry': registry,
+            'due': time.monotonic() + interval,
+        }
+
+    def bind(self, **fields):
+        """
+        Child logger that adds context fields to every record, instead of
+        passing `extra=` by hand. The fields are rendered once here, to the
+        "key=value ..." text CompiledFormatter puts before the message and to
+        the JSON members JsonFormatter appends; see `BoundContext`.
+
+        The child shares the underlying logging.Logger, its handlers and
+        level. Binding a bound logger again adds to its fields.
+
+        Example:
+          worker_log = logger.bind(run_id=run_id, worker=3)
+          worker_log.info('start')  # ... run_id=7 worker=3 start
+        """
+        return BoundLogger(self, BoundContext(fields))
+
     def remove_all_handlers(self):
-        for handle in self.logger.handlers:
-            self.logger.removeHandler(handle)
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            if isinstance(handler, (ProxyHandler, FileHandler)):
+                # don't leave a proxy's writer thread behind, and release the
+                # shared file, so that a new 'w' handler starts it over
+                handler.close()
+
+    def flush(self):
+        """
+        Blocks until every handler has written out all pending records,
+        including the ones still waiting in the async queue, and the
+        counts of records dropped by rate limits that weren't reported yet
+        """
+        _report_suppressed(self.logger, force=True)
+        for handler in self.logger.handlers:
+            handler.flush()
+
+    def close(self):
+        """
+        Drains, closes and detaches all handlers
+        """
+        _report_suppressed(self.logger, force=True)
+        for handler in list(self.logger.handlers):
+            handler.flush()
+            handler.close()
+            self.logger.removeHandler(handler)
 
     def set_level(self, level):
         """
@@ -438,6 +998,24 @@ class Logger(metaclass=_MethodGenerator):
             level = get_level_number(level)
         self.logger.setLevel(level)
 
+    def set_capture_caller(self, capture=True):
+        """
+        Whether log records carry the caller's file name, line number and
+        function name. Finding them walks the stack on every log call.
+
+        Args:
+          capture:
+            - True: always capture (default)
+            - False: skip the stack walk, records show "(unknown file)"
+              unless `stack_info=True` is passed
+            - 'auto': capture only if the format of any currently attached
+              handler references pathname, filename, lineno, funcName or module
+        """
+        if capture == 'auto':
+            capture = any(_handler_uses_caller(handler)
+                          for handler in self._output_handlers())
+        self.logger._nanolog_capture_caller = bool(capture)
+
     def get_level(self):
         return self.logger.getEffectiveLevel()
 
@@ -459,13 +1037,20 @@ class Logger(metaclass=_MethodGenerator):
                   time_format=None,
                   show_level=False,
                   stream=None,
-                  reset_handlers=False):
+                  reset_handlers=False,
+                  async_mode=False,
+                  queue_size=10000,
+                  overflow='block',
+                  render_in_writer=False,
+                  capture_caller=None):
         """
         Args:
           level: None to retain the original level of the logger
           file_name: None to print to console only
           file_mode: 'w' to override a file or 'a' to append
           format: `{}` style logging format string, right after level name
+            or 'jsonl' to write one JSON object per record with the logger
+            name, all FORMAT_ATTRS fields and any `extra=` attributes
           time_format examples:
             - "MDY HMS" => "12-25-18 16:38:05"
             - "HM@MD" => "16:38@12-25"
@@ -478,6 +1063,21 @@ class Logger(metaclass=_MethodGenerator):
             - str: "out", "stdout", "err", or "stderr"
             - None: do not print to any stream
           reset_handlers: True to remove all old handlers
+          async_mode: True to write records on a background thread, so that
+            logging calls never wait on disk or terminal I/O.
+            Call `flush()` to wait for the queue to drain.
+            'thread' to let every thread buffer its own records without
+            locking, for many threads logging at once. A single flusher
+            writes them in timestamp order, see ThreadBufferedHandler.
+          queue_size: max number of records waiting for the background thread
+          overflow: what to do when the queue is full in async_mode
+            - 'block': wait until the background thread catches up
+            - 'drop_oldest': discard the oldest queued record
+            - 'drop_newest': discard the incoming record
+          render_in_writer: True to also move message rendering (printstr,
+            pprintstr, ...) to the background thread in async_mode.
+            Only safe if the logged objects are not mutated afterwards.
+          capture_caller: see `set_capture_caller()`, None to leave unchanged
 
         Notes:
             log format rules:
@@ -507,6 +1107,16 @@ class Logger(metaclass=_MethodGenerator):
         self.add_stream_handler(stream, format, time_format, show_level)
         self.add_file_handler(file_name, file_mode,
                               format, time_format, show_level)
+        if async_mode == 'thread':
+            if self._find_handler(ThreadBufferedHandler) is None:
+                self._wrap_handlers(ThreadBufferedHandler())
+        elif async_mode and self._find_handler(QueuedHandler) is None:
+            self._wrap_handlers(
+                QueuedHandler(queue_size=queue_size, overflow=overflow,
+                              render_in_writer=render_in_writer)
+            )
+        if capture_caller is not None:
+            self.set_capture_caller(capture_caller)
         return self
     
     @classmethod
@@ -517,7 +1127,12 @@ class Logger(metaclass=_MethodGenerator):
                       format=None,
                       time_format=None,
                       show_level=False,
-                      stream='stdout'):
+                      stream='stdout',
+                      async_mode=False,
+                      queue_size=10000,
+                      overflow='block',
+                      render_in_writer=False,
+                      capture_caller=True):
         """
         Main factory method to create a new logger. If you want to reconfigure
         an existing Logger, you should use the following instead:
@@ -548,10 +1163,36 @@ class Logger(metaclass=_MethodGenerator):
             time_format=time_format,
             show_level=show_level,
             stream=stream,
-            reset_handlers=True
+            reset_handlers=True,
+            async_mode=async_mode,
+            queue_size=queue_size,
+            overflow=overflow,
+            render_in_writer=render_in_writer,
+            capture_caller=capture_caller
         )
     
-    def _get_formatter(self, format, time_format, show_level):
+    @classmethod
+    def _get_formatter(cls, format, time_format, show_level):
+        """
+        One shared formatter per configuration, so that a record that goes
+        to several handlers with the same format is only formatted once,
+        see CompiledFormatter and JsonFormatter
+        """
+        key = (cls, format, time_format, show_level)
+        formatter = _formatters.get(key)
+        if formatter is None:
+            formatter = _formatters[key] = cls._new_formatter(
+                format, time_format, show_level
+            )
+        return formatter
+
+    @classmethod
+    def _new_formatter(cls, format, time_format, show_level):
+        if format == 'jsonl':
+            return JsonFormatter(
+                fields=['name'] + cls.FORMAT_ATTRS,
+                datefmt=get_time_formatter(time_format)
+            )
         levelname = '[{levelname}]> ' if show_level else ''
         if format is None:
             if time_format is not None:
@@ -560,10 +1201,9 @@ class Logger(metaclass=_MethodGenerator):
                 fmt = ''
         else:
             fmt = format
-        return _logging.Formatter(
+        return CompiledFormatter(
             fmt=fmt + levelname + '{message}',
-            datefmt=get_time_formatter(time_format),
-            style='{'
+            datefmt=get_time_formatter(time_format)
         )
     
     def add_file_handler(self,
@@ -571,33 +1211,165 @@ class Logger(metaclass=_MethodGenerator):
                          file_mode='a',
                          format=None,
                          time_format=None,
-                         show_level=False):
+                         show_level=False,
+                         buffer_bytes=0,
+                         flush_interval=1.0,
+                         flush_level=_logging.ERROR,
+                         max_bytes=0,
+                         rotate_every=None,
+                         keep=None,
+                         compress='gz',
+                         dedup=False):
         """
         Args:
             file_name: one string or a list of strings
             file_mode: one mode or a list of modes, must match len(file_name)
+            format: see `configure()`, 'jsonl' for JSON-lines output
+            buffer_bytes: 0 to write and flush every record (default),
+              otherwise accumulate records and write them out in one call
+              once the buffer reaches this size. See BufferedFileHandler.
+            flush_interval: max seconds a record stays in the buffer
+            flush_level: level name or number, records at or above it
+              are written out immediately
+            max_bytes: rotate each file before it grows past this size
+            rotate_every: rotate each file after this many seconds
+            keep: number of rotated segments to retain per file, None for all
+            compress: 'gz', 'xz', 'bz2' or None, applied to rotated segments
+              on a background thread. See RotatingFileHandler.
+            dedup: see `add_stream_handler()`
         """
         if not file_name:
             return
-        file_name = os.path.expanduser(file_name)
         formatter = self._get_formatter(format, time_format, show_level)
         for name, mode in _expand_args(file_name, file_mode):
-            handler = _logging.FileHandler(name, mode)
+            name = os.path.expanduser(name)
+            if max_bytes or rotate_every:
+                handler = RotatingFileHandler(
+                    name, mode,
+                    max_bytes=max_bytes,
+                    rotate_every=rotate_every,
+                    keep=keep,
+                    compress=compress,
+                    buffer_bytes=buffer_bytes,
+                    flush_interval=flush_interval if buffer_bytes else None,
+                    flush_level=get_level_number(flush_level)
+                )
+            elif buffer_bytes:
+                handler = BufferedFileHandler(
+                    name, mode,
+                    buffer_bytes=buffer_bytes,
+                    flush_interval=flush_interval,
+                    flush_level=get_level_number(flush_level)
+                )
+            else:
+                handler = FileHandler(name, mode)
             handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
+            self._add_handler(_dedup(handler, dedup))
+        return self
+
+    def add_binary_handler(self, file_name, file_mode='a'):
+        """
+        Write records in nanolog's compact binary format, which defers all
+        message rendering to decoding time. Read it back with
+        `nanolog.iter_binary_log()` or `python -m nanolog decode <file_name>`
+
+        Args:
+            file_name: one string or a list of strings
+            file_mode: 'a' to append or 'w' to overwrite, or a list of modes
+        """
+        if not file_name:
+            return
+        for name, mode in _expand_args(file_name, file_mode):
+            self._add_handler(BinaryFileHandler(os.path.expanduser(name), mode))
+        return self
+
+    def add_ring_buffer_handler(self, file_name, capacity=4 * 1024 * 1024):
+        """
+        Write binary records into a shared-memory ring buffer, the cheapest
+        output nanolog has. Another process moves them to the actual log with
+        `nanolog.RingBufferReader` or `python -m nanolog drain <file_name>`.
+        When the drain falls behind, the oldest records are overwritten.
+
+        Args:
+            file_name: one path or a list, e.g. '/dev/shm/worker3.ring'.
+              Each writer process needs its own buffer.
+            capacity: size of each buffer in bytes
+        """
+        if not file_name:
+            return
+        for name, _ in _expand_args(file_name, capacity):
+            self._add_handler(RingBufferHandler(name, capacity))
+        return self
+
+    def add_flight_recorder(self,
+                            capacity=10000,
+                            max_bytes=None,
+                            record_level='debug',
+                            pass_level='info',
+                            trigger_level='error'):
+        """
+        Keep the most recent low-level records in memory and write them out
+        only when an error occurs. All current and future output handlers
+        are moved behind a FlightRecorderHandler.
+
+        Args:
+            capacity: number of records to keep
+            max_bytes: keep binary encoded records up to this size instead
+            record_level: sets the logger's level, records below it are
+              not even created
+            pass_level: records at or above it are written out right away,
+              None to only write out dumps
+            trigger_level: records at or above it, and `exception()`,
+              dump the recorded records before themselves
+        """
+        self.set_level(record_level)
+        self._wrap_handlers(FlightRecorderHandler(
+            capacity=capacity,
+            max_bytes=max_bytes,
+            pass_level=None if pass_level is None
+                       else get_level_number(pass_level),
+            trigger_level=get_level_number(trigger_level)
+        ))
+        return self
+
+    def add_socket_handler(self, address, buffer_size=10000, batch_size=512,
+                           flush_interval=0.05):
+        """
+        Send records to a `nanolog.LogCollector`, typically running in
+        another process, which writes the records of all its clients
+        through its own handlers. Formatting happens on the collector side.
+
+        Args:
+            address: Unix socket path, port or "host:port" of the collector
+            buffer_size: max records held while the collector is unreachable
+            batch_size: max records per send
+            flush_interval: max seconds a record waits for its batch
+        """
+        self._add_handler(SocketHandler(
+            address,
+            buffer_size=buffer_size,
+            batch_size=batch_size,
+            flush_interval=flush_interval
+        ))
         return self
 
     def add_stream_handler(self,
                            stream,
                            format=None,
                            time_format=None,
-                           show_level=False):
+                           show_level=False,
+                           dedup=False):
         """
         Args:
             stream: 
             - stream object: e.g. sys.stderr
             - str: "out", "stdout", "err", or "stderr"
             - a list of the above to add multiple strings
+            dedup: collapse repeats of the same message, level and callsite
+              into one "last message repeated N times" line, see DedupHandler
+            - False: write every record
+            - True: collapse consecutive repeats
+            - seconds: collapse all repeats within that time window
         """
         if not stream:
             return
@@ -610,10 +1382,68 @@ class Logger(metaclass=_MethodGenerator):
                     stream = sys.stderr
                 else:
                     raise ValueError('Unsupported stream name: '+stream)
-            handler = _logging.StreamHandler(stream)
+            handler = StreamHandler(stream)
             handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
+            self._add_handler(_dedup(handler, dedup))
         return self
+
+    def _find_handler(self, handler_cls):
+        "Returns the first attached handler of type `handler_cls`, or None"
+        for handler in self.logger.handlers:
+            if isinstance(handler, handler_cls):
+                return handler
+        return None
+
+    def _find_handlers(self, handler_cls):
+        "All attached handlers of type `handler_cls`, looking through proxies"
+        found = []
+        pending = list(self.logger.handlers)
+        while pending:
+            handler = pending.pop(0)
+            if isinstance(handler, handler_cls):
+                found.append(handler)
+            if isinstance(handler, ProxyHandler):
+                pending = handler.targets + pending
+        return found
+
+    def _output_handlers(self):
+        "All handlers that actually write records, looking through proxies"
+        handlers = []
+        pending = list(self.logger.handlers)
+        while pending:
+            handler = pending.pop(0)
+            if isinstance(handler, ProxyHandler):
+                pending = handler.targets + pending
+            else:
+                handlers.append(handler)
+        return handlers
+
+    def _add_handler(self, handler):
+        """
+        Attach an output handler. If the records go through proxies
+        (e.g. the async queue), the handler becomes a target of the innermost.
+        """
+        proxy = None
+        handlers = self.logger.handlers
+        while True:
+            inner = [h for h in handlers
+                     if isinstance(h, ProxyHandler) and h.container]
+            if not inner:
+                break
+            proxy = inner[0]
+            handlers = proxy.targets
+        if proxy is None:
+            self.logger.addHandler(handler)
+        else:
+            proxy.add_target(handler)
+
+    def _wrap_handlers(self, proxy):
+        "Move all currently attached handlers behind `proxy`"
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            proxy.add_target(handler)
+        self.logger.addHandler(proxy)
+        return proxy
     
     def set_formatter(self, formatter, time_formatter=None):
         """
@@ -637,11 +1467,11 @@ class Logger(metaclass=_MethodGenerator):
                 datefmt = get_time_formatter(time_formatter)
             else:
                 datefmt = None
-            formatter = _logging.Formatter(formatter, datefmt=datefmt, style='{')
+            formatter = CompiledFormatter(formatter, datefmt=datefmt)
         elif not isinstance(formatter, _logging.Formatter):
             raise TypeError('formatter must be either an instance of '
                     'logging.Formatter or a tuple of (fmt, datefmt) strings')
-        for handler in self.logger.handlers:
+        for handler in self._output_handlers():
             handler.setFormatter(formatter)
 
     @staticmethod
@@ -675,10 +1505,9 @@ class Logger(metaclass=_MethodGenerator):
         if f is not None:
             f = f.f_back
         rv = "(unknown file)", 0, "(unknown function)", None
-        while hasattr(f, "f_code"):
+        while f is not None:
             co = f.f_code
-            filename = os.path.normcase(co.co_filename)
-            if filename == _srcfile:
+            if _is_internal_code(co):
                 f = f.f_back
                 continue
             sinfo = None
@@ -695,12 +1524,15 @@ class Logger(metaclass=_MethodGenerator):
         return rv
 
     def _log(self, level, msg, args=tuple(),
-             exc_info=None, stack_info=False, extra=None
+             exc_info=None, stack_info=False, extra=None,
+             every_n=None, at_most_per_sec=None, sample=None
              ):
         # Low-level logging routine which creates a LogRecord and then calls
         # all the handlers of this logger to handle the record.
         sinfo = None
-        if _srcfile:
+        limited = every_n or at_most_per_sec or sample is not None
+        capture_caller = getattr(self.logger, '_nanolog_capture_caller', True)
+        if _srcfile and (capture_caller or stack_info or limited):
             #IronPython doesn't track Python frames, so findCaller raises an
             #exception on some versions of IronPython. We trap it here so that
             #IronPython can use logging.
@@ -708,8 +1540,17 @@ class Logger(metaclass=_MethodGenerator):
                 fn, lno, func, sinfo = self._findCaller(stack_info)
             except ValueError: # pragma: no cover
                 fn, lno, func = "(unknown file)", 0, "(unknown function)"
-        else: # pragma: no cover
+        else:
             fn, lno, func = "(unknown file)", 0, "(unknown function)"
+        if limited:
+            report = _check_callsite_limit(self.logger, level, fn, lno, func,
+                                           every_n, at_most_per_sec, sample)
+            if report is None:
+                return
+            suppressed, elapsed = report
+            if suppressed:
+                _emit_suppressed(self.logger, level, fn, lno, func,
+                                 suppressed, elapsed)
         if exc_info:
             if isinstance(exc_info, BaseException):
                 exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
@@ -718,3 +1559,147 @@ class Logger(metaclass=_MethodGenerator):
         record = self.logger.makeRecord(self.logger.name, level, fn, lno, msg, args,
                                         exc_info, func, extra, sinfo)
         self.logger.handle(record)
+
+
+_get_running_loop = None  # asyncio._get_running_loop, imported by AsyncLogger
+
+
+class AsyncLogger(Logger):
+    """
+    Logger for asyncio programs, whose logging calls never block the event
+    loop. All handlers sit behind the async queue (see QueuedHandler), its
+    writer thread does every write, and a full queue drops records instead
+    of making the loop wait.
+
+    The level methods are the same as Logger's (`info3`, `warnfmt`,
+    `criticalpp` ...) and stay plain calls, they only enqueue:
+
+        logger = AsyncLogger.create_logger('server', file_name='server.log')
+        logger.info('request', request_id)
+        await logger.aflush()
+
+    When an event loop that the logger was used in shuts down, e.g. at the
+    end of asyncio.run(), the pending records are flushed.
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+    __slots__ = ()
+
+    def __init__(self, logger):
+        global _get_running_loop
+        if _get_running_loop is None:
+            # asyncio is imported by now for any program that uses this class
+            from asyncio import _get_running_loop
+        super().__init__(logger)
+        if self.logger.handlers:
+            self._ensure_queue()
+
+    @classmethod
+    def create_logger(cls, name, *args, overflow='drop_oldest', **kwargs):
+        "See `Logger.create_logger()`, `overflow` must not be 'block'"
+        return super().create_logger(name, *args, overflow=overflow, **kwargs)
+
+    def configure(self, *args, overflow='drop_oldest', **kwargs):
+        """
+        See `Logger.configure()`, async_mode is always on and `overflow`
+        must be 'drop_oldest' or 'drop_newest'
+        """
+        assert overflow in self.OVERFLOW_POLICIES, \
+            'overflow must be one of {}'.format(self.OVERFLOW_POLICIES)
+        kwargs['async_mode'] = True
+        super().configure(*args, overflow=overflow, **kwargs)
+        self._find_handler(QueuedHandler).overflow = overflow
+        self._watch_loop()
+        return self
+
+    def _ensure_queue(self):
+        queue = self._find_handler(QueuedHandler)
+        if queue is None:
+            self._wrap_handlers(QueuedHandler(overflow='drop_oldest'))
+        elif queue.overflow == 'block':
+            queue.overflow = 'drop_oldest'
+
+    def _add_handler(self, handler):
+        super()._add_handler(handler)
+        self._ensure_queue()
+
+    def _watch_loop(self, loop=None):
+        "Flush the queue when the running event loop, if any, shuts down"
+        if loop is None:
+            loop = _get_running_loop()
+            if loop is None:
+                return
+        # kept on the stdlib logger, the wrappers come and go
+        self.logger._nanolog_last_loop = weakref.ref(loop)
+        watchers = self.logger.__dict__.setdefault(
+            '_nanolog_loop_watchers', weakref.WeakKeyDictionary()
+        )
+        if loop not in watchers:
+            # the loop only keeps a weak reference to its tasks
+            watchers[loop] = loop.create_task(self._flush_on_shutdown())
+
+    async def _flush_on_shutdown(self):
+        import asyncio
+        try:
+            await asyncio.get_running_loop().create_future()
+        except asyncio.CancelledError:
+            # asyncio.run() cancels the remaining tasks before it closes
+            # the loop, and lets them finish
+            await self.aflush()
+
+    def _log(self, *args, **kwargs):
+        loop = _get_running_loop()
+        if loop is not None:
+            # only a loop other than the last one seen needs a watcher
+            last_loop = self.logger.__dict__.get('_nanolog_last_loop')
+            if last_loop is None or last_loop() is not loop:
+                self._watch_loop(loop)
+        super()._log(*args, **kwargs)
+
+    async def aflush(self):
+        "Waits until every pending record is written, without blocking the loop"
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def aclose(self):
+        "Drains, closes and detaches all handlers, without blocking the loop"
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+class BoundLogger(Logger):
+    """
+    Logger with context fields, returned by `Logger.bind()`. Records get the
+    pre-rendered `BoundContext` as one `context` attribute, so the cost per
+    call doesn't grow with the number of fields.
+    """
+    __slots__ = ('context', '_parent', '_extra')
+
+    def __init__(self, parent, context):
+        """
+        Args:
+          parent: the unbound Logger that does the actual logging
+          context: BoundContext
+        """
+        self._parent = parent
+        self.context = context
+        self._extra = {'context': context}
+        super().__init__(parent.logger)
+
+    def bind(self, **fields):
+        return BoundLogger(self._parent, BoundContext(fields, self.context))
+
+    def _log(self, level, msg, args=tuple(), exc_info=None, stack_info=False,
+             extra=None, **kwargs):
+        if extra is None:
+            extra = self._extra
+        else:
+            extra = dict(extra, context=self.context)
+        # the parent's _log, e.g. AsyncLogger's, which watches the event loop
+        self._parent._log(level, msg, args, exc_info, stack_info, extra,
+                          **kwargs)
@@ -6,26 +6,30 @@ Printing utils:
 """
 
 import os
+import re
 import sys
-import datetime
 import time
-import pprint as _pprint_builtin
-import prettyprinter as _pprint_thirdparty
 import numbers
-import inspect
+import threading
+import collections
 from collections import abc
 from io import StringIO
 import traceback
 from .constants import PP_DEFAULT
 
 
-_PP_BACKEND = _pprint_thirdparty
+# 'builtin' or 'thirdparty', the modules are only imported on first use
+_PP_BACKEND = 'thirdparty'
 # global default configs
 _PP_CONFIG = {
     'indent': 1,
     'width': 80,
     'depth': None,
-    'compact': False
+    'compact': False,
+    'cache_size': 0,
+    'max_items': None,
+    'max_chars': None,
+    'chunk_size': 64 * 1024,
 }
 
 
@@ -40,20 +44,383 @@ def set_pprint_backend(backend):
     global _PP_BACKEND
     backend = backend.lower()
     assert backend in ['builtin', 'thirdparty']
+    _PP_BACKEND = backend
+
+
+def _import_pp_backend(backend):
+    """
+    Deferred until the first prettyprint call,
+    `prettyprinter` alone takes tens of ms to import.
+    """
     if backend == 'builtin':
-        _PP_BACKEND = _pprint_builtin
+        import pprint
+        return pprint
     else:
-        _PP_BACKEND = _pprint_thirdparty
+        import prettyprinter
+        return prettyprinter
 
 
 def set_pprint_config(indent=PP_DEFAULT,
                       width=PP_DEFAULT,
                       depth=PP_DEFAULT,
-                      compact=PP_DEFAULT):
-    kwargs = dict(indent=indent, width=width, depth=depth, compact=compact)
+                      compact=PP_DEFAULT,
+                      cache_size=PP_DEFAULT,
+                      max_items=PP_DEFAULT,
+                      max_chars=PP_DEFAULT,
+                      chunk_size=PP_DEFAULT):
+    """
+    Global prettyprint defaults. The layout options can be overridden per call.
+
+    Args:
+        cache_size: number of prettyprinted strings to keep in an LRU cache,
+          0 to disable (default). Only objects that can't change are cached:
+          numbers, bytes, and tuples/frozensets of those, as well as
+          objects with a `__pp_fingerprint__()` method, see _pp_cache_key.
+        max_items: containers with more items are prettyprinted with the
+          first `max_items` and a "...(N more)" marker. None for no limit.
+        max_chars: stop visiting items once the output is estimated to reach
+          this size, and cut the final string there. None for no limit.
+        chunk_size: approximate size of the pieces iter_pprintstr() and
+          iter_pprintfmtstr() yield
+    """
+    kwargs = dict(indent=indent, width=width, depth=depth, compact=compact,
+                  cache_size=cache_size, max_items=max_items,
+                  max_chars=max_chars, chunk_size=chunk_size)
     for key, value in kwargs.items():
         if value != PP_DEFAULT:
             _PP_CONFIG[key] = value
+    if _PP_CONFIG['cache_size'] < len(_pp_cache):
+        clear_pprint_cache()
+
+
+# ---------------- prettyprint cache -----------------
+_pp_cache = collections.OrderedDict()
+_pp_cache_lock = threading.Lock()
+_IMMUTABLE_SCALARS = frozenset([type(None), bool, int, float, complex,
+                                str, bytes])
+
+
+def clear_pprint_cache():
+    with _pp_cache_lock:
+        _pp_cache.clear()
+
+
+def _immutable_types(obj):
+    """
+    Returns:
+        nested tuple of the types in `obj` if nothing in it can change,
+        otherwise None. 1 == 1.0 == True, so the types go into the cache key.
+    """
+    obj_type = type(obj)
+    if obj_type in _IMMUTABLE_SCALARS:
+        return obj_type
+    if obj_type is tuple or obj_type is frozenset:
+        types = [obj_type]
+        for item in obj:
+            item_types = _immutable_types(item)
+            if item_types is None:
+                return None
+            types.append(item_types)
+        return tuple(types)
+    return None
+
+
+def _pp_cache_key(obj):
+    """
+    Returns:
+        hashable key that identifies the prettyprinted string of `obj`,
+        or None if it can't be cached.
+
+    An object can opt in with a `__pp_fingerprint__()` method that returns
+    a hashable value that changes whenever the printed content would, e.g.
+    a version counter or a tuple of the relevant fields.
+    """
+    fingerprint = getattr(type(obj), '__pp_fingerprint__', None)
+    if fingerprint is not None:
+        return type(obj), fingerprint(obj)
+    types = _immutable_types(obj)
+    if types is None:
+        return None
+    return types, obj
+
+
+# ---------------- type-dispatched summaries -----------------
+# type -> function(obj) that returns the string to print for obj
+_pp_formatters = {}
+# 'module.QualName' -> function, for types whose module may not be imported
+_pp_formatters_by_name = {}
+# type -> resolved function or None, cleared on every registration
+_pp_dispatch_cache = {}
+
+
+def register_pprint_formatter(cls, func):
+    """
+    Prettyprint instances of `cls` and its subclasses as `func(obj)`,
+    wherever they appear in the printed structure.
+
+    Args:
+        cls: a type, or its 'module.QualName' string to avoid importing it,
+          e.g. 'torch.Tensor'
+        func: returns the string to print, None to unregister `cls`
+    """
+    registry = _pp_formatters_by_name if isinstance(cls, str) else _pp_formatters
+    if func is None:
+        registry.pop(cls, None)
+    else:
+        registry[cls] = func
+    _pp_dispatch_cache.clear()
+
+
+def _find_pprint_formatter(obj):
+    "Registered function for `obj`'s type by MRO, or summarize_array for arrays"
+    obj_type = type(obj)
+    try:
+        return _pp_dispatch_cache[obj_type]
+    except KeyError:
+        func = _pp_dispatch_cache[obj_type] = _resolve_pprint_formatter(obj_type)
+        return func
+
+
+def _resolve_pprint_formatter(obj_type):
+    func = None
+    for base in obj_type.__mro__:
+        func = _pp_formatters.get(base)
+        if func is None and _pp_formatters_by_name:
+            func = _pp_formatters_by_name.get(
+                '{}.{}'.format(base.__module__, base.__qualname__)
+            )
+        if func is not None:
+            return func
+    if _is_array_like(obj_type):
+        return summarize_array
+    return None
+
+
+def _is_array_like(obj_type):
+    """
+    numpy.ndarray, torch.Tensor, jax arrays etc. by duck typing. Checks the
+    type, so that proxies like mock.Mock, which answer every attribute,
+    are not mistaken for arrays.
+    """
+    return all(hasattr(obj_type, attr)
+               for attr in ('shape', 'dtype', 'ndim', 'min', 'max', 'mean'))
+
+
+def _to_scalar(value):
+    item = getattr(value, 'item', None)
+    return item() if item is not None else value
+
+
+def _format_scalar(value):
+    value = _to_scalar(value)
+    if isinstance(value, float):
+        return '{:.4g}'.format(value)
+    return str(value)
+
+
+def _edge_elements(arr, size, edge_items):
+    "First and last `edge_items` elements in flat order, without a full copy"
+    flat = getattr(arr, 'flat', None)  # numpy, a strided view
+    if flat is None:
+        flat = arr.reshape(-1)  # a view for contiguous torch/jax arrays
+    return (list(map(_to_scalar, flat[:edge_items])),
+            list(map(_to_scalar, flat[size - edge_items:size])))
+
+
+def summarize_array(arr, edge_items=3):
+    """
+    One line summary of an ndarray-like object, e.g.
+    ndarray(shape=(64, 128), dtype=float32, min=-2.1, max=3.4, mean=0.01,
+            [0.1, 0.5, -0.3, ..., 1.2, 0.7, 0.9])
+    The statistics use the array's own vectorized reductions, and only the
+    edge elements are converted to Python objects.
+    Small arrays are printed in full with their own repr.
+    """
+    shape = tuple(arr.shape)
+    size = 1
+    for dim in shape:
+        size *= dim
+    if size <= 2 * edge_items:
+        return repr(arr)
+    parts = ['shape={}'.format(shape), 'dtype={}'.format(arr.dtype)]
+    try:
+        for stat in ('min', 'max', 'mean'):
+            parts.append('{}={}'.format(stat, _format_scalar(getattr(arr, stat)())))
+    except Exception:
+        pass  # e.g. mean of an integer tensor or of strings
+    try:
+        first, last = _edge_elements(arr, size, edge_items)
+        parts.append('[{}, ..., {}]'.format(
+            ', '.join(map(_format_scalar, first)),
+            ', '.join(map(_format_scalar, last))
+        ))
+    except Exception:
+        pass
+    return '{}({})'.format(type(arr).__name__, ', '.join(parts))
+
+
+# ---------------- size-bounded prettyprint -----------------
+class _Text:
+    "Placeholder printed as the given text"
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+class _Elided(_Text):
+    """
+    Placeholder that sorts after everything else, so that the backends,
+    which sort sets and dict keys, keep it at the end
+    """
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+def _elided(count):
+    "Placeholder for the items dropped by max_items/max_chars"
+    return _Elided('...({} more)'.format(count))
+
+
+# estimated printed size of an object we don't look into
+_LEAF_CHARS = 8
+
+
+class _Truncator:
+    """
+    Copies a nested structure, keeping at most `max_items` per container
+    and about `max_chars` of printed output in total, and replacing the
+    objects with a registered formatter by their summary text. Only the
+    containers that actually change are copied, and the traversal never
+    visits the items beyond the limits.
+    """
+    def __init__(self, max_items, max_chars):
+        self.max_items = max_items
+        self.budget = max_chars if max_chars is not None else float('inf')
+        self._active = set()  # ids of the containers being visited
+
+    def truncate(self, obj):
+        obj_type = type(obj)
+        if obj_type in (str, bytes):
+            self.budget -= len(obj) + 3
+            return obj
+        if obj_type in _IMMUTABLE_SCALARS:
+            self.budget -= _LEAF_CHARS
+            return obj
+        if obj_type in (dict, collections.OrderedDict):
+            return self._visit(obj, self._truncate_dict)
+        if obj_type in (list, tuple, set, frozenset, collections.deque):
+            return self._visit(obj, self._truncate_sequence)
+        formatter = _find_pprint_formatter(obj)
+        if formatter is not None:
+            try:
+                text = formatter(obj)
+            except Exception:
+                pass  # printed with its own repr instead
+            else:
+                self.budget -= len(text)
+                return _Text(text)
+        self.budget -= _LEAF_CHARS
+        return obj
+
+    def _visit(self, obj, truncate):
+        if id(obj) in self._active:
+            return obj  # recursive structure, left to the backend to mark
+        self._active.add(id(obj))
+        try:
+            return truncate(obj)
+        finally:
+            self._active.discard(id(obj))
+
+    def _limit(self, size):
+        return size if self.max_items is None else min(size, self.max_items)
+
+    def _truncate_sequence(self, obj):
+        self.budget -= 2
+        items = []
+        changed = False
+        limit = self._limit(len(obj))
+        for i, item in enumerate(obj):
+            if i >= limit or self.budget <= 0:
+                break
+            new_item = self.truncate(item)
+            changed = changed or new_item is not item
+            items.append(new_item)
+            self.budget -= 2
+        if len(items) < len(obj):
+            items.append(_elided(len(obj) - len(items)))
+        elif not changed:
+            return obj
+        if type(obj) is collections.deque:
+            return collections.deque(items)
+        return type(obj)(items)
+
+    def _truncate_dict(self, obj):
+        self.budget -= 2
+        items = []
+        changed = False
+        limit = self._limit(len(obj))
+        for i, (key, value) in enumerate(obj.items()):
+            if i >= limit or self.budget <= 0:
+                break
+            new_key = self.truncate(key)
+            new_value = self.truncate(value)
+            changed = changed or new_key is not key or new_value is not value
+            items.append((new_key, new_value))
+            self.budget -= 4
+        if len(items) < len(obj):
+            items.append((_Elided('...'), _elided(len(obj) - len(items))))
+        elif not changed:
+            return obj
+        return type(obj)(items)
+
+
+def _has_formatted_items(obj):
+    "Whether anything in the nested structure has a pprint formatter"
+    pending = [obj]
+    seen = set()
+    while pending:
+        obj = pending.pop()
+        obj_type = type(obj)
+        if obj_type in _IMMUTABLE_SCALARS:
+            continue
+        if obj_type in (dict, collections.OrderedDict):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                pending.extend(obj.keys())
+                pending.extend(obj.values())
+        elif obj_type in (list, tuple, set, frozenset, collections.deque):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                pending.extend(obj)
+        elif _find_pprint_formatter(obj) is not None:
+            return True
+    return False
+
+
+def _truncate(obj, max_items, max_chars):
+    "_Truncator pre-pass, skipped if it wouldn't change anything"
+    if (max_items is None and max_chars is None
+            and not _has_formatted_items(obj)):
+        return obj
+    return _Truncator(max_items, max_chars).truncate(obj)
+
+
+def _pp_kwargs(indent, width, depth, compact):
+    "Layout options of one call, with the global defaults filled in"
+    kwargs = dict(indent=indent, width=width, depth=depth, compact=compact)
+    for key, value in kwargs.items():
+        if value == PP_DEFAULT:
+            kwargs[key] = _PP_CONFIG[key]
+    return kwargs
 
 
 def _pp_obj_str(obj, indent, width, depth, compact, *, _leave_number):
@@ -66,14 +433,330 @@ def _pp_obj_str(obj, indent, width, depth, compact, *, _leave_number):
     # don't convert number to string if we pass it to str.format()
     if isinstance(obj, numbers.Number) and _leave_number:
         return obj
-    kwargs = dict(indent=indent, width=width, depth=depth, compact=compact)
-    for key, value in kwargs.items():
-        if value == PP_DEFAULT:
-            kwargs[key] = _PP_CONFIG[key]
+    kwargs = _pp_kwargs(indent, width, depth, compact)
     backend = _PP_BACKEND
     if kwargs['compact']:
-        backend = _pprint_builtin
-    return backend.pformat(obj, **kwargs)
+        backend = 'builtin'
+    max_items = _PP_CONFIG['max_items']
+    max_chars = _PP_CONFIG['max_chars']
+    cache_size = _PP_CONFIG['cache_size']
+    cache_key = None
+    if cache_size:
+        cache_key = _pp_cache_key(obj)
+        if cache_key is not None:
+            cache_key = (cache_key, backend, max_items, max_chars,
+                         tuple(kwargs.values()))
+            with _pp_cache_lock:
+                text = _pp_cache.get(cache_key)
+                if text is not None:
+                    _pp_cache.move_to_end(cache_key)
+                    return text
+    obj = _truncate(obj, max_items, max_chars)
+    text = _import_pp_backend(backend).pformat(obj, **kwargs)
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars] + '...'
+    if cache_key is not None:
+        with _pp_cache_lock:
+            _pp_cache[cache_key] = text
+            while len(_pp_cache) > cache_size:
+                _pp_cache.popitem(last=False)
+    return text
+
+
+# ---------------- streaming prettyprint -----------------
+def _recursion(obj):
+    return '<Recursion on {} with id={}>'.format(type(obj).__name__, id(obj))
+
+
+def _safe_tuple(pair):
+    from pprint import _safe_key  # the builtin backend's ordering
+    return _safe_key(pair[0]), _safe_key(pair[1])
+
+
+class _StreamingPrinter:
+    """
+    Generator version of the builtin pprint.PrettyPrinter layout, yields the
+    output in small pieces instead of building one string.
+
+    Whether a container fits on the rest of the line is decided by a repr
+    that gives up as soon as it exceeds the line, so apart from single long
+    leaves (e.g. a long string, which is not wrapped) no piece is larger
+    than one line. Only dict, list, tuple, set and frozenset are laid out
+    over several lines, like the builtin backend.
+    """
+    def __init__(self, indent, width, depth, compact):
+        self._indent = indent
+        self._width = width
+        self._depth = depth
+        self._compact = compact
+        self._dispatch = {
+            dict: self._pprint_dict,
+            list: self._pprint_list,
+            tuple: self._pprint_tuple,
+            set: self._pprint_set,
+            frozenset: self._pprint_set,
+        }
+
+    def iter_format(self, obj):
+        return self._format(obj, 0, 0, set(), 0)
+
+    def _format(self, obj, indent, allowance, context, level):
+        pprint_container = self._dispatch.get(type(obj))
+        if pprint_container is None:
+            yield repr(obj)
+            return
+        if id(obj) in context:
+            yield _recursion(obj)
+            return
+        rep = self._repr(obj, self._width - indent - allowance, context, level)
+        if rep is not None:
+            yield rep
+            return
+        context.add(id(obj))
+        yield from pprint_container(obj, indent, allowance, context, level + 1)
+        context.discard(id(obj))
+
+    def _repr(self, obj, limit, context, level):
+        """
+        Returns:
+          one-line repr of `obj` as the builtin backend writes it,
+          None if it is longer than `limit`
+        """
+        obj_type = type(obj)
+        if obj_type not in self._dispatch or not obj:
+            text = repr(obj)
+            return text if len(text) <= limit else None
+        if (self._depth and level >= self._depth
+                and obj_type not in (set, frozenset)):
+            if obj_type is tuple and len(obj) == 1:
+                text = '(...,)'
+            else:
+                text = {dict: '{...}', list: '[...]', tuple: '(...)'}[obj_type]
+            return text if len(text) <= limit else None
+        if id(obj) in context:
+            text = _recursion(obj)
+            return text if len(text) <= limit else None
+        # every item takes at least 3 characters, e.g. "1, "
+        if 3 * len(obj) > limit + 1:
+            return None
+        if obj_type is dict:
+            items = sorted(obj.items(), key=_safe_tuple)
+        else:
+            items = obj
+        context.add(id(obj))
+        parts = []
+        used = 2
+        for item in items:
+            if obj_type is dict:
+                key = self._repr(item[0], limit - used, context, level + 1)
+                value = None
+                if key is not None:
+                    value = self._repr(item[1], limit - used - len(key) - 2,
+                                       context, level + 1)
+                rep = None if value is None else key + ': ' + value
+            else:
+                rep = self._repr(item, limit - used, context, level + 1)
+            if rep is None:
+                break
+            parts.append(rep)
+            used += len(rep) + 2
+        context.discard(id(obj))
+        if len(parts) < len(obj):
+            return None
+        text = ', '.join(parts)
+        if obj_type is dict:
+            text = '{' + text + '}'
+        elif obj_type is list:
+            text = '[' + text + ']'
+        elif obj_type is tuple:
+            text = '(' + text + (',)' if len(obj) == 1 else ')')
+        elif obj_type is set:
+            text = '{' + text + '}'
+        else:
+            text = 'frozenset({' + text + '})'
+        return text if len(text) <= limit else None
+
+    def _pprint_dict(self, obj, indent, allowance, context, level):
+        yield '{'
+        if self._indent > 1:
+            yield ' ' * (self._indent - 1)
+        if obj:
+            items = sorted(obj.items(), key=_safe_tuple)
+            yield from self._format_dict_items(
+                items, indent, allowance + 1, context, level
+            )
+        yield '}'
+
+    def _format_dict_items(self, items, indent, allowance, context, level):
+        indent += self._indent
+        delimnl = ',\n' + ' ' * indent
+        last_index = len(items) - 1
+        for i, (key, value) in enumerate(items):
+            last = i == last_index
+            rep = self._repr(key, float('inf'), context, level)
+            yield rep
+            yield ': '
+            yield from self._format(value, indent + len(rep) + 2,
+                                    allowance if last else 1,
+                                    context, level)
+            if not last:
+                yield delimnl
+
+    def _pprint_list(self, obj, indent, allowance, context, level):
+        yield '['
+        yield from self._format_items(obj, indent, allowance + 1,
+                                      context, level)
+        yield ']'
+
+    def _pprint_tuple(self, obj, indent, allowance, context, level):
+        yield '('
+        endchar = ',)' if len(obj) == 1 else ')'
+        yield from self._format_items(obj, indent, allowance + len(endchar),
+                                      context, level)
+        yield endchar
+
+    def _pprint_set(self, obj, indent, allowance, context, level):
+        if not obj:
+            yield repr(obj)
+            return
+        if type(obj) is set:
+            yield '{'
+            endchar = '}'
+        else:
+            yield 'frozenset({'
+            endchar = '})'
+            indent += len('frozenset') + 1
+        from pprint import _safe_key
+        yield from self._format_items(sorted(obj, key=_safe_key), indent,
+                                      allowance + len(endchar), context, level)
+        yield endchar
+
+    def _format_items(self, items, indent, allowance, context, level):
+        indent += self._indent
+        if self._indent > 1:
+            yield ' ' * (self._indent - 1)
+        delimnl = ',\n' + ' ' * indent
+        delim = ''
+        width = max_width = self._width - indent + 1
+        it = iter(items)
+        try:
+            next_item = next(it)
+        except StopIteration:
+            return
+        last = False
+        while not last:
+            item = next_item
+            try:
+                next_item = next(it)
+            except StopIteration:
+                last = True
+                max_width -= allowance
+                width -= allowance
+            if self._compact:
+                rep = self._repr(item, max_width, context, level)
+                w = float('inf') if rep is None else len(rep) + 2
+                if width < w:
+                    width = max_width
+                    if delim:
+                        delim = delimnl
+                if width >= w:
+                    width -= w
+                    yield delim
+                    delim = ', '
+                    yield rep
+                    continue
+            yield delim
+            delim = delimnl
+            yield from self._format(item, indent, allowance if last else 1,
+                                    context, level)
+
+
+def _iter_pp_obj(obj, indent, width, depth, compact):
+    "Streaming counterpart of _pp_obj_str(), yields small pieces"
+    if isinstance(obj, str):
+        yield obj
+        return
+    kwargs = _pp_kwargs(indent, width, depth, compact)
+    max_chars = _PP_CONFIG['max_chars']
+    obj = _truncate(obj, _PP_CONFIG['max_items'], max_chars)
+    pieces = _StreamingPrinter(**kwargs).iter_format(obj)
+    if max_chars is None:
+        yield from pieces
+        return
+    remaining = max_chars
+    for piece in pieces:
+        if len(piece) > remaining:
+            yield piece[:remaining] + '...'
+            return
+        remaining -= len(piece)
+        yield piece
+
+
+def _iter_chunks(pieces, chunk_size):
+    "Join small pieces into chunks of at least `chunk_size` characters"
+    if chunk_size == PP_DEFAULT:
+        chunk_size = _PP_CONFIG['chunk_size']
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def iter_pprintstr(*objs, sep=' ',
+                   indent=PP_DEFAULT, width=PP_DEFAULT, depth=PP_DEFAULT,
+                   compact=PP_DEFAULT, chunk_size=PP_DEFAULT):
+    """
+    pprintstr() as a generator of chunks of about `chunk_size` characters,
+    so that the whole string never has to be in memory. The layout is always
+    that of the builtin backend, and the result is not cached.
+    """
+    def pieces():
+        for i, obj in enumerate(objs):
+            if i:
+                yield sep
+            yield from _iter_pp_obj(obj, indent, width, depth, compact)
+    return _iter_chunks(pieces(), chunk_size)
+
+
+def iter_pprintfmtstr(msg, *fmt_args,
+                      indent=PP_DEFAULT, width=PP_DEFAULT, depth=PP_DEFAULT,
+                      compact=PP_DEFAULT, chunk_size=PP_DEFAULT,
+                      **fmt_kwargs):
+    """
+    pprintfmtstr() as a generator of chunks, see iter_pprintstr().
+    Replacement fields without a conversion or format spec are streamed,
+    the others are prettyprinted in full first, as pprintfmtstr() does.
+    """
+    import string
+    formatter = string.Formatter()
+
+    def pieces():
+        auto_index = 0
+        for literal, field, spec, conversion in formatter.parse(msg):
+            if literal:
+                yield literal
+            if field is None:
+                continue
+            if field == '':
+                field = str(auto_index)
+                auto_index += 1
+            obj, _ = formatter.get_field(field, fmt_args, fmt_kwargs)
+            if spec or conversion or isinstance(obj, (str, numbers.Number)):
+                value = _pp_obj_str(obj, indent, width, depth, compact,
+                                    _leave_number=True)
+                value = formatter.convert_field(value, conversion)
+                spec = formatter.vformat(spec, fmt_args, fmt_kwargs)
+                yield formatter.format_field(value, spec)
+            else:
+                yield from _iter_pp_obj(obj, indent, width, depth, compact)
+    return _iter_chunks(pieces(), chunk_size)
 
 
 def printerr(*args, **kwargs):
@@ -249,6 +932,24 @@ def pbannerfmt(msg, *fmt_args, symbol='=', banner_len=20, banner_lines=1,
 
 
 # ---------------- time formatting -----------------
+_TIME_ALIASES = [
+    ('MDY', '%m-%d-%y'),
+    ('YMD', '%y-%m-%d'),
+    ('DMY', '%d-%m-%y'),
+    ('YDM', '%y-%d-%m'),
+    ('MY', '%m-%y'),
+    ('YM', '%y-%m'),
+    ('MD', '%m-%d'),
+    ('DM', '%d-%m'),
+    ('HMS', '%H:%M:%S'),
+    ('HM', '%H:%M'),
+    ('MS', '%M:%S'),
+]
+# alias formatter -> translated format string
+_time_formatters = {}
+_TIME_CACHE_SIZE = 256
+
+
 def get_time_formatter(formatter):
     """
     Convenient aliases for common time formatter.
@@ -268,44 +969,90 @@ def get_time_formatter(formatter):
       "time: YMD MS" => "time: 18-12-25 38:05"
 
     Returns:
-      time format string with %
+      time format string with %, memoized per formatter
     """
     if formatter is None:
         return None
-    return (
-        formatter
-            .replace('MDY', '%m-%d-%y')
-            .replace('YMD', '%y-%m-%d')
-            .replace('DMY', '%d-%m-%y')
-            .replace('YDM', '%y-%d-%m')
-            .replace('MY', '%m-%y')
-            .replace('YM', '%y-%m')
-            .replace('MD', '%m-%d')
-            .replace('DM', '%d-%m')
-            .replace('HMS', '%H:%M:%S')
-            .replace('HM', '%H:%M')
-            .replace('MS', '%M:%S')
-    )
+    translated = _time_formatters.get(formatter)
+    if translated is None:
+        translated = formatter
+        for alias, spec in _TIME_ALIASES:
+            translated = translated.replace(alias, spec)
+        if len(_time_formatters) >= _TIME_CACHE_SIZE:
+            _time_formatters.clear()
+        _time_formatters[formatter] = translated
+    return translated
+
 
+# time.monotonic() never goes backwards, the offset anchors it to the epoch
+_MONOTONIC_OFFSET = time.time() - time.monotonic()
 
-def time2str(formatter):
+
+def monotonic_time():
+    """
+    Seconds since the epoch like time.time(), but from time.monotonic()
+    plus an offset taken at import: never jumps back when the system clock
+    is stepped, e.g. by NTP, at the price of drifting away from it.
+    """
+    return time.monotonic() + _MONOTONIC_OFFSET
+
+
+# per thread: formatter -> (second, strftime pieces around each %f)
+_time2str_cache = threading.local()
+
+
+def _split_subsecond(time_format):
+    "Split a strftime format around its %f (microsecond) fields"
+    pieces = ['']
+    for token in re.findall('%.|%|[^%]+', time_format):
+        if token == '%f':
+            pieces.append('')
+        else:
+            pieces[-1] += token
+    return pieces
+
+
+def time2str(formatter, monotonic=False):
     """
     https://docs.python.org/3/library/time.html#time.strftime
     %m - month; %d - day; %y - year
     %H - 24 hr; %I - 12 hr; %M - minute; %S - second; %p - AM or PM
+    %f - microseconds, unlike time.strftime()
+
+    See `get_time_formatter` for convenient aliases in formatter.
+    The strftime() text is cached per thread until the clock reaches the
+    next second, only %f is filled in on every call.
 
-    See `get_time_formatter` for convenient aliases in formatter
+    Args:
+      monotonic: True to read the time from `monotonic_time()`, so that
+        sub-second fields never run backwards
 
     Returns:
         string of the current time formatted with `formatter`
     """
-    if '%' not in formatter:
-        formatter = get_time_formatter(formatter)
-    return time.strftime(formatter)
+    now = monotonic_time() if monotonic else time.time()
+    second = int(now)
+    cache = _time2str_cache.__dict__
+    entry = cache.get(formatter)
+    if entry is None or entry[0] != second:
+        time_format = formatter
+        if '%' not in time_format:
+            time_format = get_time_formatter(time_format)
+        local = time.localtime(second)
+        pieces = [time.strftime(piece, local) if piece else ''
+                  for piece in _split_subsecond(time_format)]
+        if len(cache) >= _TIME_CACHE_SIZE:
+            cache.clear()
+        entry = cache[formatter] = (second, pieces)
+    pieces = entry[1]
+    if len(pieces) == 1:
+        return pieces[0]
+    return '{:06d}'.format(int((now - second) * 1e6)).join(pieces)
 
 
 def seconds2str(seconds):
     "Convert seconds to str `HH:MM:SS`"
+    import datetime
     return datetime.timedelta(seconds=seconds)
 
 
@@ -376,6 +1123,7 @@ def exception2str(exc):
 
 
 def signature2str(func):
+    import inspect
     return str(inspect.signature(func))
 
 
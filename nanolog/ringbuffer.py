@@ -0,0 +1,316 @@
+"""
+Shared-memory ring buffer: the logging process writes binary encoded records
+into an mmap'ed file, which costs no system call per record. A drain process
+reads them back and writes them through its own handlers. Since the buffer
+is a file, e.g. under /dev/shm, it also survives a crash of the writer and
+can be inspected afterwards.
+
+The writer never waits for the reader: when the buffer is full, the oldest
+records are overwritten. Every record has a sequence number, so the reader
+knows exactly which ones it missed.
+
+File layout: HEADER_SIZE bytes of header, then `capacity` bytes of data.
+Header fields, all little-endian uint64 after the 8-byte MAGIC:
+
+- capacity: size of the data region
+- version: seqlock, odd while the writer is modifying the buffer
+- head_pos, head_seq: total bytes and records ever written
+- tail_pos, tail_seq: byte position and sequence of the oldest intact record
+- overwritten: records overwritten by the writer, read or not
+- read_seq: next record the drain will read, written by the reader only
+- lost: records the drain never got, written by the reader only
+- pid: writer's process id
+
+Positions grow forever, the data offset is `pos % capacity`, so entries
+wrap around the end of the data region. An entry is a uint32 length
+followed by one self-contained nanolog.binary callsite and record frame.
+
+Only one process may write to a ring buffer, give every writer its own.
+"""
+
+import os
+import mmap
+import time
+import struct
+import logging as _logging
+from .binary import BinaryEncoder, BinaryDecoder
+
+
+MAGIC = b'NLRING\x00\x01'
+HEADER_SIZE = 128
+
+_U64 = struct.Struct('<Q')
+_U32 = struct.Struct('<I')
+
+# header field offsets
+_CAPACITY = 8
+_VERSION = 16
+_HEAD_POS = 24
+_HEAD_SEQ = 32
+_TAIL_POS = 40
+_TAIL_SEQ = 48
+_OVERWRITTEN = 56
+_READ_SEQ = 64
+_LOST = 72
+_PID = 80
+
+_FIELDS = [
+    ('capacity', _CAPACITY),
+    ('head_pos', _HEAD_POS),
+    ('head_seq', _HEAD_SEQ),
+    ('tail_pos', _TAIL_POS),
+    ('tail_seq', _TAIL_SEQ),
+    ('overwritten', _OVERWRITTEN),
+    ('read_seq', _READ_SEQ),
+    ('lost', _LOST),
+    ('pid', _PID),
+]
+
+
+def _read_data(buf, capacity, pos, size):
+    "Copy `size` bytes of the data region at `pos`, wrapping around the end"
+    offset = HEADER_SIZE + pos % capacity
+    first = min(size, HEADER_SIZE + capacity - offset)
+    if first == size:
+        return buf[offset:offset + size]
+    rest = HEADER_SIZE + size - first
+    return buf[offset:offset + first] + buf[HEADER_SIZE:rest]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # e.g. no permission to signal it, but it exists
+        pass
+    return True
+
+
+class RingBufferHandler(_logging.Handler):
+    """
+    Writes records into a shared-memory ring buffer, see this module's doc.
+    Read it with RingBufferReader or `python -m nanolog drain <file_name>`.
+    """
+    def __init__(self, file_name, capacity=4 * 1024 * 1024):
+        """
+        Args:
+          file_name: path of the buffer, /dev/shm/<name> keeps it in memory.
+            An existing buffer is reset.
+          capacity: size of the data region in bytes
+        """
+        super().__init__()
+        assert capacity > _U32.size, 'capacity too small'
+        self.file_name = os.path.expanduser(file_name)
+        self.capacity = capacity
+        self.too_large = 0  # records that don't fit the whole buffer
+        with open(self.file_name, 'w+b') as f:
+            f.truncate(HEADER_SIZE + capacity)
+            self._buf = mmap.mmap(f.fileno(), HEADER_SIZE + capacity)
+        buf = self._buf
+        buf[:len(MAGIC)] = MAGIC
+        _U64.pack_into(buf, _CAPACITY, capacity)
+        _U64.pack_into(buf, _PID, os.getpid())
+        # the fields below are only touched by this writer, keep them local
+        self._version = 0
+        self._head_pos = 0
+        self._head_seq = 0
+        self._tail_pos = 0
+        self._tail_seq = 0
+        self._overwritten = 0
+
+    def uses_caller(self):
+        return True
+
+    def emit(self, record):
+        if self._buf is None:
+            # closed, drop the record like a handler whose stream is gone
+            return
+        try:
+            payload = BinaryEncoder().encode(record)
+        except Exception:
+            self.handleError(record)
+            return
+        size = _U32.size + len(payload)
+        if size > self.capacity:
+            self.too_large += 1
+            return
+        buf = self._buf
+        capacity = self.capacity
+        self._version += 1
+        _U64.pack_into(buf, _VERSION, self._version)
+        # make room by retiring the oldest entries. The tail is published
+        # before the data is overwritten, so that the header stays valid
+        # if this process dies halfway through
+        while self._head_pos + size - self._tail_pos > capacity:
+            length, = _U32.unpack(_read_data(buf, capacity, self._tail_pos,
+                                             _U32.size))
+            self._tail_pos += _U32.size + length
+            self._tail_seq += 1
+            self._overwritten += 1
+        _U64.pack_into(buf, _TAIL_POS, self._tail_pos)
+        _U64.pack_into(buf, _TAIL_SEQ, self._tail_seq)
+        _U64.pack_into(buf, _OVERWRITTEN, self._overwritten)
+        entry = _U32.pack(len(payload)) + payload
+        offset = HEADER_SIZE + self._head_pos % capacity
+        first = min(size, HEADER_SIZE + capacity - offset)
+        buf[offset:offset + first] = entry[:first]
+        if first < size:
+            buf[HEADER_SIZE:HEADER_SIZE + size - first] = entry[first:]
+        self._head_pos += size
+        self._head_seq += 1
+        _U64.pack_into(buf, _HEAD_POS, self._head_pos)
+        _U64.pack_into(buf, _HEAD_SEQ, self._head_seq)
+        self._version += 1
+        _U64.pack_into(buf, _VERSION, self._version)
+
+    def flush(self):
+        "Not needed for the drain, only to persist the buffer to a disk file"
+        if self._buf is not None:
+            self._buf.flush()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._buf is not None:
+                self._buf.close()
+                self._buf = None
+        finally:
+            self.release()
+        super().close()
+
+
+class RingBufferReader:
+    """
+    Reads a ring buffer written by RingBufferHandler, either live from a
+    drain process or post mortem from a crash-dump tool.
+
+    - `snapshot()` returns every record still intact, without consuming
+    - `drain()` returns the records written since the last drain() and
+      accounts for the ones overwritten before they could be read
+    - `stats()` returns the header counters
+    """
+    def __init__(self, file_name, readonly=False, stuck_timeout=1.0):
+        """
+        Args:
+          file_name: path given to RingBufferHandler
+          readonly: True to only inspect, drain() then doesn't store
+            its position in the buffer
+          stuck_timeout: seconds to wait for a writer that is alive but
+            stopped in the middle of a write, e.g. in a debugger
+        """
+        self.file_name = os.path.expanduser(file_name)
+        self.readonly = readonly
+        self.stuck_timeout = stuck_timeout
+        with open(self.file_name, 'rb' if readonly else 'r+b') as f:
+            access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+            self._buf = mmap.mmap(f.fileno(), 0, access=access)
+        if self._buf[:len(MAGIC)] != MAGIC:
+            self._buf.close()
+            raise ValueError('{} is not a nanolog ring buffer'
+                             .format(self.file_name))
+        self.capacity = _U64.unpack_from(self._buf, _CAPACITY)[0]
+        self.pid = _U64.unpack_from(self._buf, _PID)[0]
+        self.read_seq = _U64.unpack_from(self._buf, _READ_SEQ)[0]
+        self.lost = _U64.unpack_from(self._buf, _LOST)[0]
+
+    def stats(self):
+        """
+        Returns:
+          dict of the header fields, plus `wraps`: the number of times the
+          writer went around the end of the buffer
+        """
+        while True:
+            version = self._stable_version()
+            stats = {name: _U64.unpack_from(self._buf, offset)[0]
+                     for name, offset in _FIELDS}
+            if version == _U64.unpack_from(self._buf, _VERSION)[0]:
+                break
+        stats['wraps'] = stats['head_pos'] // stats['capacity']
+        return stats
+
+    def _stable_version(self):
+        """
+        Wait until the writer is not in the middle of an update.
+
+        Returns:
+          the seqlock version, odd if the writer died (or hangs) during an
+          update, in which case the header still describes intact entries
+        """
+        deadline = None
+        while True:
+            version = _U64.unpack_from(self._buf, _VERSION)[0]
+            if not version & 1:
+                return version
+            if deadline is None:
+                deadline = time.time() + self.stuck_timeout
+            elif time.time() > deadline or not _pid_alive(self.pid):
+                return version
+            time.sleep(0)
+
+    def _read_entries(self, from_seq):
+        """
+        Returns:
+          (list of (seq, payload) from max(from_seq, tail_seq) to the head,
+           tail_seq and head_seq at the time of the copy)
+        """
+        buf = self._buf
+        capacity = self.capacity
+        while True:
+            version = self._stable_version()
+            head_pos = _U64.unpack_from(buf, _HEAD_POS)[0]
+            head_seq = _U64.unpack_from(buf, _HEAD_SEQ)[0]
+            tail_pos = _U64.unpack_from(buf, _TAIL_POS)[0]
+            tail_seq = _U64.unpack_from(buf, _TAIL_SEQ)[0]
+            if version != _U64.unpack_from(buf, _VERSION)[0]:
+                continue
+            data = _read_data(buf, capacity, tail_pos, head_pos - tail_pos)
+            if version == _U64.unpack_from(buf, _VERSION)[0]:
+                break
+            # the writer moved on during the copy, the entries we need
+            # may have been overwritten, try again
+        entries = []
+        pos = 0
+        for seq in range(tail_seq, head_seq):
+            length, = _U32.unpack_from(data, pos)
+            pos += _U32.size
+            if seq >= from_seq:
+                entries.append((seq, data[pos:pos + length]))
+            pos += length
+        return entries, tail_seq, head_seq
+
+    def _decode(self, entries):
+        records = []
+        for _, payload in entries:
+            records.extend(BinaryDecoder(pid=self.pid).feed(payload))
+        return records
+
+    def snapshot(self):
+        "Every record still in the buffer, oldest first"
+        entries, _, _ = self._read_entries(0)
+        return self._decode(entries)
+
+    def drain(self):
+        """
+        Returns:
+          records written since the last drain(), oldest first.
+          Records overwritten in between are added to `self.lost`.
+        """
+        entries, tail_seq, head_seq = self._read_entries(self.read_seq)
+        if head_seq < self.read_seq:
+            # a new writer has reset the buffer
+            self.read_seq = 0
+            entries, tail_seq, head_seq = self._read_entries(0)
+        if tail_seq > self.read_seq:
+            self.lost += tail_seq - self.read_seq
+        if entries:
+            self.read_seq = entries[-1][0] + 1
+        else:
+            self.read_seq = max(self.read_seq, tail_seq)
+        if not self.readonly:
+            _U64.pack_into(self._buf, _READ_SEQ, self.read_seq)
+            _U64.pack_into(self._buf, _LOST, self.lost)
+        return self._decode(entries)
+
+    def close(self):
+        self._buf.close()
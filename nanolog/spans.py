@@ -0,0 +1,169 @@
+"""
+Timing statistics for `Logger.span()`: every finished span adds its duration
+to a SpanRegistry, which keeps count, total, min, max and a QuantileSketch
+per span name, in constant memory.
+
+Usage:
+    with logger.span('load_batch'):
+        ...
+
+    @logger.span('train_step', level='info')
+    def train_step(batch):
+        ...
+
+    logger.log_span_stats()  # or span_registry.to_json()
+"""
+
+import math
+import json
+import threading
+
+
+class QuantileSketch:
+    """
+    Streaming quantile estimate with bounded relative error: values are
+    counted in logarithmic buckets, so that every quantile is off by at most
+    `relative_accuracy` of its true value, e.g. 1%. Memory grows with the
+    log of the value range, not with the number of values. Same scheme as
+    DDSketch (Masson et al., VLDB 2019).
+    """
+    def __init__(self, relative_accuracy=0.01):
+        assert 0 < relative_accuracy < 1, 'relative_accuracy must be in (0, 1)'
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = {}
+        self._zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        "`value` must not be negative"
+        self.count += 1
+        if value <= 0:
+            self._zeros += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        buckets = self._buckets
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        """
+        Args:
+          q: between 0 and 1, e.g. 0.99
+
+        Returns:
+          estimated value at quantile `q`, None if nothing was added
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                # midpoint of the bucket (gamma^(i-1), gamma^i]
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+    def merge(self, other):
+        "Add the values counted by another sketch of the same accuracy"
+        assert other.relative_accuracy == self.relative_accuracy
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self._zeros += other._zeros
+        self.count += other.count
+
+
+class _SpanStats:
+    __slots__ = ('count', 'total', 'min', 'max', 'sketch')
+
+    def __init__(self, relative_accuracy):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total += duration_ns
+        if self.min is None or duration_ns < self.min:
+            self.min = duration_ns
+        if self.max is None or duration_ns > self.max:
+            self.max = duration_ns
+        self.sketch.add(duration_ns)
+
+    def summary(self, quantiles):
+        summary = {
+            'count': self.count,
+            'total_ms': self.total / 1e6,
+            'mean_ms': self.total / self.count / 1e6,
+            'min_ms': self.min / 1e6,
+            'max_ms': self.max / 1e6,
+        }
+        for q in quantiles:
+            # the sketch's estimate may stray a little outside [min, max]
+            value = min(max(self.sketch.quantile(q), self.min), self.max)
+            summary['p{:g}_ms'.format(q * 100)] = value / 1e6
+        return summary
+
+
+class SpanRegistry:
+    """
+    Per-name duration statistics of finished spans, safe to share between
+    threads. `span_registry` is the process-wide default.
+    """
+    def __init__(self, quantiles=(0.5, 0.99), relative_accuracy=0.01):
+        """
+        Args:
+          quantiles: reported by `stats()`, e.g. 0.99 as "p99_ms"
+          relative_accuracy: max relative error of the quantile estimates
+        """
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration_ns):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _SpanStats(self.relative_accuracy)
+            stats.add(duration_ns)
+
+    def stats(self, reset=False):
+        """
+        Args:
+          reset: True to start over afterwards, e.g. for periodic reports
+
+        Returns:
+          {span name: {'count', 'total_ms', 'mean_ms', 'min_ms', 'max_ms',
+                       'p50_ms', 'p99_ms', ...}}, sorted by name
+        """
+        with self._lock:
+            stats = self._stats
+            if reset:
+                self._stats = {}
+        return {name: stats[name].summary(self.quantiles)
+                for name in sorted(stats)}
+
+    def to_json(self, reset=False, **json_kwargs):
+        "`stats()` as a JSON string, `json_kwargs` go to json.dumps()"
+        return json.dumps(self.stats(reset=reset), **json_kwargs)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+span_registry = SpanRegistry()
+
+
+def format_duration(duration_ns):
+    "e.g. 812ns, 45.2us, 3.07ms, 1.5s"
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if duration_ns >= scale:
+            return '{:.3g}{}'.format(duration_ns / scale, unit)
+    return '{}ns'.format(duration_ns)
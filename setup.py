@@ -20,6 +20,7 @@ setup(
     packages=['nanolog'],
     entry_points={
         'console_scripts': [
+            'nanolog=nanolog.__main__:main',
         ]
     },
     classifiers=[
@@ -0,0 +1,112 @@
+import json
+import logging
+import nanolog as nl
+import nanolog.__main__
+import pytest
+
+
+@pytest.fixture
+def logger(tmpdir):
+    logger = nl.Logger.create_logger('binary_test', stream=None, level='trace')
+    logger.add_binary_handler(str(tmpdir.join('log.bin')))
+    yield logger
+    logger.close()
+
+
+def _log_lines(logger):
+    for i in range(3):
+        logger.trace('step', i, 1/3., None, True, {'a': [i]})
+    logger.warnfmt('{:>5d} {name} {:.2f}', 7, 3.5, name='x')
+    logger.infopp({'b': 2})
+    logger.error('unicode ☃', -2**70)
+
+
+def test_binary_roundtrip(tmpdir, logger):
+    _log_lines(logger)
+    try:
+        1/0
+    except ZeroDivisionError as e:
+        logger.exception('oops', exc=e)
+    logger.close()
+    records = list(nl.iter_binary_log(str(tmpdir.join('log.bin'))))
+    messages = [record.getMessage() for record in records]
+    assert messages[:6] == [
+        "step 0 0.3333333333333333 None True {'a': [0]}",
+        "step 1 0.3333333333333333 None True {'a': [1]}",
+        "step 2 0.3333333333333333 None True {'a': [2]}",
+        '    7 x 3.50',
+        "{'b': 2}",
+        'unicode ☃ -1180591620717411303424',
+    ]
+    assert 'ZeroDivisionError' in messages[6]
+    assert [r.levelname for r in records] == \
+        ['TRACE'] * 3 + ['WARNING', 'INFO', 'ERROR', 'ERROR']
+    assert {r.filename for r in records} == {'test_binary.py'}
+    assert records[0].funcName == '_log_lines'
+    assert records[0].name == 'binary_test'
+    created = [r.created for r in records]
+    assert created == sorted(created)
+
+
+def test_binary_sessions(tmpdir, logger, monkeypatch):
+    file_name = str(tmpdir.join('log.bin'))
+    _log_lines(logger)
+    logger.close()
+    logger.add_binary_handler(file_name)
+    _log_lines(logger)
+    logger.close()
+    records = list(nl.iter_binary_log(file_name))
+    assert len(records) == 12
+    assert records[0].getMessage() == records[6].getMessage()
+    # callsites are written once per session
+    with open(file_name, 'rb') as f:
+        assert f.read().count(b'_log_lines') == 2 * 4
+    # a crash in the middle of a write leaves a truncated tail
+    with open(file_name, 'ab') as f:
+        f.write(b'\x50\x02')
+    assert len(list(nl.iter_binary_log(file_name))) == 12
+    # frames and session headers split across read chunks
+    monkeypatch.setattr(nanolog.binary, '_READ_CHUNK_SIZE', 5)
+    assert ([r.getMessage() for r in nl.iter_binary_log(file_name)]
+            == [r.getMessage() for r in records])
+
+
+def test_binary_bad_format(tmpdir):
+    # outside the logger hierarchy, where pytest's handlers would raise
+    file_name = str(tmpdir.join('log.bin'))
+    logger = nl.Logger(logging.Logger('bad_format_test'))
+    logger.add_binary_handler(file_name)
+    logger.info('before')
+    logger.infofmt('bad {1}', 'a')
+    logger.infofmt('missing {k}', 'a', x=1)
+    logger.info('after')
+    logger.close()
+    messages = [r.getMessage() for r in nl.iter_binary_log(file_name)]
+    assert messages == ['before', "bad {1} 'a'", "missing {k} 'a' x=1",
+                        'after']
+
+
+def test_decode_cli(tmpdir, logger, capsys):
+    _log_lines(logger)
+    logger.close()
+    file_name = str(tmpdir.join('log.bin'))
+    nanolog.__main__.main(['decode', file_name, '--format', 'jsonl'])
+    lines = capsys.readouterr().out.splitlines()
+    assert json.loads(lines[3])['message'] == '    7 x 3.50'
+    nanolog.__main__.main(['decode', file_name, '-f', '{filename} '])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[4] == "test_binary.py [INFO]> {'b': 2}"
+
+
+def test_binary_decoder_split(tmpdir, logger):
+    _log_lines(logger)
+    logger.close()
+    with open(str(tmpdir.join('log.bin')), 'rb') as f:
+        data = f.read()
+    expected = [r.getMessage() for r in nl.iter_binary_log(str(tmpdir.join('log.bin')))]
+    decoder = nl.BinaryDecoder()
+    messages = []
+    for i in range(len(data)):
+        messages.extend(r.getMessage() for r in decoder.feed(data[i:i + 1]))
+    assert messages == expected
+    assert decoder.pending_bytes() == 0
@@ -0,0 +1,100 @@
+import os
+import time
+import logging
+import multiprocessing
+import nanolog as nl
+import pytest
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def collector(tmpdir):
+    target = ListHandler()
+    logger = nl.Logger.create_logger('collector_test', stream=None)
+    logger.logger.addHandler(target)
+    collector = nl.LogCollector(str(tmpdir.join('log.sock')), logger,
+                                merge_window=0.05).start()
+    yield collector, target
+    collector.close()
+    logger.close()
+
+
+def _worker(address, worker_id):
+    logger = nl.Logger.create_logger('worker{}'.format(worker_id), stream=None)
+    logger.add_socket_handler(address, batch_size=8)
+    for i in range(50):
+        logger.info('worker', worker_id, 'step', i)
+    logger.close()
+
+
+def test_parse_address():
+    assert nl.parse_address(9020)[1] == ('localhost', 9020)
+    assert nl.parse_address('9020')[1] == ('localhost', 9020)
+    assert nl.parse_address('127.0.0.1:9020')[1] == ('127.0.0.1', 9020)
+    assert nl.parse_address('/tmp/log.sock')[1] == '/tmp/log.sock'
+
+
+def test_collect_processes(collector):
+    collector, target = collector
+    workers = [
+        multiprocessing.Process(target=_worker, args=(collector.address, i))
+        for i in range(4)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    collector.close()
+    assert len(target.records) == 200
+    for i in range(4):
+        messages = [r.getMessage() for r in target.records
+                    if r.name == 'worker{}'.format(i)]
+        assert messages == ['worker {} step {}'.format(i, j) for j in range(50)]
+    assert len({r.process for r in target.records}) == 4
+    created = [r.created for r in target.records]
+    assert created == sorted(created)
+
+
+def test_socket_reconnect(tmpdir):
+    address = str(tmpdir.join('log.sock'))
+    handler = nl.SocketHandler(address, buffer_size=5, batch_size=1,
+                               reconnect_interval=0.01,
+                               max_reconnect_interval=0.01)
+    logger = nl.Logger.create_logger('reconnect_test', stream=None)
+    logger.logger.addHandler(handler)
+    for i in range(8):
+        logger.info('early', i)
+    time.sleep(0.05)  # collector is down, the sender keeps retrying
+    target = ListHandler()
+    raw_logger = logging.getLogger('reconnect_collector')
+    raw_logger.addHandler(target)
+    collector = nl.LogCollector(address, raw_logger, merge_window=0).start()
+    handler.flush()
+    logger.info('late')
+    handler.flush()
+    collector.close()
+    logger.close()
+    assert handler.dropped == 3
+    assert [r.getMessage() for r in target.records] == \
+        ['early {}'.format(i) for i in range(3, 8)] + ['late']
+    assert not os.path.exists(address)
+
+
+def test_socket_flush_interval(collector):
+    collector, target = collector
+    logger = nl.Logger.create_logger('interval_test', stream=None)
+    logger.add_socket_handler(collector.address, flush_interval=0.01)
+    logger.info('lone record')
+    deadline = time.time() + 5
+    while not target.records and time.time() < deadline:
+        time.sleep(0.01)
+    assert [r.getMessage() for r in target.records] == ['lone record']
+    logger.close()
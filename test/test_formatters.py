@@ -0,0 +1,93 @@
+import json
+import logging
+import pytest
+import nanolog as nl
+
+
+def _make_record(msg, args=(), exc_info=None, **extra):
+    record = logging.LogRecord('test', nl.INFO3, '/path/to/file.py', 42,
+                               msg, args, exc_info, func='func')
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    formatter = nl.JsonFormatter(['levelname', 'lineno', 'message'])
+    line = formatter.format(_make_record('hello %s', ('world',),
+                                         run_id=7, obj=object()))
+    assert '\n' not in line
+    obj = json.loads(line)
+    assert list(obj)[:3] == ['levelname', 'lineno', 'message']
+    assert obj['levelname'] == 'INFO3'
+    assert obj['lineno'] == 42
+    assert obj['message'] == 'hello world'
+    assert obj['run_id'] == 7
+    assert obj['obj'].startswith('<object')
+    assert formatter.uses_caller()
+    assert not nl.JsonFormatter(['message']).uses_caller()
+
+
+def test_json_formatter_exception():
+    try:
+        1/0
+    except ZeroDivisionError:
+        import sys
+        record = _make_record('multi\nline', exc_info=sys.exc_info())
+    obj = json.loads(nl.JsonFormatter(['asctime', 'message']).format(record))
+    assert obj['message'] == 'multi\nline'
+    assert 'ZeroDivisionError' in obj['exc_text']
+    assert obj['asctime']
+
+
+def test_compiled_formatter():
+    import sys
+    try:
+        1/0
+    except ZeroDivisionError:
+        exc_info = sys.exc_info()
+    formats = [
+        ('{asctime} [{levelname}]> {message}', '%y-%m-%d %H:%M:%S'),
+        ('{asctime} {message}', None),
+        ("{name!r} {lineno:>5d} {funcName}() {{literal}} 'q' \"dq\" \\ {message}",
+         None),
+        ('{filename:>16s}:{lineno} {msecs:03.0f} {message}\n', '%H:%M'),
+        ('', None),
+        ('{name[0]} {message}', None),  # falls back to the stdlib
+    ]
+    for fmt, datefmt in formats:
+        expected = logging.Formatter(fmt, datefmt, style='{')
+        formatter = nl.CompiledFormatter(fmt, datefmt)
+        assert (formatter._render is None) == ('{name[' in fmt)
+        records = [
+            _make_record('hello {}', created=1500000000.25, msecs=250.0),
+            _make_record('later', created=1500000000.75, msecs=750.0),
+            _make_record('next second', created=1500000001.5, msecs=500.0),
+            _make_record('error', exc_info=exc_info),
+            _make_record('stack', stack_info='Stack (most recent call last):'),
+        ]
+        for record in records:
+            assert formatter.format(record) == expected.format(record)
+
+
+def test_compiled_formatter_missing_field():
+    formatter = nl.CompiledFormatter('{nonexistent} {message}')
+    with pytest.raises(ValueError, match='nonexistent'):
+        formatter.format(_make_record('msg'))
+
+
+def test_bound_context():
+    context = nl.BoundContext({'run_id': 'r 1', 'n': 2})
+    child = nl.BoundContext({'obj': object()}, parent=context)
+    assert child.prefix.startswith('run_id="r 1" n=2 obj="<object')
+    assert list(child.fields) == ['run_id', 'n', 'obj']
+    formatter = nl.CompiledFormatter('{levelname} {message}')
+    assert (formatter.format(_make_record('msg', context=context))
+            == 'INFO3 run_id="r 1" n=2 msg')
+    formatter = nl.CompiledFormatter('[{context}] {message}')
+    assert formatter.format(_make_record('msg', context=context)) \
+        == '[run_id="r 1" n=2] msg'
+    assert formatter.format(_make_record('msg')) == '[] msg'
+    obj = json.loads(nl.JsonFormatter(['message']).format(
+        _make_record('msg', context=child)))
+    assert obj['run_id'] == 'r 1' and obj['n'] == 2
+    assert obj['obj'].startswith('<object')
@@ -0,0 +1,360 @@
+import threading
+import logging
+import nanolog as nl
+import pytest
+
+
+class ListHandler(logging.Handler):
+    "Collects formatted messages, optionally waiting on a gate first"
+    def __init__(self, gate=None):
+        super().__init__()
+        self.messages = []
+        self.gate = gate
+
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+def _make_record(msg, level=logging.INFO):
+    return logging.LogRecord('test', level, __file__, 0, msg, (), None)
+
+
+def test_queued_flush():
+    target = ListHandler()
+    handler = nl.QueuedHandler([target])
+    for i in range(100):
+        handler.handle(_make_record(str(i)))
+    handler.flush()
+    assert target.messages == [str(i) for i in range(100)]
+    assert handler.pending() == 0
+    handler.close()
+
+
+@pytest.mark.parametrize('overflow', ['drop_oldest', 'drop_newest'])
+def test_queued_overflow(overflow):
+    gate = threading.Event()
+    target = ListHandler(gate)
+    handler = nl.QueuedHandler([target], queue_size=3, overflow=overflow)
+    handler.handle(_make_record('stuck'))
+    # wait until the writer holds 'stuck' and the queue is empty again
+    while handler._queue:
+        pass
+    for i in range(5):
+        handler.handle(_make_record(str(i)))
+    assert handler.dropped == 2
+    gate.set()
+    handler.close()
+    if overflow == 'drop_oldest':
+        assert target.messages == ['stuck', '2', '3', '4']
+    else:
+        assert target.messages == ['stuck', '0', '1', '2']
+
+
+def test_queued_block():
+    target = ListHandler()
+    handler = nl.QueuedHandler([target], queue_size=2, overflow='block')
+    threads = [
+        threading.Thread(target=lambda: [handler.handle(_make_record('x'))
+                                         for _ in range(50)])
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    handler.close()
+    assert len(target.messages) == 200
+    assert handler.dropped == 0
+
+
+def test_queued_target_level():
+    target = ListHandler()
+    target.setLevel(logging.WARNING)
+    handler = nl.QueuedHandler([target])
+    handler.handle(_make_record('info', logging.INFO))
+    handler.handle(_make_record('error', logging.ERROR))
+    handler.close()
+    assert target.messages == ['error']
+
+
+@pytest.mark.parametrize('render_in_writer', [False, True])
+def test_queued_render_thread(render_in_writer):
+    threads = []
+
+    def render():
+        threads.append(threading.current_thread())
+        return 'msg'
+
+    target = ListHandler()
+    handler = nl.QueuedHandler([target], render_in_writer=render_in_writer)
+    handler.handle(_make_record(nl.DeferredMessage(render)))
+    handler.close()
+    assert target.messages == ['msg']
+    assert (threads[0] is threading.current_thread()) != render_in_writer
+
+
+def test_buffered_file(tmpdir):
+    file_name = str(tmpdir.join('buffered.log'))
+    handler = nl.BufferedFileHandler(file_name, buffer_bytes=20,
+                                     flush_interval=None)
+    handler.handle(_make_record('0123456789'))
+    assert tmpdir.join('buffered.log').read() == ''
+    handler.handle(_make_record('0123456789'))
+    assert tmpdir.join('buffered.log').read() == '0123456789\n' * 2
+    handler.handle(_make_record('info'))
+    handler.handle(_make_record('error', logging.ERROR))
+    assert tmpdir.join('buffered.log').read().endswith('info\nerror\n')
+    handler.handle(_make_record('last'))
+    handler.close()
+    assert tmpdir.join('buffered.log').read().endswith('error\nlast\n')
+
+
+def test_buffered_file_interval(tmpdir):
+    import time
+    file_name = str(tmpdir.join('buffered.log'))
+    handler = nl.BufferedFileHandler(file_name, flush_interval=0.01)
+    handler.handle(_make_record('hello'))
+    deadline = time.time() + 5
+    while not tmpdir.join('buffered.log').read() and time.time() < deadline:
+        time.sleep(0.01)
+    assert tmpdir.join('buffered.log').read() == 'hello\n'
+    handler.close()
+
+
+@pytest.mark.parametrize('compress', [None, 'gz', 'xz'])
+def test_rotating_file_size(tmpdir, compress):
+    file_name = str(tmpdir.join('rotating.log'))
+    handler = nl.RotatingFileHandler(file_name, max_bytes=25, keep=2,
+                                     compress=compress)
+    for i in range(10):
+        handler.handle(_make_record('message {}'.format(i)))
+    handler.close()
+    segments = handler.segments()
+    assert len(segments) == 2
+    if compress:
+        assert all(s.endswith('.' + compress) for s in segments)
+        module = {'gz': 'gzip', 'xz': 'lzma'}[compress]
+        opener = __import__(module).open
+    else:
+        opener = open
+    with opener(segments[-1], 'rt') as f:
+        assert f.read() == 'message 6\nmessage 7\n'
+    assert tmpdir.join('rotating.log').read() == 'message 8\nmessage 9\n'
+
+
+def test_rotating_file_prune_pending(tmpdir, capsys):
+    # segments are pruned faster than the compressor catches up
+    file_name = str(tmpdir.join('rotating.log'))
+    handler = nl.RotatingFileHandler(file_name, max_bytes=200, keep=1,
+                                     compress='xz')
+    for i in range(400):
+        handler.handle(_make_record('message {}'.format(i)))
+    handler.close()
+    assert 'Logging error' not in capsys.readouterr().err
+    segments = handler.segments()
+    assert len(segments) == 1 and segments[0].endswith('.xz')
+
+
+def test_rotating_file_time(tmpdir):
+    file_name = str(tmpdir.join('rotating.log'))
+    handler = nl.RotatingFileHandler(file_name, rotate_every=3600,
+                                     compress=None)
+    handler.handle(_make_record('old'))
+    handler._rotate_at = 0
+    handler.handle(_make_record('new'))
+    handler.close()
+    segments = handler.segments()
+    assert len(segments) == 1
+    assert open(segments[0]).read() == 'old\n'
+    assert tmpdir.join('rotating.log').read() == 'new\n'
+
+
+@pytest.mark.parametrize('max_bytes', [None, 10000])
+def test_flight_recorder(max_bytes):
+    target = ListHandler()
+    handler = nl.FlightRecorderHandler([target], capacity=3,
+                                       max_bytes=max_bytes)
+    for i in range(5):
+        handler.handle(_make_record('debug {}'.format(i), logging.DEBUG))
+    handler.handle(_make_record('info'))
+    assert target.messages == ['info']
+    assert len(handler.records()) == 3 if max_bytes is None else 5
+    handler.handle(_make_record('error', logging.ERROR))
+    recorded = ['debug 2', 'debug 3', 'debug 4'] if max_bytes is None \
+        else ['debug {}'.format(i) for i in range(5)]
+    assert target.messages[1:] == [
+        '----- flight recorder: last {} records -----'.format(len(recorded))
+    ] + recorded + ['----- flight recorder: end -----', 'error']
+    assert handler.records() == []
+    handler.handle(_make_record('error'))
+    assert target.messages[-1] == 'error'
+    handler.close()
+
+
+def test_flight_recorder_max_bytes():
+    target = ListHandler()
+    handler = nl.FlightRecorderHandler([target], max_bytes=1000)
+    for i in range(100):
+        handler.handle(_make_record('debug {}'.format(i), logging.DEBUG))
+    records = handler.records()
+    assert 0 < len(records) < 50
+    assert records[-1].getMessage() == 'debug 99'
+    handler.close()
+
+
+def test_dedup_consecutive():
+    target = ListHandler()
+    handler = nl.DedupHandler([target])
+    for msg in ['a', 'a', 'a', 'b', 'a', 'b', 'b']:
+        handler.handle(_make_record(msg))
+    handler.handle(_make_record('b', logging.WARNING))
+    handler.flush()
+    assert target.messages == [
+        'a', 'last message repeated 2 times', 'b', 'a',
+        'b', 'last message repeated 1 time', 'b'
+    ]
+    handler.close()
+
+
+def test_dedup_window():
+    target = ListHandler()
+    handler = nl.DedupHandler([target], window=10)
+    for i, msg in enumerate(['a', 'b', 'a', 'b', 'a', 'c']):
+        record = _make_record(msg)
+        record.created = 1000 + i
+        handler.handle(record)
+    record = _make_record('a')
+    record.created = 1010.5
+    handler.handle(record)
+    assert target.messages == [
+        'a', 'b', 'c', 'last message repeated 2 times', 'a'
+    ]
+    handler.close()
+    assert target.messages[-1] == 'last message repeated 1 time'
+
+
+def test_shared_file(tmpdir):
+    file_name = str(tmpdir / 'shared.log')
+    loggers = [nl.Logger.create_logger('shared{}'.format(i), stream=None,
+                                       file_name=file_name, file_mode='w')
+               for i in range(3)]
+    handlers = [logger.handlers[0] for logger in loggers]
+    assert len({id(h.stream) for h in handlers}) == 1
+    assert len({id(h.lock) for h in handlers}) == 1
+
+    def write(logger):
+        for i in range(200):
+            logger.info(logger.name, 'x' * 100, i)
+
+    threads = [threading.Thread(target=write, args=(logger,))
+               for logger in loggers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    loggers[0].close()
+    assert not handlers[1].stream.closed
+    loggers[1].info('still open')
+    stream = handlers[2].stream
+    loggers[1].close()
+    loggers[2].close()
+    assert stream.closed
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 601
+    assert all(line.endswith('still open') or line.split()[1] == 'x' * 100
+               for line in lines)
+
+
+def test_shared_file_rerun(tmpdir):
+    import gc
+    file_name = str(tmpdir / 'rerun.log')
+    logger = nl.Logger.create_logger('rerun', stream=None,
+                                     file_name=file_name, file_mode='w')
+    logger.info('first run')
+    other = nl.Logger.create_logger('rerun_other', stream=None,
+                                    file_name=file_name, file_mode='a')
+    # create_logger closes the replaced handler, its 'w' starts over
+    logger = nl.Logger.create_logger('rerun', stream=None,
+                                     file_name=file_name, file_mode='w')
+    logger.info('second run')
+    other.info('other')
+    logger.close()
+    other.close()
+    with open(file_name) as f:
+        assert f.read() == 'second run\nother\n'
+    del logger, other
+    gc.collect()
+    assert file_name not in nl.handlers._shared_files
+
+
+def test_shared_formatter():
+    import io
+    streams = [io.StringIO() for _ in range(3)]
+    logger = nl.Logger.create_logger('shared_formatter', stream=streams,
+                                     time_format='HMS', show_level=True)
+    other = nl.Logger.create_logger('shared_formatter2', stream=streams[0],
+                                    time_format='HMS', show_level=True)
+    assert logger.handlers[0].formatter is other.handlers[0].formatter
+
+    def shout(record):
+        record.levelname = 'LOUD'
+        return True
+
+    # every handler formats the record as its filters left it
+    logger.handlers[1].addFilter(shout)
+    logger.info('fan', 'out')
+    assert streams[0].getvalue().endswith(' [INFO]> fan out\n')
+    assert streams[1].getvalue().endswith(' [LOUD]> fan out\n')
+    logger.remove_all_handlers()
+    other.remove_all_handlers()
+
+
+def test_thread_buffered():
+    target = ListHandler()
+    handler = nl.ThreadBufferedHandler([target], flush_interval=10)
+
+    def write(name):
+        for i in range(100):
+            handler.handle(_make_record('{} {}'.format(name, i)))
+
+    threads = [threading.Thread(target=write, args=(str(n),))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert target.messages == []
+    handler.flush()
+    assert len(target.messages) == 800
+    for n in range(8):
+        own = [m for m in target.messages if m.split()[0] == str(n)]
+        assert own == ['{} {}'.format(n, i) for i in range(100)]
+    # dead threads' empty buffers are dropped
+    handler.flush()
+    assert handler._buffers == []
+    handler.handle(_make_record('error', logging.ERROR))
+    for _ in range(100):
+        if len(target.messages) == 801:
+            break
+        threading.Event().wait(0.01)
+    assert target.messages[-1] == 'error'
+    handler.close()
+
+
+def test_thread_buffered_order():
+    target = ListHandler()
+    handler = nl.ThreadBufferedHandler([target], flush_interval=10)
+    records = [_make_record(str(i)) for i in range(6)]
+    for i, record in enumerate(records):
+        record.created = i
+    # two threads, interleaved timestamps
+    write = lambda rs: [handler.handle(r) for r in rs]
+    for rs in (records[0::2], records[1::2]):
+        thread = threading.Thread(target=write, args=(rs,))
+        thread.start()
+        thread.join()
+    handler.close()
+    assert target.messages == [str(i) for i in range(6)]
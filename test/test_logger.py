@@ -1,3 +1,5 @@
+import io
+import os
 import pytest
 import logging
 import inspect
@@ -113,3 +115,441 @@ def test_set_level(logger):
         logger.critical9('LOG', 'TURNED', 'OFF')
 
 
+def test_async_mode(tmpdir):
+    file_name = str(tmpdir.join('async.log'))
+    logger = nl.Logger.create_logger(
+        'async_test',
+        file_name=file_name,
+        stream=None,
+        async_mode=True,
+    )
+    assert isinstance(logger.handlers[0], nl.QueuedHandler)
+    for i in range(1000):
+        logger.info('line', i)
+    logger.flush()
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    assert lines == ['line {}'.format(i) for i in range(1000)]
+    logger.close()
+    assert logger.handlers == []
+
+
+def test_deferred_message():
+    calls = []
+
+    def render(*args):
+        calls.append(args)
+        return ' '.join(args)
+
+    msg = nl.DeferredMessage(render, 'a', 'b')
+    assert not msg.is_rendered()
+    assert str(msg) == 'a b'
+    assert str(msg) == 'a b'
+    assert calls == [('a', 'b')]
+    assert msg.is_rendered()
+
+
+def test_deferred_render(tmpdir):
+    class Probe:
+        renders = 0
+
+        def __repr__(self):
+            Probe.renders += 1
+            return 'probe'
+
+    logger = nl.Logger.create_logger(
+        'deferred_test',
+        level='debug',
+        file_name=[str(tmpdir.join('a.log')), str(tmpdir.join('b.log'))],
+        stream=None,
+    )
+    for handler in logger.handlers:
+        handler.setLevel(nl.INFO)
+    logger.debugpp5({'key': Probe()})
+    assert Probe.renders == 0
+    logger.infopp({'key': Probe()})
+    assert Probe.renders == 1
+    logger.close()
+    for name in ['a.log', 'b.log']:
+        assert tmpdir.join(name).read() == "{'key': probe}\n"
+
+
+def test_cached_threshold():
+    logger = nl.Logger.create_logger('threshold_test', level='info', stream=None)
+    other = nl.Logger('threshold_test')
+    assert not logger.is_enabled_for('debug3')
+    assert logger.is_enabled_for(nl.INFO)
+    with logger.temp_level_scope(nl.DEBUG3):
+        assert logger.is_enabled_for('debug3')
+        assert other.is_enabled_for(nl.DEBUG3)
+    assert not logger.is_enabled_for(nl.DEBUG3)
+    # changes made through the stdlib are picked up too
+    logger.unwrap().setLevel(logging.DEBUG)
+    assert logger.is_enabled_for(nl.DEBUG3)
+    logging.disable(nl.INFO)
+    try:
+        assert not logger.is_enabled_for(nl.INFO)
+        assert logger.is_enabled_for(nl.INFO1)
+    finally:
+        logging.disable(logging.NOTSET)
+    assert logger.is_enabled_for(nl.DEBUG3)
+
+
+def test_delegated_attrs():
+    logger = nl.Logger.create_logger('delegate_test', stream='out')
+    raw_logger = logger.unwrap()
+    assert logger.name == 'delegate_test'
+    assert logger.handlers is raw_logger.handlers
+    assert logger.getEffectiveLevel() == nl.INFO
+    logger.propagate = True
+    assert raw_logger.propagate
+    logger.propagate = False
+    assert not raw_logger.propagate
+    with pytest.raises(AttributeError):
+        logger.no_such_attribute
+
+
+def _last_record(logger):
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.unwrap().addHandler(handler)
+    logger.info('hello')
+    logger.unwrap().removeHandler(handler)
+    return records[-1]
+
+
+def test_capture_caller():
+    logger = nl.Logger.create_logger('caller_test', stream=None)
+    record = _last_record(logger)
+    assert record.filename == 'test_logger.py'
+    assert record.funcName == '_last_record'
+
+    logger.set_capture_caller(False)
+    record = _last_record(logger)
+    assert record.lineno == 0
+    assert record.funcName == '(unknown function)'
+
+    logger = nl.Logger.create_logger('caller_test', stream='out',
+                                     format='{asctime} ', capture_caller='auto')
+    assert _last_record(logger).lineno == 0
+    logger = nl.Logger.create_logger('caller_test', stream='out',
+                                     format='{lineno} ', capture_caller='auto')
+    assert _last_record(logger).funcName == '_last_record'
+
+
+def test_lazy_methods():
+    class MyLogger(nl.Logger):
+        def pp(self, level, *msgs, **kwargs):
+            return 'overridden'
+
+    assert 'infopp3' not in MyLogger.__dict__
+    assert 'infopp3' in dir(MyLogger)
+    logger = MyLogger('lazy_test')
+    assert 'warnfmt' in dir(logger)
+    assert logger.infopp3('x') == 'overridden'
+    assert 'infopp3' in MyLogger.__dict__
+    assert MyLogger.infopp3.__name__ == 'infopp3'
+    assert 'severity INFO3 (level 23)' in inspect.getdoc(logger.infopp3)
+    with pytest.raises(AttributeError):
+        MyLogger.infopp33
+
+    # generated on the base class first, still uses the subclass override
+    nl.Logger.warnpp2
+    assert logger.warnpp2('x') == 'overridden'
+
+
+def test_jsonl(tmpdir):
+    import json
+    file_name = str(tmpdir.join('log.jsonl'))
+    logger = nl.Logger.create_logger('jsonl_test', file_name=file_name,
+                                     stream=None, format='jsonl')
+    logger.info3('hello', {'a': 1})
+    logger.warnfmt('{} miles', 3, extra={'run_id': 'r1'})
+    logger.close()
+    with open(file_name) as f:
+        objs = [json.loads(line) for line in f]
+    assert objs[0]['message'] == "hello {'a': 1}"
+    assert objs[0]['levelname'] == 'INFO3'
+    assert objs[0]['funcName'] == 'test_jsonl'
+    assert objs[1]['message'] == '3 miles'
+    assert objs[1]['run_id'] == 'r1'
+    assert set(nl.Logger.FORMAT_ATTRS) <= set(objs[1])
+
+
+def test_buffered_file_handler(tmpdir):
+    file_name = str(tmpdir.join('buffered.log'))
+    logger = nl.Logger.create_logger('buffered_test', stream=None)
+    logger.add_file_handler(file_name, buffer_bytes=1 << 20,
+                            flush_interval=None, flush_level='critical')
+    assert isinstance(logger.handlers[0], nl.BufferedFileHandler)
+    logger.error('not yet')
+    assert tmpdir.join('buffered.log').read() == ''
+    logger.flush()
+    assert tmpdir.join('buffered.log').read() == 'not yet\n'
+    logger.critical('right away')
+    assert tmpdir.join('buffered.log').read() == 'not yet\nright away\n'
+    logger.close()
+
+
+def test_rotating_file_handlers(tmpdir):
+    file_names = [str(tmpdir.join('a.log')), str(tmpdir.join('b.log'))]
+    logger = nl.Logger.create_logger('rotating_test', stream=None)
+    logger.add_file_handler(file_names, max_bytes=100, keep=1)
+    for i in range(50):
+        logger.info('line', i)
+    logger.close()
+    for file_name in file_names:
+        rotated = [f for f in os.listdir(str(tmpdir))
+                   if f.startswith(os.path.basename(file_name) + '.')]
+        assert len(rotated) == 1 and rotated[0].endswith('.gz')
+        assert open(file_name).read().endswith('line 49\n')
+
+
+def test_flight_recorder():
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('flight_test', stream=stream, level='info')
+    logger.add_flight_recorder(capacity=2)
+    logger.debug('step 1')
+    logger.debug('step 2')
+    logger.debug('step 3')
+    logger.info('info')
+    assert stream.getvalue() == 'info\n'
+    try:
+        1/0
+    except ZeroDivisionError as e:
+        logger.exception('failed', exc=e, level=logging.WARNING)
+    lines = stream.getvalue().splitlines()
+    assert lines[1:5] == ['----- flight recorder: last 2 records -----',
+                          'step 2', 'step 3', '----- flight recorder: end -----']
+    assert lines[5] == 'failed'
+    logger.close()
+
+
+def test_callsite_every_n():
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('every_n_test', stream=stream)
+    rendered = []
+
+    class Rendered:
+        def __str__(self):
+            rendered.append(1)
+            return 'rendered'
+
+    for i in range(10):
+        logger.info('step', i, every_n=4)
+        logger.infofmt('{}', Rendered(), every_n=100)
+    assert stream.getvalue().splitlines() == \
+        ['step 0', 'rendered', 'step 4', 'step 8']
+    # the dropped messages are never rendered
+    assert rendered == [1]
+
+
+def test_callsite_rate_limit(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(nl.logger.time, 'time', lambda: now[0])
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('rate_test', stream=stream)
+    for second in range(3):
+        for i in range(5):
+            logger.warn('second', second, 'call', i, at_most_per_sec=2)
+        now[0] += 1
+    lines = stream.getvalue().splitlines()
+    assert lines[:2] == ['second 0 call 0', 'second 0 call 1']
+    assert lines[2].startswith('nanolog: suppressed 3 records from '
+                               'test_logger.py:')
+    assert lines[2].endswith('in the last 1.0s')
+    assert lines[3:5] == ['second 1 call 0', 'second 1 call 1']
+    assert len(lines) == 8
+
+
+def test_callsite_rate_limit_quiet(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(nl.logger.time, 'time', lambda: now[0])
+    monkeypatch.setattr(nl.logger, '_next_sweep', 0.)
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('rate_quiet_test', stream=stream)
+
+    def flood(n):
+        for i in range(n):
+            logger.warn('flood', i, at_most_per_sec=1)
+
+    flood(5)
+    # reported by the next rate limited call elsewhere once the window closed
+    now[0] += 2
+    logger.info('other', at_most_per_sec=1)
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == 'flood 0'
+    assert lines[1].startswith('nanolog: suppressed 4 records')
+    assert lines[2] == 'other'
+    # and by flush(), even if the window is still open
+    flood(3)
+    logger.flush()
+    lines = stream.getvalue().splitlines()
+    assert lines[3:] == ['flood 0', lines[4]]
+    assert lines[4].startswith('nanolog: suppressed 2 records')
+    logger.close()
+    assert len(stream.getvalue().splitlines()) == 5
+
+
+def test_callsite_sample():
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('sample_test', stream=stream)
+    for i in range(1000):
+        logger.info(i, sample=0.1)
+    for i in range(10):
+        logger.info(i, sample=0)
+    assert 30 < len(stream.getvalue().splitlines()) < 300
+
+
+def test_dedup_handler():
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('dedup_test', stream=None)
+    logger.add_stream_handler(stream, dedup=True, show_level=True)
+    logger.add_stream_handler(io.StringIO())
+    assert isinstance(logger.handlers[0], nl.DedupHandler)
+    assert len(logger.handlers[0].targets) == 1
+    for i in range(100):
+        logger.warn('nan loss')
+    logger.info('done')
+    assert stream.getvalue().splitlines() == [
+        '[WARNING]> nan loss',
+        '[WARNING]> last message repeated 99 times',
+        '[INFO]> done',
+    ]
+    logger.close()
+
+
+def test_streaming_pp(tmpdir):
+    class RecordingStream(io.StringIO):
+        def __init__(self):
+            super().__init__()
+            self.writes = []
+
+        def write(self, text):
+            self.writes.append(len(text))
+            return super().write(text)
+
+    nl.set_pprint_backend('builtin')
+    nl.set_pprint_config(chunk_size=256)
+    file_name = str(tmpdir / 'pp.log')
+    stream = RecordingStream()
+    try:
+        logger = nl.Logger.create_logger(
+            'streaming_pp', stream=stream, file_name=file_name,
+            format='{levelname} ', time_format=None
+        )
+        data = {'rows': [list(range(i, i + 10)) for i in range(500)]}
+        logger.infopp('data:', data, streaming=True)
+        logger.infoppfmt('{0} {1}', 'ppfmt:', data, streaming=True)
+        logger.info('after')
+        logger.flush()
+        expected = ('INFO data: {}\nINFO ppfmt: {}\nINFO after\n'
+                    .format(nl.pprintstr(data), nl.pprintstr(data)))
+        assert stream.getvalue() == expected
+        assert max(stream.writes) < 1024 < len(expected)
+        with open(file_name) as f:
+            assert f.read() == expected
+    finally:
+        nl.set_pprint_config(chunk_size=64 * 1024)
+        nl.set_pprint_backend('thirdparty')
+        logger.remove_all_handlers()
+
+
+def test_async_logger():
+    import time
+    import asyncio
+
+    class SlowStream(io.StringIO):
+        def write(self, text):
+            time.sleep(0.002)
+            return super().write(text)
+
+    stream = SlowStream()
+
+    async def main():
+        logger = nl.AsyncLogger.create_logger('async_logger', stream=stream)
+        assert logger._find_handler(nl.QueuedHandler).overflow == 'drop_oldest'
+        start = time.time()
+        for i in range(50):
+            logger.info3('record', i)
+        # enqueuing doesn't wait for the slow writes
+        assert time.time() - start < 50 * 0.002
+        logger.criticalppfmt('{}', {'key': 'value'})
+        await logger.aflush()
+        assert stream.getvalue().endswith("{'key': 'value'}\n")
+        for i in range(20):
+            logger.warnfmt('last {}', i)
+
+    asyncio.run(main())
+    # flushed when asyncio.run() shut the loop down
+    assert stream.getvalue().endswith('last 19\n')
+
+    # created outside of any loop, every new loop gets watched
+    logger = nl.AsyncLogger('async_logger')
+
+    async def log_in_loop(n):
+        for i in range(20):
+            logger.warnfmt('loop {} {}', n, i)
+
+    for n in range(2):
+        asyncio.run(log_in_loop(n))
+        assert stream.getvalue().endswith('loop {} 19\n'.format(n))
+    with pytest.raises(AssertionError):
+        nl.AsyncLogger('async_logger').configure(overflow='block')
+    nl.Logger('async_logger').remove_all_handlers()
+
+
+def test_thread_buffered_mode(tmpdir):
+    import threading
+    file_name = str(tmpdir / 'threads.log')
+    logger = nl.Logger.create_logger('thread_buffered', stream=None,
+                                     file_name=file_name, async_mode='thread')
+    assert isinstance(logger.handlers[0], nl.ThreadBufferedHandler)
+
+    def write(n):
+        for i in range(50):
+            logger.info(n, i)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.debug('filtered out by the level')
+    logger.flush()
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    assert sorted(lines) == sorted('{} {}'.format(n, i)
+                                   for n in range(4) for i in range(50))
+    logger.close()
+
+
+def test_bind(tmpdir):
+    import json
+    text_name = str(tmpdir.join('bound.log'))
+    json_name = str(tmpdir.join('bound.jsonl'))
+    logger = nl.Logger.create_logger('bind_test', file_name=text_name,
+                                     stream=None)
+    logger.add_file_handler(json_name, format='jsonl')
+    run_log = logger.bind(run_id='r1', worker=3)
+    assert isinstance(run_log, nl.Logger)
+    assert run_log.unwrap() is logger.unwrap()
+    step_log = run_log.bind(step=10, worker=4)
+    run_log.info('start')
+    step_log.infofmt('{} done', 'step', extra={'loss': 0.5})
+    logger.info('unbound')
+    assert _last_record(step_log).funcName == '_last_record'
+    logger.close()
+    with open(text_name) as f:
+        lines = f.read().splitlines()
+    assert lines[:3] == ['run_id=r1 worker=3 start',
+                         'run_id=r1 worker=4 step=10 step done',
+                         'unbound']
+    with open(json_name) as f:
+        objs = [json.loads(line) for line in f][:3]
+    assert objs[0]['run_id'] == 'r1' and objs[0]['worker'] == 3
+    assert objs[1]['worker'] == 4 and objs[1]['step'] == 10
+    assert objs[1]['loss'] == 0.5
+    assert objs[1]['funcName'] == 'test_bind'
+    assert 'context' not in objs[2] and 'run_id' not in objs[2]
@@ -1,4 +1,5 @@
 import sys
+import time
 import nanolog as nl
 import pytest
 
@@ -56,3 +57,224 @@ def test_ppfmt():
            d1, 1/7, d2,
            width=10, depth=3, compact=True)
     nl.ppf('{myd2} myerr {myd2}', myd2=d2, width=35)
+
+
+@pytest.fixture
+def pp_config():
+    yield
+    nl.set_pprint_config(cache_size=0, max_items=None, max_chars=None)
+    nl.set_pprint_backend('thirdparty')
+
+
+def test_pp_cache(pp_config):
+    nl.set_pprint_backend('builtin')
+    nl.set_pprint_config(cache_size=2)
+
+    class Config:
+        def __init__(self):
+            self.version = 0
+            self.formatted = 0
+
+        def __pp_fingerprint__(self):
+            return self.version
+
+        def __repr__(self):
+            self.formatted += 1
+            return 'Config(v{})'.format(self.version)
+
+    config = Config()
+    assert nl.pprintstr(config) == 'Config(v0)'
+    assert nl.pprintstr(config) == 'Config(v0)'
+    assert config.formatted == 1
+    config.version += 1
+    assert nl.pprintstr(config) == 'Config(v1)'
+    assert config.formatted == 2
+    # equal but differently typed values are not mixed up
+    assert nl.pprintstr((1, 2)) == '(1, 2)'
+    assert nl.pprintstr((1.0, True)) == '(1.0, True)'
+    # mutable objects are never cached
+    data = [1]
+    assert nl.pprintstr(data) == '[1]'
+    data.append(2)
+    assert nl.pprintstr(data) == '[1, 2]'
+    assert len(nl.printing._pp_cache) == 2
+
+
+@pytest.mark.parametrize('backend', ['builtin', 'thirdparty'])
+def test_pp_max_items(pp_config, backend):
+    nl.set_pprint_backend(backend)
+    nl.set_pprint_config(max_items=3)
+    data = {'a': list(range(100)), 'b': tuple(range(3))}
+    original = {'a': list(range(100)), 'b': tuple(range(3))}
+    text = nl.pprintstr(data, width=200)
+    assert '[0, 1, 2, ...(97 more)]' in text
+    assert '(0, 1, 2)' in text
+    assert data == original
+    text = nl.pprintstr({'s': set(range(10)), 'f': frozenset(range(10)),
+                         'd': {str(i): i for i in range(10)}}, width=200)
+    assert '{0, 1, 2, ...(7 more)}' in text
+    assert 'frozenset(' in text
+    assert text.index("'2': 2") < text.index('...: ...(7 more)')
+
+
+def test_pp_max_chars(pp_config):
+    nl.set_pprint_backend('builtin')
+    nl.set_pprint_config(max_chars=200)
+    data = [list(range(1000)) for _ in range(1000)]
+    text = nl.pprintstr(data)
+    assert len(text) <= 203
+    assert text.endswith('...(999 more)]')
+
+
+class FakeArray:
+    "ndarray-like: shape, dtype, ndim and vectorized reductions"
+    dtype = 'float32'
+
+    def __init__(self, values, shape):
+        self.values = values
+        self._shape = shape
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def min(self):
+        return min(self.values)
+
+    def max(self):
+        return max(self.values)
+
+    def mean(self):
+        return sum(self.values) / len(self.values)
+
+    def reshape(self, *shape):
+        return self.values
+
+    def __repr__(self):
+        raise AssertionError('full repr should not be called')
+
+
+@pytest.mark.parametrize('backend', ['builtin', 'thirdparty'])
+def test_pp_array_summary(pp_config, backend):
+    nl.set_pprint_backend(backend)
+    arr = FakeArray([float(i) for i in range(1000)], (10, 100))
+    assert nl.pprintstr(arr) == (
+        'FakeArray(shape=(10, 100), dtype=float32, min=0, max=999, '
+        'mean=499.5, [0, 1, 2, ..., 997, 998, 999])'
+    )
+    text = nl.pprintstr({'batch': arr, 'step': 3}, width=200)
+    assert "'batch': FakeArray(shape=(10, 100)" in text
+
+
+def test_pp_not_array_like(pp_config):
+    from unittest import mock
+
+    class BrokenArray(FakeArray):
+        def __repr__(self):
+            return '<broken>'
+
+    proxy = mock.Mock()
+    assert nl.pprintstr({'a': proxy}) == "{{'a': {!r}}}".format(proxy)
+    arr = BrokenArray(['a', 'b'] * 10, None)  # the summary fails on shape
+    assert nl.pprintstr([arr]) == '[<broken>]'
+
+
+def test_pp_formatter_registry(pp_config):
+    nl.set_pprint_backend('builtin')
+
+    class Tensor:
+        pass
+
+    class SubTensor(Tensor):
+        pass
+
+    nl.register_pprint_formatter(Tensor, lambda t: '<tensor>')
+    try:
+        assert nl.pprintstr([SubTensor()]) == '[<tensor>]'
+        name = '{}.{}'.format(Tensor.__module__, Tensor.__qualname__)
+        nl.register_pprint_formatter(Tensor, None)
+        nl.register_pprint_formatter(name, lambda t: '<by name>')
+        assert nl.pprintstr(SubTensor()) == '<by name>'
+        nl.register_pprint_formatter(name, None)
+        assert nl.pprintstr(SubTensor()).startswith('<')
+        assert 'SubTensor object' in nl.pprintstr(SubTensor())
+    finally:
+        nl.register_pprint_formatter(Tensor, None)
+
+
+def test_pp_numpy(pp_config):
+    np = pytest.importorskip('numpy')
+    nl.set_pprint_backend('builtin')
+    text = nl.pprintstr(np.arange(10000, dtype=np.float64).reshape(100, 100))
+    assert text == ('ndarray(shape=(100, 100), dtype=float64, min=0, max=9999, '
+                    'mean=5000, [0, 1, 2, ..., 9997, 9998, 9999])')
+    assert nl.pprintstr(np.arange(3)) == 'array([0, 1, 2])'
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(width=80), dict(width=20, indent=4), dict(width=30, compact=True),
+    dict(width=10, depth=2),
+])
+def test_iter_pprintstr(pp_config, kwargs):
+    import pprint
+    nl.set_pprint_backend('builtin')
+    data = {
+        'nested': [{'id': i, 'tags': ('a', 'b'), 'ids': {i, i + 1}}
+                   for i in range(20)],
+        'empty': [[], (), {}, set(), frozenset()],
+        'single': (1,),
+        3: frozenset(range(12)),
+    }
+    data['self'] = [data['single'], data['nested'][0]]
+    data['self'].append(data['self'])
+    expected = pprint.pformat(data, **kwargs)
+    chunks = list(nl.iter_pprintstr(data, chunk_size=64, **kwargs))
+    assert ''.join(chunks) == expected
+    assert len(chunks) > 1
+    assert max(map(len, chunks)) < 64 + 80
+    assert ''.join(nl.iter_pprintstr('s', data, 7, sep='|', **kwargs)) == \
+        nl.pprintstr('s', data, 7, sep='|', **kwargs)
+
+
+def test_iter_pprintfmtstr(pp_config):
+    nl.set_pprint_backend('builtin')
+    nl.set_pprint_config(max_items=5)
+    data = {'values': list(range(1000)), 'name': 'x'}
+    args = ('{0} and {1:.2f}, {data!s:>10} {0:{w}}',
+            data, 1/3)
+    kwargs = dict(data={'name': 'n'}, w=5)
+    assert ''.join(nl.iter_pprintfmtstr(*args, chunk_size=4, **kwargs)) == \
+        nl.pprintfmtstr(*args, **kwargs)
+
+
+def test_time2str_cache(monkeypatch):
+    from nanolog import printing
+    assert nl.get_time_formatter('YMD HMS') == '%y-%m-%d %H:%M:%S'
+    assert nl.get_time_formatter('YMD HMS') is nl.get_time_formatter('YMD HMS')
+    now = [1500000000.25]
+    calls = []
+    strftime = time.strftime
+    monkeypatch.setattr(printing.time, 'time', lambda: now[0])
+    monkeypatch.setattr(printing.time, 'strftime',
+                        lambda *args: calls.append(args) or strftime(*args))
+    expected = strftime('%H:%M:%S', time.localtime(now[0]))
+    assert nl.time2str('HMS') == expected
+    now[0] += 0.5
+    assert nl.time2str('HMS') == expected
+    assert len(calls) == 1
+    assert nl.time2str('%H:%M:%S.%f') == expected + '.750000'
+    now[0] += 0.5
+    assert nl.time2str('HMS') == strftime('%H:%M:%S', time.localtime(now[0]))
+    assert len(calls) == 3
+    assert nl.time2str('%%f%f') == '%f250000'
+
+
+def test_monotonic_time():
+    assert abs(nl.monotonic_time() - time.time()) < 1
+    stamps = [nl.monotonic_time() for _ in range(100)]
+    assert stamps == sorted(stamps)
+    assert len(nl.time2str('%H:%M:%S.%f', monotonic=True)) == len('00:00:00.000000')
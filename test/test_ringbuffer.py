@@ -0,0 +1,97 @@
+import os
+import multiprocessing
+import nanolog as nl
+import nanolog.__main__
+import pytest
+
+
+@pytest.fixture
+def ring(tmpdir):
+    logger = nl.Logger.create_logger('ring_test', stream=None)
+    file_name = str(tmpdir.join('test.ring'))
+    logger.add_ring_buffer_handler(file_name, capacity=1024)
+    yield logger, file_name
+    logger.close()
+
+
+def test_ring_drain(ring):
+    logger, file_name = ring
+    reader = nl.RingBufferReader(file_name)
+    assert reader.drain() == []
+    logger.info('first', 1)
+    logger.warnfmt('{} {:.1f}', 'second', 2.)
+    records = reader.drain()
+    assert [r.getMessage() for r in records] == ['first 1', 'second 2.0']
+    assert records[0].funcName == 'test_ring_drain'
+    assert records[1].levelname == 'WARNING'
+    assert records[0].process == os.getpid()
+    assert reader.drain() == []
+    reader.close()
+
+
+def test_ring_overwrite(ring):
+    logger, file_name = ring
+    reader = nl.RingBufferReader(file_name)
+    logger.info('before')
+    assert len(reader.drain()) == 1
+    for i in range(200):
+        logger.info('message', i)
+    records = reader.drain()
+    stats = reader.stats()
+    assert stats['head_seq'] == 201
+    assert stats['wraps'] > 1
+    # every record is either drained or accounted for
+    assert reader.lost + len(records) == 200
+    assert reader.lost == stats['tail_seq'] - 1
+    assert records[-1].getMessage() == 'message 199'
+    messages = [r.getMessage() for r in records]
+    assert messages == ['message {}'.format(i)
+                        for i in range(200 - len(records), 200)]
+    # a new reader picks up the stored position
+    reader.close()
+    reader = nl.RingBufferReader(file_name)
+    assert reader.drain() == []
+    assert reader.lost == 200 - len(records)
+    reader.close()
+
+
+def test_ring_closed(tmpdir):
+    file_name = str(tmpdir.join('closed.ring'))
+    handler = nl.RingBufferHandler(file_name, capacity=1024)
+    logger = nl.Logger.create_logger('ring_closed_test', stream=None)
+    logger.logger.addHandler(handler)
+    logger.info('kept')
+    handler.close()
+    # a record for a closed ring is dropped, not raised to the caller
+    logger.info('dropped')
+    reader = nl.RingBufferReader(file_name)
+    assert [r.getMessage() for r in reader.drain()] == ['kept']
+    reader.close()
+    logger.remove_all_handlers()
+
+
+def _crashing_writer(file_name):
+    logger = nl.Logger.create_logger('crashed', stream=None)
+    logger.add_ring_buffer_handler(file_name, capacity=1024)
+    for i in range(30):
+        logger.error('last words', i)
+    os._exit(1)
+
+
+def test_ring_post_mortem(tmpdir, capsys):
+    file_name = str(tmpdir.join('crash.ring'))
+    proc = multiprocessing.Process(target=_crashing_writer, args=(file_name,))
+    proc.start()
+    proc.join()
+    # as if the writer died in the middle of a record
+    with open(file_name, 'r+b') as f:
+        f.seek(nl.ringbuffer._VERSION)
+        f.write((61).to_bytes(8, 'little'))
+    reader = nl.RingBufferReader(file_name, readonly=True)
+    records = reader.snapshot()
+    assert records[-1].getMessage() == 'last words 29'
+    assert records[-1].process == proc.pid
+    reader.close()
+    nanolog.__main__.main(['drain', '--snapshot', '--hide-level',
+                           '-f', '{name} ', file_name])
+    assert capsys.readouterr().out.endswith('crashed last words 29\n')
@@ -0,0 +1,80 @@
+import io
+import json
+import random
+import pytest
+import nanolog as nl
+
+
+def test_quantile_sketch():
+    random.seed(0)
+    values = [random.lognormvariate(10, 2) for _ in range(20000)] + [0] * 100
+    sketch = nl.QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    values.sort()
+    for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+        exact = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.011)
+    assert sketch.quantile(0) == 0
+    assert len(sketch._buckets) < 2000
+    assert nl.QuantileSketch().quantile(0.5) is None
+
+
+@pytest.fixture
+def span_logger():
+    stream = io.StringIO()
+    logger = nl.Logger.create_logger('spans', stream=stream, level='debug')
+    logger.stream = stream
+    yield logger
+    logger.remove_all_handlers()
+
+
+def test_span(span_logger):
+    registry = nl.SpanRegistry()
+    with span_logger.span('block', registry=registry) as span:
+        pass
+    assert span.duration_ns > 0
+
+    @span_logger.span('func', level='info', registry=registry)
+    def func(x):
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    assert [func(i) for i in range(10)] == list(range(0, 20, 2))
+    with pytest.raises(ValueError):
+        func(-1)
+    with span_logger.span('silent', level=None, registry=registry):
+        pass
+    lines = span_logger.stream.getvalue().splitlines()
+    assert len(lines) == 12
+    assert lines[0].startswith('block took ')
+    assert lines[-1].startswith('func took ') and '(raised ValueError)' in lines[-1]
+
+    stats = registry.stats()
+    assert list(stats) == ['block', 'func', 'silent']
+    func_stats = stats['func']
+    assert func_stats['count'] == 11
+    assert func_stats['min_ms'] <= func_stats['p50_ms'] <= func_stats['p99_ms'] \
+        <= func_stats['max_ms']
+    assert func_stats['total_ms'] == pytest.approx(11 * func_stats['mean_ms'])
+    assert json.loads(registry.to_json(reset=True))['func']['count'] == 11
+    assert registry.stats() == {}
+
+
+def test_span_report(span_logger, monkeypatch):
+    registry = nl.SpanRegistry()
+    now = [1000.0]
+    monkeypatch.setattr(nl.logger.time, 'monotonic', lambda: now[0])
+    span_logger.set_span_report(10, registry=registry)
+    with span_logger.span('step', level=None, registry=registry):
+        pass
+    assert span_logger.stream.getvalue() == ''
+    now[0] += 11
+    with span_logger.span('step', level=None, registry=registry):
+        pass
+    text = span_logger.stream.getvalue()
+    assert 'span stats' in text and "'count': 2" in text
+    # reset after the report
+    assert registry.stats() == {}
+    span_logger.set_span_report(None)